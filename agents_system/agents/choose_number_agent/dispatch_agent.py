@@ -1,13 +1,23 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import os
 
-from typing import Any, List, Dict
+from typing import Any, List, Dict, Optional
 from pydantic import BaseModel
 from fastapi import APIRouter
-from jinja2 import Template
 
+from agents_system.config.settings import settings
 from agents_system.core.base_agent import BaseAgent
+from agents_system.core.registry import registry
+from agents_system.core.template_registry import template_registry
 from agents_system.models.doubao import DoubaoModel, logger
+from agents_system.models.pre_router import PreRouter, RouteRule
+
+
+# 本地路由规则：询问是否还有补充后，用户明确表示没有补充 → 2
+ROUTE_RULES = [
+    RouteRule("2", r"还有其他补充", r"^(没有|没有了|没了|无|无其他补充|没有其他补充|没有补充|暂无|暂时没有)[。！!～~]*$"),
+]
 
 
 class DispatchRequest(BaseModel):
@@ -35,11 +45,23 @@ class DispatchResponse(BaseModel):
 class DispatchAgent(BaseAgent):
     """对话统筹与路由判断智能体"""
 
-    def __init__(self):
+    def __init__(self, doubao_client: Optional[DoubaoModel] = None, use_cache: bool = True,
+                 pre_router: Optional[PreRouter] = None, streaming: Optional[bool] = None,
+                 max_tokens: Optional[int] = None, stop: Optional[List[str]] = None):
         super().__init__(name="DispatchAgent")
         self.name = "对话统筹与路由判断智能体"
         self.description = "负责依据对话上下文和当前博主消息，精准输出单个三位码用于路由"
-        self.doubao_client = DoubaoModel()
+        self.doubao_client = doubao_client or registry.get_model()
+        self.use_cache = use_cache
+        if pre_router is None and settings.PRE_ROUTER_ENABLED:
+            pre_router = PreRouter.from_settings("choose_number", ROUTE_RULES)
+        self.pre_router = pre_router
+        self.streaming = settings.DISPATCH_STREAMING if streaming is None else streaming
+        max_tokens = settings.DISPATCH_MAX_TOKENS if max_tokens is None else max_tokens
+        stop = settings.DISPATCH_STOP if stop is None else stop
+        self.generation_params: Dict[str, Any] = {
+            key: value for key, value in (("max_tokens", max_tokens), ("stop", stop)) if value
+        }
         # self._setup_routes()
 
     def _setup_routes(self) -> None:
@@ -59,15 +81,33 @@ class DispatchAgent(BaseAgent):
             conversations = data.get("conversations", [])
             user_input = next((m.get('content') for m in reversed(conversations) if m.get('role') == "user"), "")
 
+            # 本地前置路由，置信度足够时直接返回
+            local_code = None
+            if self.pre_router is not None:
+                local_code, confidence, source = self.pre_router.predict(conversations)
+                if local_code is not None:
+                    logger.info(f"本地路由命中({source}), 路由码: {local_code}, 置信度: {confidence:.3f}")
+                    if not self.pre_router.should_shadow():
+                        return {
+                            "route_code": local_code,
+                            "success": True,
+                            "message": "路由判断成功"
+                        }
+
             # 构建提示词
             prompt = self._build_prompt(conversations, user_input)
 
             # 调用大模型进行路由判断
-            response = await self.doubao_client.generate_text(prompt)
+            response = await self._generate_route(prompt)
 
             # 提取路由码
             route_code = self._extract_route_code(response)
 
+            if self.pre_router is not None:
+                if local_code is not None:
+                    self.pre_router.record_shadow(local_code, route_code)
+                await self.pre_router.record(conversations, route_code)
+
             logger.info(f"路由判断完成, 路由码: {route_code}")
 
             return {
@@ -92,16 +132,10 @@ class DispatchAgent(BaseAgent):
         :return: 构建的提示词
         """
         try:
-            # 读取 prompt 模板文件
-            import os
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            prompt_file = os.path.join(current_dir, "dispatch.txt")
-            
-            with open(prompt_file, 'r', encoding='utf-8') as f:
-                prompt_template = Template(f.read())
-            # 替换模板中的占位符
-
-            prompt = prompt_template.render(
+            # 从模板注册表获取已编译的模板并替换占位符
+            prompt_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dispatch.txt")
+            prompt = template_registry.render_file(
+                prompt_file,
                 conversations=conversations,
                 user_input=user_input
             )
@@ -112,6 +146,29 @@ class DispatchAgent(BaseAgent):
         except Exception as e:
             logger.error(f"读取 dispatch.txt 文件失败: {str(e)}")
 
+    async def _generate_route(self, prompt: str) -> str:
+        """
+        调用大模型生成路由判断
+
+        流式模式下出现第一个有效路由码即断开响应流；流式调用失败时退回非流式调用（带重试）。
+
+        :param prompt: 路由判断提示词
+        :return: 模型响应
+        """
+        if self.streaming:
+            try:
+                return await self.doubao_client.generate_text_until(
+                    prompt, self._has_route_code, cache=self.use_cache, **self.generation_params
+                )
+            except Exception as e:
+                logger.warning(f"流式路由判断失败, 改用非流式调用: {str(e)}")
+        return await self.doubao_client.generate_text(prompt, cache=self.use_cache, **self.generation_params)
+
+    @staticmethod
+    def _has_route_code(text: str) -> bool:
+        """判断已生成的文本中是否已出现有效路由码"""
+        return any(char in ['1', '2', '3'] for char in text)
+
     def _extract_route_code(self, response: str) -> str:
         """
         从模型响应中提取路由码
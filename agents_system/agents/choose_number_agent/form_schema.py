@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from typing import Any, Dict, List, Optional
+
+
+# 通用表头，与 save.txt 中列出的字段保持一致
+_COMMON_FIELDS = [
+    "品牌/产品名称", "产品品类", "投放总预算", "预算要求", "推广周期", "投放形式", "折扣要求",
+    "创作方向", "账号类型", "数据要求", "目标人群/粉丝画像",
+]
+_TAIL_FIELDS = ["排竞要求", "对标案例链接", "特殊权益要求 / 其他要求"]
+
+# 各模板类型允许的字段
+FORM_SCHEMAS: Dict[str, List[str]] = {
+    "通用": _COMMON_FIELDS + _TAIL_FIELDS,
+    "家居": _COMMON_FIELDS + _TAIL_FIELDS,
+    "母婴": _COMMON_FIELDS + ["小孩/宝宝性别年龄要求"] + _TAIL_FIELDS,
+    "美食": _COMMON_FIELDS + ["是否需要探店"] + _TAIL_FIELDS,
+    "时尚鞋服": _COMMON_FIELDS + ["是否需要探店", "排竞要求", "是否需要外景拍摄", "对标案例链接", "特殊权益要求 / 其他要求"],
+    "美妆护肤": _COMMON_FIELDS + ["是否有肤质要求"] + _TAIL_FIELDS,
+}
+
+TEMPLATE_TYPE_FIELD = "模板类型"
+
+
+def validate_form(form: Dict[str, Any], previous: Optional[Dict[str, Any]] = None) -> List[str]:
+    """
+    按模板类型校验表单
+
+    模板由对话确定，表单可以包含模板表头以外的新字段（如品牌名称、内容方向、稿件数量）；
+    所有字段的值都必须为字符串或数字。模板类型必须为 FORM_SCHEMAS 中的类型，
+    更新前表单已使用的未知模板类型可以保留，但不能改为新的未知类型。
+
+    :param form: 待校验的表单
+    :param previous: 更新前的表单
+    :return: 错误列表，为空表示校验通过
+    """
+    if not form:
+        return []
+    errors = []
+    template_type = form.get(TEMPLATE_TYPE_FIELD)
+    if template_type is not None:
+        if not isinstance(template_type, str) or not template_type.strip():
+            errors.append(f"模板类型无效: {template_type}")
+        elif template_type not in FORM_SCHEMAS and template_type != (previous or {}).get(TEMPLATE_TYPE_FIELD):
+            errors.append(f"未知的模板类型: {template_type}")
+
+    for key, value in form.items():
+        if key != TEMPLATE_TYPE_FIELD and (not isinstance(value, (str, int, float)) or isinstance(value, bool)):
+            errors.append(f"字段值必须为字符串或数字: {key}")
+    return errors
@@ -1,12 +1,14 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-from typing import List, Dict
+from typing import List, Dict, Optional
 from pydantic import BaseModel
 from fastapi import APIRouter
 
+from agents_system.config.settings import settings
 from agents_system.core.base_agent import BaseAgent
+from agents_system.core.registry import registry
 from agents_system.models.doubao import DoubaoModel, logger
-from agents_system.utils.similarity_retrieve_json import search_similar_in_group
+from agents_system.utils.similarity_retrieve_json import format_qa_reference, search_hybrid, search_similar_in_group
 
 
 class GlobalQARequest(BaseModel):
@@ -37,11 +39,12 @@ class GlobalQAResponse(BaseModel):
 class GlobalQAgent(BaseAgent):
     """选号需求填写智能体"""
 
-    def __init__(self):
+    def __init__(self, doubao_client: Optional[DoubaoModel] = None):
         super().__init__(name="GlobalQAAgent")
         self.name = "全局QA智能体"
         self.description = "负责回答用户提出的一系列问题"
-        self.doubao_client = DoubaoModel()
+        self.doubao_client = doubao_client or registry.get_model()
+        self.stats = {"calls": 0, "direct_lexical": 0, "direct_vector": 0, "generated": 0}
         # self._setup_routes()
 
     def _setup_routes(self) -> None:
@@ -60,17 +63,32 @@ class GlobalQAgent(BaseAgent):
         try:
             conversations = data.conversations
             user_input = next((m.get('content') for m in reversed(conversations) if m.get('role') == "user"), "")
-            info = await search_similar_in_group(query=user_input, group_uuid="b51a2fef-d824-4b2a-a868-a69fac7eab69")
-            # 构建提示词
-            prompt = f"""
+            group_uuid = "b51a2fef-d824-4b2a-a868-a69fac7eab69"
+            self.stats["calls"] += 1
+            if settings.QA_DIRECT_ANSWER_ENABLED:
+                retrieval = await search_hybrid(query=user_input, group_uuid=group_uuid)
+                info = format_qa_reference(retrieval["results"]) if retrieval["results"] else []
+            else:
+                retrieval = {"direct": None}
+                info = await search_similar_in_group(query=user_input, group_uuid=group_uuid)
+
+            if retrieval["direct"] is not None:
+                # 知识库中有相同的问题，直接使用其答案，不调用大模型生成
+                self.stats[f"direct_{retrieval['source']}"] += 1
+                answer = retrieval["direct"]["answer"]
+                logger.info(f"全局QA命中知识库问题({retrieval['source']}): {retrieval['direct']['question'][:50]}")
+            else:
+                # 构建提示词
+                prompt = f"""
             背景信息: {info}
             用户问题: {user_input}
             请你只根据这些背景信息回答用户问题，你不可以自由发挥，你的语气要温和耐心，模仿背景信息回答的语气来回答，回答尽可能简略一些，
             如果你无法回答这个问题或者这个问题和背景信息没有关系，请你只输出一个大写字母N,不要输出任何多余的内容
             """
 
-            # 调用大模型生成回复
-            answer = await self.doubao_client.generate_text(prompt)
+                # 调用大模型生成回复
+                self.stats["generated"] += 1
+                answer = await self.doubao_client.generate_text(prompt)
 
             logger.info(f"全局QA智能体完成，用户输入: {user_input[:50]}...")
             reference = ""
@@ -1,12 +1,17 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import os
 import json
-from typing import Any, List, Dict
+from typing import Any, List, Dict, Optional
 from pydantic import BaseModel
 from fastapi import APIRouter
-from jinja2 import Template
+from agents_system.agents.choose_number_agent.form_schema import validate_form
+from agents_system.config.settings import settings
 from agents_system.core.base_agent import BaseAgent
+from agents_system.core.registry import registry
+from agents_system.core.template_registry import template_registry
 from agents_system.models.doubao import DoubaoModel, logger
+from agents_system.utils.form_patch import FormPatchError, apply_form_patch
 
 
 class SaveRequest(BaseModel):
@@ -36,11 +41,16 @@ class SaveResponse(BaseModel):
 class SaveAgent(BaseAgent):
     """表单信息识别与更新智能体"""
     
-    def __init__(self):
+    def __init__(self, doubao_client: Optional[DoubaoModel] = None, use_cache: bool = True,
+                 patch_mode: Optional[bool] = None):
         super().__init__(name="SaveAgent")
         self.name = "表单信息识别与更新智能体"
         self.description = "专门负责识别聊天记录中表单信息并更新表单的系统"
-        self.doubao_client = DoubaoModel()
+        self.doubao_client = doubao_client or registry.get_model()
+        self.use_cache = use_cache
+        # 增量模式：模型只输出变化字段（Merge Patch / JSON Patch），在本地应用并按模板类型校验
+        self.patch_mode = settings.SAVE_PATCH_MODE if patch_mode is None else patch_mode
+        self.patch_stats = {"applied": 0, "rejected": 0}
         # self._setup_routes()
     
     def _setup_routes(self) -> None:
@@ -64,17 +74,24 @@ class SaveAgent(BaseAgent):
             prompt = self._build_prompt(conversations, json.dumps(current_form))
             
             # 调用大模型进行表单更新
-            response = await self.doubao_client.generate_text(prompt)
+            response = await self.doubao_client.generate_text(prompt, cache=self.use_cache)
             
             # 处理响应
-            updated_form = self._process_response(response)
+            updated_form = self.apply_output(current_form, self._process_response(response))
             
             return {
-                "updated_form": updated_form if updated_form != {} else current_form,
+                "updated_form": updated_form,
                 "success": True,
                 "message": "表单信息识别与更新成功"
             }
             
+        except FormPatchError as e:
+            logger.warning(f"表单增量无效, 已拒绝: {str(e)}")
+            return {
+                "updated_form": current_form,
+                "success": False,
+                "message": f"表单增量无效: {str(e)}"
+            }
         except Exception as e:
             logger.error(f"表单信息识别与更新失败: {str(e)}")
             return {
@@ -92,16 +109,11 @@ class SaveAgent(BaseAgent):
         :return: 构建的提示词
         """
         try:
-            # 读取 prompt 模板文件
-            import os
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            prompt_file = os.path.join(current_dir, "save.txt")
-            
-            with open(prompt_file, 'r', encoding='utf-8') as f:
-                prompt_template = Template(f.read())
-            
-            # 替换模板中的占位符
-            prompt = prompt_template.render(
+            # 从模板注册表获取已编译的模板并替换占位符
+            prompt_name = "save_patch.txt" if self.patch_mode else "save.txt"
+            prompt_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), prompt_name)
+            prompt = template_registry.render_file(
+                prompt_file,
                 conversations=conversations,
                 form=current_form
             )
@@ -111,7 +123,31 @@ class SaveAgent(BaseAgent):
         except Exception as e:
             logger.error(f"读取 save.txt 文件失败: {str(e)}")
 
-    def _process_response(self, response: str) -> Dict[str, Any]:
+    def apply_output(self, current_form: Dict[str, Any], output: Any) -> Dict[str, Any]:
+        """
+        将模型输出应用到当前表单
+
+        :param current_form: 当前表单
+        :param output: 模型输出的完整表单或表单增量，无更新时为空
+        :return: 更新后的表单
+        :raises FormPatchError: 增量模式下增量无法应用或应用后不符合模板类型要求
+        """
+        if not self.patch_mode:
+            return output if output else current_form
+
+        current_form = current_form or {}
+        try:
+            updated_form = apply_form_patch(current_form, output or None)
+            errors = validate_form(updated_form, current_form)
+            if errors:
+                raise FormPatchError("; ".join(errors))
+        except FormPatchError:
+            self.patch_stats["rejected"] += 1
+            raise
+        self.patch_stats["applied"] += 1
+        return updated_form
+
+    def _process_response(self, response: str) -> Any:
         """
         处理模型响应
         
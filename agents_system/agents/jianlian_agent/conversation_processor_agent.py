@@ -1,14 +1,19 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 from pydantic import BaseModel
 from fastapi import APIRouter
-from jinja2 import Template
+from fastapi.responses import StreamingResponse
 from tqdm.asyncio import tqdm
 
 from agents_system.agents.jianlian_agent.conversation_processor_prompt import CONVERSATION_PROCESS
+from agents_system.config.settings import settings
 from agents_system.core.base_agent import BaseAgent
+from agents_system.core.batch_stream import ndjson_events
+from agents_system.core.record_store import RecordDeduplicator, prompt_version
+from agents_system.core.registry import registry
+from agents_system.core.template_registry import template_registry
 from agents_system.models.doubao import DoubaoModel, logger
 
 
@@ -17,8 +22,10 @@ class ConversationProcessRequest(BaseModel):
     对话处理请求模型
 
     :param conversations: 包含多个字典的列表，每个字典包含'小红书昵称'和'聊天记录'字段
+    :param concurrency: 流式接口的并发数，为空时使用配置 BATCH_STREAM_CONCURRENCY
     """
     conversations: List[Dict[str, str]]
+    concurrency: Optional[int] = None
 
 
 class ConversationProcessResponse(BaseModel):
@@ -37,17 +44,22 @@ class ConversationProcessResponse(BaseModel):
 class ConversationProcessorAgent(BaseAgent):
     """对话内容处理智能体（多线程并发版本）"""
 
-    def __init__(self):
+    def __init__(self, doubao_client: Optional[DoubaoModel] = None):
         super().__init__(name="ConversationProcessorAgent")
         self.name = "对话内容处理智能体"
         self.description = "负责处理包含多个字典的列表，对每个字典中的聊天记录字段进行大模型处理"
-        self.doubao_client = DoubaoModel()
+        self.doubao_client = doubao_client or registry.get_model()
+        # 按内容哈希去重，相同聊天记录只生成一次
+        self.deduplicator = RecordDeduplicator(
+            prompt_version(CONVERSATION_PROCESS, self.doubao_client.model_name)
+        ) if settings.RECORD_DEDUP_ENABLED else None
         self._setup_routes()
 
     def _setup_routes(self) -> None:
         """设置路由"""
         router = APIRouter(prefix=f"/{self.__class__.__name__.lower().replace('agent', '')}")
         router.post("/process-conversation", response_model=ConversationProcessResponse)(self.process_conversation_route)
+        router.post("/process-conversation-stream")(self.process_conversation_stream_route)
         self.router = router
 
     async def process(self, data: dict[str, Any]) -> dict[str, Any]:
@@ -89,11 +101,9 @@ class ConversationProcessorAgent(BaseAgent):
                     processed_results[i] = f"内容生成失败: {str(result)[:100]}"
 
             # 构建结果列表，保持原数据结构
-            processed_conversations = []
-            for i, conversation in enumerate(conversations):
-                processed_conversation = conversation.copy()
-                processed_conversation["聊天记录"] = processed_results[i] or "处理失败"
-                processed_conversations.append(processed_conversation)
+            processed_conversations = [
+                self._merge_result(conversation, processed_results[i]) for i, conversation in enumerate(conversations)
+            ]
 
             logger.info(f"异步并发对话处理完成，成功处理了 {len(processed_conversations)} 条聊天记录")
 
@@ -111,28 +121,82 @@ class ConversationProcessorAgent(BaseAgent):
                 "message": f"异步并发对话处理失败: {str(e)}"
             }
 
-    async def _process_single_conversation(self, chat_content: str) -> str:
+    async def process_stream(self, conversations: List[Dict[str, str]], concurrency: Optional[int] = None):
+        """
+        流式处理对话内容，每条对话处理完成即产出 NDJSON 行
+
+        :param conversations: 对话列表
+        :param concurrency: 并发数，为空时使用配置 BATCH_STREAM_CONCURRENCY
+        :return: NDJSON 行的异步迭代器
+        """
+        async def generate(index: int, conversation: Dict[str, str]) -> Dict[str, Any]:
+            return {"conversation": await self.process_record(conversation)}
+
+        concurrency = min(concurrency or settings.BATCH_STREAM_CONCURRENCY, settings.BATCH_STREAM_MAX_CONCURRENCY)
+        logger.info(f"开始流式处理 {len(conversations)} 条聊天记录，并发数 {concurrency}")
+        async for line in ndjson_events(conversations, generate, concurrency):
+            yield line
+
+    async def process_record(self, conversation: Dict[str, str], raise_errors: bool = False) -> Dict[str, str]:
+        """
+        处理单条对话并返回聊天记录替换为生成内容的结果（批量任务的单条处理入口）
+
+        :param conversation: 包含'小红书昵称'和'聊天记录'字段的对话
+        :param raise_errors: 模型调用失败时抛出异常（由调用方重试），否则写入失败原因
+        :return: 处理后的对话
+        """
+        result = await self._process_single_conversation(conversation.get("聊天记录", ""), raise_errors)
+        return self._merge_result(conversation, result)
+
+    @staticmethod
+    def _merge_result(conversation: Dict[str, str], result: str) -> Dict[str, str]:
+        """
+        保持原数据结构，聊天记录字段替换为生成内容
+
+        :param conversation: 原始对话
+        :param result: 生成的对话内容
+        :return: 处理后的对话
+        """
+        processed_conversation = conversation.copy()
+        processed_conversation["聊天记录"] = result or "处理失败"
+        return processed_conversation
+
+    async def _process_single_conversation(self, chat_content: str, raise_errors: bool = False) -> str:
         """
         处理单个对话内容（异步方法）
 
         :param chat_content: 原始聊天记录内容
+        :param raise_errors: 模型调用失败时抛出异常，否则返回生成失败内容
         :return: 生成的对话内容
         """
         if not chat_content or not chat_content.strip():
             return "有信息缺失，无法识别"
 
         try:
-            # 构建提示词
-            prompt = self._build_prompt(chat_content)
-
-            # 异步调用大模型
-            generated_content = await self.doubao_client.generate_text(prompt)
-            return generated_content.strip()
+            if self.deduplicator is not None:
+                return await self.deduplicator.get_or_compute(chat_content, self._call_model)
+            return await self._call_model(chat_content)
 
         except Exception as e:
             logger.error(f"处理单个对话时出错: {str(e)}")
+            if raise_errors:
+                raise
             return f"内容生成失败: {str(e)[:100]}"
 
+    async def _call_model(self, chat_content: str) -> str:
+        """
+        调用大模型生成对话内容，调用失败时抛出异常
+
+        :param chat_content: 原始聊天记录内容
+        :return: 生成的对话内容
+        """
+        # 构建提示词
+        prompt = self._build_prompt(chat_content)
+
+        # 异步调用大模型
+        generated_content = await self.doubao_client.generate_text(prompt, pool="batch")
+        return generated_content.strip()
+
     @staticmethod
     def _build_prompt(chat_content: str) -> str:
         """
@@ -141,9 +205,7 @@ class ConversationProcessorAgent(BaseAgent):
         :param chat_content: 原始聊天记录内容
         :return: 构建的提示词
         """
-        conversation_processor_prompt = Template(CONVERSATION_PROCESS)
-        prompt = conversation_processor_prompt.render(chat_content=chat_content)
-        return prompt
+        return template_registry.render_string("conversation_process", CONVERSATION_PROCESS, chat_content=chat_content)
 
     async def process_conversation_route(self, request: ConversationProcessRequest) -> ConversationProcessResponse:
         """
@@ -168,3 +230,17 @@ class ConversationProcessorAgent(BaseAgent):
                 success=False,
                 message=f"对话处理失败: {str(e)}"
             )
+
+    async def process_conversation_stream_route(self, request: ConversationProcessRequest) -> StreamingResponse:
+        """
+        对话处理流式接口，以 NDJSON 逐行推送
+
+        每条对话处理完成即推送 {"type": "result", "index": 输入下标, "conversation": {...}}（按完成顺序），
+        全部完成后推送 {"type": "done", ...}。客户端断开连接即停止，未开始的对话不再调用模型。
+
+        :param request: 对话处理请求
+        """
+        return StreamingResponse(
+            self.process_stream(request.conversations, request.concurrency),
+            media_type="application/x-ndjson"
+        )
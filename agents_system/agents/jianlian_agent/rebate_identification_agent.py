@@ -2,25 +2,44 @@
 # -*- coding: utf-8 -*-
 
 import json
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Tuple
 from pydantic import BaseModel
 from fastapi import APIRouter
-from jinja2 import Template
+from fastapi.responses import StreamingResponse
 
 from tqdm.asyncio import tqdm
 
-from agents_system.agents.jianlian_agent.rebate_identification_prompt import REBATE_IDENTIFICATION
+from agents_system.agents.jianlian_agent.rebate_identification_prompt import (
+    REBATE_IDENTIFICATION,
+    REBATE_IDENTIFICATION_PACKED
+)
+from agents_system.config.settings import settings
 from agents_system.core.base_agent import BaseAgent
+from agents_system.core.batch_stream import ndjson_events
+from agents_system.core.prompt_packer import PromptPacker, estimate_tokens
+from agents_system.core.record_store import RecordDeduplicator, prompt_version
+from agents_system.core.registry import registry
+from agents_system.core.template_registry import template_registry
 from agents_system.models.doubao import DoubaoModel, logger
 
 
+class UnparsedResultError(ValueError):
+    """大模型返回结果不是有效JSON，raw 为原始文本（不写入结果存储）"""
+
+    def __init__(self, raw: str):
+        super().__init__("大模型返回结果不是有效JSON格式")
+        self.raw = raw
+
+
 class RebateIdentificationRequest(BaseModel):
     """
     返点识别请求模型
 
     :param conversations: 包含多个字典的列表，每个字典包含'小红书昵称'和'聊天记录'字段
+    :param concurrency: 流式接口的并发数，为空时使用配置 BATCH_STREAM_CONCURRENCY
     """
     conversations: List[Dict[str, str]]
+    concurrency: Optional[int] = None
 
 
 class RebateIdentificationResponse(BaseModel):
@@ -39,17 +58,37 @@ class RebateIdentificationResponse(BaseModel):
 class RebateIdentificationAgent(BaseAgent):
     """返点识别智能体（异步并发版本）"""
 
-    def __init__(self):
+    def __init__(self, doubao_client: Optional[DoubaoModel] = None, use_cache: bool = True):
         super().__init__(name="RebateIdentificationAgent")
         self.name = "返点识别智能体"
         self.description = "负责分析聊天记录中未能达成返点协议的原因，并将识别结果添加到原数据结构中（支持异步并发）"
-        self.doubao_client = DoubaoModel()
+        self.doubao_client = doubao_client or registry.get_model()
+        self.use_cache = use_cache
+        # 按内容哈希去重，相同聊天记录只分析一次；开启打包时结果也取决于打包模板与打包参数
+        self.deduplicator = RecordDeduplicator(prompt_version(
+            REBATE_IDENTIFICATION,
+            self.doubao_client.model_name,
+            {
+                "packed_template": REBATE_IDENTIFICATION_PACKED,
+                "max_record_tokens": settings.REBATE_PACK_MAX_RECORD_TOKENS,
+                "token_budget": settings.REBATE_PACK_TOKEN_BUDGET,
+                "max_items": settings.REBATE_PACK_MAX_ITEMS
+            } if settings.REBATE_PACK_ENABLED else None
+        )) if settings.RECORD_DEDUP_ENABLED else None
+        # 短对话打包为一次调用，分摊标签目录等静态提示词
+        self.packer = PromptPacker(
+            self._call_packed,
+            token_budget=settings.REBATE_PACK_TOKEN_BUDGET,
+            max_items=settings.REBATE_PACK_MAX_ITEMS,
+            window=settings.REBATE_PACK_WINDOW
+        ) if settings.REBATE_PACK_ENABLED else None
         self._setup_routes()
 
     def _setup_routes(self) -> None:
         """设置路由"""
         router = APIRouter(prefix=f"/{self.__class__.__name__.lower().replace('agent', '')}")
         router.post("/identify-rebate", response_model=RebateIdentificationResponse)(self.identify_rebate_route)
+        router.post("/identify-rebate-stream")(self.identify_rebate_stream_route)
         self.router = router
 
     async def process(self, data: dict[str, Any]) -> dict[str, Any]:
@@ -91,17 +130,9 @@ class RebateIdentificationAgent(BaseAgent):
                     processed_results[i] = {"原因": f"分析失败: {str(result)[:100]}", "标签": "分析异常"}
 
             # 构建结果列表，保持原数据结构并添加原因、标签字段
-            processed_conversations = []
-            for i, conversation in enumerate(conversations):
-                processed_conversation = conversation.copy()
-                result = processed_results[i]
-                if isinstance(result, dict):
-                    processed_conversation["原因"] = result.get("原因", "分析失败")
-                    processed_conversation["标签"] = result.get("标签", "无标签适合")
-                else:
-                    processed_conversation["原因"] = result or "分析失败"
-                    processed_conversation["标签"] = "无标签适合"
-                processed_conversations.append(processed_conversation)
+            processed_conversations = [
+                self._merge_result(conversation, processed_results[i]) for i, conversation in enumerate(conversations)
+            ]
 
             logger.info(f"异步并发返点识别分析完成，成功分析了 {len(processed_conversations)} 条聊天记录")
 
@@ -119,38 +150,162 @@ class RebateIdentificationAgent(BaseAgent):
                 "message": f"异步并发返点识别分析失败: {str(e)}"
             }
 
-    async def _analyze_single_conversation(self, chat_content: str) -> dict[str, str]:
+    async def process_stream(self, conversations: List[Dict[str, str]], concurrency: Optional[int] = None):
+        """
+        流式处理返点识别分析，每条对话分析完成即产出 NDJSON 行
+
+        :param conversations: 对话列表
+        :param concurrency: 并发数，为空时使用配置 BATCH_STREAM_CONCURRENCY
+        :return: NDJSON 行的异步迭代器
+        """
+        async def analyze(index: int, conversation: Dict[str, str]) -> Dict[str, Any]:
+            return {"conversation": await self.process_record(conversation)}
+
+        concurrency = min(concurrency or settings.BATCH_STREAM_CONCURRENCY, settings.BATCH_STREAM_MAX_CONCURRENCY)
+        logger.info(f"开始流式分析 {len(conversations)} 条聊天记录的返点识别，并发数 {concurrency}")
+        async for line in ndjson_events(conversations, analyze, concurrency):
+            yield line
+
+    async def process_record(self, conversation: Dict[str, str], raise_errors: bool = False) -> Dict[str, str]:
+        """
+        分析单条对话并返回添加了原因、标签字段的结果（批量任务的单条处理入口）
+
+        :param conversation: 包含'小红书昵称'和'聊天记录'字段的对话
+        :param raise_errors: 模型调用失败时抛出异常（由调用方重试），否则写入失败原因
+        :return: 处理后的对话
+        """
+        result = await self._analyze_single_conversation(conversation.get("聊天记录", ""), raise_errors)
+        return self._merge_result(conversation, result)
+
+    @staticmethod
+    def _merge_result(conversation: Dict[str, str], result: Any) -> Dict[str, str]:
+        """
+        保持原数据结构并添加原因、标签字段
+
+        :param conversation: 原始对话
+        :param result: 分析结果
+        :return: 处理后的对话
+        """
+        processed_conversation = conversation.copy()
+        if isinstance(result, dict):
+            processed_conversation["原因"] = result.get("原因", "分析失败")
+            processed_conversation["标签"] = result.get("标签", "无标签适合")
+        else:
+            processed_conversation["原因"] = result or "分析失败"
+            processed_conversation["标签"] = "无标签适合"
+        return processed_conversation
+
+    async def _analyze_single_conversation(self, chat_content: str, raise_errors: bool = False) -> dict[str, str]:
         """
         分析单个对话的返点识别原因（异步方法）
 
         :param chat_content: 原始聊天记录内容
+        :param raise_errors: 模型调用失败时抛出异常，否则返回分析失败结果
         :return: 返点识别分析结果，包含原因、标签
         """
         if not chat_content or not chat_content.strip():
             return {"原因": "聊天记录为空，无法分析", "标签": "无标签适合"}
 
         try:
-            # 构建提示词
-            prompt = self._build_prompt(chat_content)
-
-            # 异步调用大模型
-            analysis_result = await self.doubao_client.generate_text(prompt)
-            
-            # 尝试解析JSON结果
-            try:
-                result_dict = json.loads(analysis_result.strip())
-                return {
-                    "原因": result_dict.get("原因", "分析结果格式异常"),
-                    "标签": result_dict.get("标签", "无标签适合")
-                }
-            except json.JSONDecodeError:
-                logger.warning(f"大模型返回结果不是有效JSON格式: {analysis_result[:200]}")
-                return {"原因": analysis_result.strip(), "标签": "无标签适合"}
+            if self.deduplicator is not None:
+                return await self.deduplicator.get_or_compute(chat_content, self._call_model)
+            return await self._call_model(chat_content)
 
+        except UnparsedResultError as e:
+            # 原始文本作为原因返回，但不保存为去重结果，重跑时重新分析
+            return {"原因": e.raw, "标签": "无标签适合"}
         except Exception as e:
             logger.error(f"分析单个对话时出错: {str(e)}")
+            if raise_errors:
+                raise
             return {"原因": f"分析失败: {str(e)[:100]}", "标签": "分析异常"}
 
+    async def _call_model(self, chat_content: str) -> dict[str, str]:
+        """
+        调用大模型分析返点识别原因，开启打包时短对话与其他短对话合并调用，调用失败时抛出异常
+
+        :param chat_content: 原始聊天记录内容
+        :return: 返点识别分析结果，包含原因、标签
+        """
+        if self.packer is not None and estimate_tokens(chat_content) <= settings.REBATE_PACK_MAX_RECORD_TOKENS:
+            result = await self.packer.submit(chat_content)
+            if result is not None:
+                return result
+        return await self._call_single(chat_content)
+
+    async def _call_single(self, chat_content: str) -> dict[str, str]:
+        """
+        单独调用大模型分析一条聊天记录
+
+        :param chat_content: 原始聊天记录内容
+        :return: 返点识别分析结果，包含原因、标签
+        :raises UnparsedResultError: 返回结果不是有效JSON
+        """
+        # 构建提示词
+        prompt = self._build_prompt(chat_content)
+
+        # 异步调用大模型
+        analysis_result = await self.doubao_client.generate_text(prompt, pool="batch", cache=self.use_cache)
+
+        # 尝试解析JSON结果
+        try:
+            result_dict = json.loads(analysis_result.strip())
+            return {
+                "原因": result_dict.get("原因", "分析结果格式异常"),
+                "标签": result_dict.get("标签", "无标签适合")
+            }
+        except json.JSONDecodeError:
+            logger.warning(f"大模型返回结果不是有效JSON格式: {analysis_result[:200]}")
+            raise UnparsedResultError(analysis_result.strip())
+
+    async def _call_packed(self, items: List[Tuple[str, str]]) -> Dict[str, dict[str, str]]:
+        """
+        一次调用分析多条聊天记录
+
+        :param items: (ID, 聊天记录) 列表
+        :return: 通过校验的 {ID: 分析结果}，缺失的ID由打包器交给单条调用重跑
+        """
+        prompt = template_registry.render_string(
+            "rebate_identification_packed",
+            REBATE_IDENTIFICATION_PACKED,
+            conversations=[{"id": item_id, "chat_content": chat_content} for item_id, chat_content in items]
+        )
+        analysis_result = await self.doubao_client.generate_text(prompt, pool="batch", cache=self.use_cache)
+        return self._parse_packed_result(analysis_result, [item_id for item_id, _ in items])
+
+    @staticmethod
+    def _parse_packed_result(analysis_result: str, item_ids: List[str]) -> Dict[str, dict[str, str]]:
+        """
+        解析并逐条校验打包调用的输出
+
+        :param analysis_result: 大模型输出，应为 [{"id", "原因", "标签"}, ...]
+        :param item_ids: 本批次的记录ID
+        :return: 通过校验的 {ID: {"原因", "标签"}}，ID不在本批次、重复或字段缺失的条目被丢弃
+        """
+        text = analysis_result.strip()
+        start, end = text.find("["), text.rfind("]")
+        try:
+            items = json.loads(text[start:end + 1]) if 0 <= start < end else None
+        except json.JSONDecodeError:
+            items = None
+        if not isinstance(items, list):
+            logger.warning(f"打包调用返回结果不是有效JSON数组: {analysis_result[:200]}")
+            return {}
+
+        expected = set(item_ids)
+        results = {}
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            item_id = str(item.get("id", "")).strip()
+            reason, tag = item.get("原因"), item.get("标签")
+            if item_id not in expected or item_id in results:
+                continue
+            if not isinstance(reason, str) or not reason.strip() or not isinstance(tag, str) or not tag.strip():
+                continue
+            results[item_id] = {"原因": reason.strip(), "标签": tag.strip()}
+        return results
+
     @staticmethod
     def _build_prompt(chat_content: str) -> str:
         """
@@ -159,9 +314,7 @@ class RebateIdentificationAgent(BaseAgent):
         :param chat_content: 原始聊天记录内容
         :return: 构建的提示词
         """
-        rebate_identification_prompt = Template(REBATE_IDENTIFICATION)
-        prompt = rebate_identification_prompt.render(chat_content=chat_content)
-        return prompt
+        return template_registry.render_string("rebate_identification", REBATE_IDENTIFICATION, chat_content=chat_content)
 
     async def identify_rebate_route(self, request: RebateIdentificationRequest) -> RebateIdentificationResponse:
         """
@@ -186,3 +339,17 @@ class RebateIdentificationAgent(BaseAgent):
                 success=False,
                 message=f"返点识别分析失败: {str(e)}"
             )
+
+    async def identify_rebate_stream_route(self, request: RebateIdentificationRequest) -> StreamingResponse:
+        """
+        返点识别分析流式接口，以 NDJSON 逐行推送
+
+        每条对话分析完成即推送 {"type": "result", "index": 输入下标, "conversation": {...}}（按完成顺序），
+        全部完成后推送 {"type": "done", ...}。客户端断开连接即停止，未开始的对话不再调用模型。
+
+        :param request: 返点识别请求
+        """
+        return StreamingResponse(
+            self.process_stream(request.conversations, request.concurrency),
+            media_type="application/x-ndjson"
+        )
@@ -157,4 +157,30 @@ REBATE_IDENTIFICATION = """
 
 ### 输出示例
 {"原因":"智能体提及‘返点’字段并索取合作信息，博主仅回复‘你好’未提供任何返点及合作信息，合作未推进","标签":"返点需求触达-信息待补充-博主仅礼貌回应"}  
-"""
\ No newline at end of file
+"""
+
+# 多条聊天记录打包分析：沿用单条提示词的角色设定、标签目录与任务步骤，
+# 待分析的聊天记录按 ID 编号放在提示词末尾，输出为以 id 对应的 JSON 数组
+REBATE_IDENTIFICATION_PACKED = REBATE_IDENTIFICATION.split("***输出要求***")[0].replace(
+    "最终以JSON格式输出结果（仅含“原因”“标签”两个字段，无额外内容）",
+    "最终按“输出要求”以JSON数组输出每条聊天记录的结果"
+).replace(
+    "聊天记录: {{chat_content}}",
+    "见末尾“待分析聊天记录”，共 {{ conversations|length }} 条，每条以【ID: 编号】开头；各条相互独立，需逐条分别分析"
+) + """***输出要求***  
+1. 仅输出一个JSON数组，每条聊天记录对应数组中的一个对象，字段严格为“id”“原因”“标签”，无任何多余文字（如解释、说明）；  
+2. “id”与输入的 ID 完全一致，每个 ID 恰好输出一次，不得遗漏、合并或新增；  
+3. “原因”需包含该条聊天记录的具体细节，与标签逻辑一致，不得引用其他记录的内容；  
+4. “标签”仅可填上述细化标签名称或“无标签适合”，不可自定义。  
+
+
+### 输出示例
+[{"id":"1","原因":"智能体提及‘返点’字段并索取合作信息，博主仅回复‘你好’未提供任何返点及合作信息，合作未推进","标签":"返点需求触达-信息待补充-博主仅礼貌回应"},{"id":"2","原因":"智能体仅发送合作邀请未提返点，博主无回应","标签":"全程未提返点-仅停留在合作邀请无后续"}]
+
+
+***待分析聊天记录***
+{% for item in conversations %}
+【ID: {{ item.id }}】
+{{ item.chat_content }}
+{% endfor %}
+"""
@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import os
 
-from typing import Any, List, Dict
+from typing import Any, List, Dict, Optional, AsyncGenerator
 from pydantic import BaseModel
 from fastapi import APIRouter
-from jinja2 import Template
 from agents_system.core.base_agent import BaseAgent
+from agents_system.core.registry import registry
+from agents_system.core.template_registry import template_registry
 from agents_system.models.doubao import DoubaoModel, logger
 
 
@@ -36,11 +38,11 @@ class FillResponse(BaseModel):
 class FillAgent(BaseAgent):
     """选号需求填写智能体"""
 
-    def __init__(self):
+    def __init__(self, doubao_client: Optional[DoubaoModel] = None):
         super().__init__(name="FillAgent")
         self.name = "二次议价智能体"
         self.description = "负责向博主二次议价"
-        self.doubao_client = DoubaoModel()
+        self.doubao_client = doubao_client or registry.get_model()
         # self._setup_routes()
 
     def _setup_routes(self) -> None:
@@ -83,6 +85,22 @@ class FillAgent(BaseAgent):
                 "message": f"二次议价填写失败: {str(e)}"
             }
 
+    async def process_stream(self, data: dict[str, Any]) -> AsyncGenerator[str, None]:
+        """
+        流式生成二次议价填写回复，逐段返回模型输出
+
+        :param data: 包含聊天历史、用户输入和表单状态的数据
+        :return: 回复文本片段
+        """
+        conversations = data.get("conversations", [])
+        current_form = data.get("form", "")
+        user_input = next((m.get('content') for m in reversed(conversations) if m.get('role') == "user"), "")
+
+        prompt = self._build_prompt(conversations, user_input, current_form)
+
+        async for chunk in self.doubao_client.generate_text_stream(prompt):
+            yield chunk
+
     def _build_prompt(self, conversations: List, user_input: str, current_form: str) -> str | None:
         """
         构建二次议价填写提示词
@@ -93,16 +111,10 @@ class FillAgent(BaseAgent):
         :return: 构建的提示词
         """
         try:
-            # 读取 prompt 模板文件
-            import os
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            prompt_file = os.path.join(current_dir, "fill.txt")
-
-            with open(prompt_file, 'r', encoding='utf-8') as f:
-                prompt_template = Template(f.read())
-
-            # 替换模板中的占位符
-            prompt = prompt_template.render(
+            # 从模板注册表获取已编译的模板并替换占位符
+            prompt_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fill.txt")
+            prompt = template_registry.render_file(
+                prompt_file,
                 conversations=conversations,
                 user_input=user_input,
                 form=current_form
@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import os
 import json
-from typing import Any, List, Dict
+from typing import Any, List, Dict, Optional
 from pydantic import BaseModel
 from fastapi import APIRouter
-from jinja2 import Template
 from agents_system.core.base_agent import BaseAgent
+from agents_system.core.registry import registry
+from agents_system.core.template_registry import template_registry
 from agents_system.models.doubao import DoubaoModel, logger
 
 
@@ -36,11 +38,12 @@ class SaveResponse(BaseModel):
 class SaveAgent(BaseAgent):
     """表单信息识别与更新智能体"""
 
-    def __init__(self):
+    def __init__(self, doubao_client: Optional[DoubaoModel] = None, use_cache: bool = True):
         super().__init__(name="SaveAgent")
         self.name = "表单信息识别与更新智能体"
         self.description = "专门负责识别聊天记录中表单信息并更新表单的系统"
-        self.doubao_client = DoubaoModel()
+        self.doubao_client = doubao_client or registry.get_model()
+        self.use_cache = use_cache
         # self._setup_routes()
 
     def _setup_routes(self) -> None:
@@ -64,15 +67,15 @@ class SaveAgent(BaseAgent):
             prompt = self._build_prompt(conversations, current_form)
 
             # 调用大模型进行表单更新
-            response = await self.doubao_client.generate_text(prompt)
+            response = await self.doubao_client.generate_text(prompt, cache=self.use_cache)
 
             # 处理响应
-            updated_form = self._process_response(response)
+            updated_form = self.apply_output(current_form, self._process_response(response))
 
             logger.info(f"表单信息识别与更新完成，更新结果: {'有更新' if updated_form != 'null' else '无更新'}")
 
             return {
-                "updated_form": updated_form if updated_form != {} else current_form,
+                "updated_form": updated_form,
                 "success": True,
                 "message": "表单信息识别与更新成功"
             }
@@ -94,16 +97,10 @@ class SaveAgent(BaseAgent):
         :return: 构建的提示词
         """
         try:
-            # 读取 prompt 模板文件
-            import os
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            prompt_file = os.path.join(current_dir, "save.txt")
-
-            with open(prompt_file, 'r', encoding='utf-8') as f:
-                prompt_template = Template(f.read())
-
-            # 替换模板中的占位符
-            prompt = prompt_template.render(
+            # 从模板注册表获取已编译的模板并替换占位符
+            prompt_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "save.txt")
+            prompt = template_registry.render_file(
+                prompt_file,
                 conversations=conversations,
                 form=current_form
             )
@@ -113,6 +110,16 @@ class SaveAgent(BaseAgent):
         except Exception as e:
             logger.error(f"读取 save.txt 文件失败: {str(e)}")
 
+    def apply_output(self, current_form: Dict[str, Any], output: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        将模型输出应用到当前表单
+
+        :param current_form: 当前表单
+        :param output: 模型输出的完整表单，无更新时为空
+        :return: 更新后的表单
+        """
+        return output if output else current_form
+
     def _process_response(self, response: str) -> Dict[str, Any]:
         """
         处理模型响应
@@ -0,0 +1,570 @@
+import asyncio
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+
+from agents_system.config.settings import settings
+from agents_system.core.batch_stream import stream_as_completed
+from agents_system.core.task_queue import RESULTS, TASKS, TaskBroker
+from agents_system.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+# 单条记录处理函数：输入一条对话，返回处理后的对话
+RecordProcessor = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def infer_format(content_type: Optional[str], fmt: Optional[str] = None) -> str:
+    """
+    确定上传内容格式，优先使用显式指定的格式，否则按 Content-Type 判断
+
+    :param content_type: 请求的 Content-Type
+    :param fmt: 显式指定的格式（json/jsonl/xlsx）
+    :return: 格式
+    """
+    if fmt:
+        return fmt.lower()
+    content_type = (content_type or "").lower()
+    if "spreadsheet" in content_type or "excel" in content_type:
+        return "xlsx"
+    if "ndjson" in content_type or "jsonl" in content_type:
+        return "jsonl"
+    return "json"
+
+
+def parse_records(body: bytes, fmt: str) -> List[Dict[str, Any]]:
+    """
+    解析上传的批量记录
+
+    :param body: 上传内容
+    :param fmt: json（数组或 {"conversations": [...]}）、jsonl（每行一条）、xlsx（首个工作表，每行一条）
+    :return: 记录列表
+    :raises ValueError: 格式不支持或内容无法解析
+    """
+    if fmt == "json":
+        data = json.loads(body.decode("utf-8"))
+        records = data.get("conversations", []) if isinstance(data, dict) else data
+    elif fmt == "jsonl":
+        records = [json.loads(line) for line in body.decode("utf-8").splitlines() if line.strip()]
+    elif fmt == "xlsx":
+        import pandas as pd
+        df = pd.read_excel(io.BytesIO(body), dtype=str)
+        records = [
+            {str(column).strip(): str(value).strip() for column, value in row.items() if pd.notna(value)}
+            for _, row in df.iterrows()
+        ]
+    else:
+        raise ValueError(f"不支持的格式: {fmt}")
+    if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+        raise ValueError("记录必须为JSON对象列表")
+    return records
+
+
+class JobStore:
+    """
+    批量任务存储（SQLite）
+
+    jobs 表保存任务状态，job_records 表保存每条记录的输入与结果；记录完成即写入，作为断点续跑的检查点。
+    """
+
+    def __init__(self, db_path: str):
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "job_id TEXT PRIMARY KEY, task TEXT NOT NULL, status TEXT NOT NULL, total INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, started_at REAL, finished_at REAL, message TEXT)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS job_records ("
+                "job_id TEXT NOT NULL, idx INTEGER NOT NULL, input TEXT NOT NULL, output TEXT, "
+                "status TEXT NOT NULL, finished_at REAL, PRIMARY KEY (job_id, idx))"
+            )
+            self._db.commit()
+
+    def create_job(self, job_id: str, task: str, records: List[Dict[str, Any]]) -> None:
+        """
+        创建任务并写入全部输入记录
+
+        :param job_id: 任务ID
+        :param task: 任务类型
+        :param records: 输入记录
+        """
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (job_id, task, status, total, created_at) VALUES (?, ?, 'pending', ?, ?)",
+                (job_id, task, len(records), time.time())
+            )
+            self._db.executemany(
+                "INSERT INTO job_records (job_id, idx, input, status) VALUES (?, ?, ?, 'pending')",
+                [(job_id, i, json.dumps(record, ensure_ascii=False)) for i, record in enumerate(records)]
+            )
+            self._db.commit()
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        获取任务及各状态的记录数
+
+        :param job_id: 任务ID
+        :return: 任务信息，不存在时返回None
+        """
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            counts = self._db.execute(
+                "SELECT status, COUNT(*) AS count FROM job_records WHERE job_id = ? GROUP BY status", (job_id,)
+            ).fetchall()
+        job = dict(row)
+        job["counts"] = {"pending": 0, "queued": 0, "done": 0, "failed": 0, **{r["status"]: r["count"] for r in counts}}
+        return job
+
+    def list_jobs(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """列出最近的任务"""
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def unfinished_records(self, job_id: str, include_queued: bool = True) -> List[Tuple[int, Dict[str, Any]]]:
+        """
+        获取未完成（待处理、已入队或失败）的记录
+
+        :param job_id: 任务ID
+        :param include_queued: 是否包含已发布到消息队列、尚未返回结果的记录
+        :return: (下标, 输入记录) 列表
+        """
+        statuses = ("pending", "failed", "queued") if include_queued else ("pending", "failed")
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT idx, input FROM job_records WHERE job_id = ? AND status IN ({','.join('?' * len(statuses))}) "
+                "ORDER BY idx",
+                (job_id, *statuses)
+            ).fetchall()
+        return [(row["idx"], json.loads(row["input"])) for row in rows]
+
+    def mark_queued(self, job_id: str, indexes: List[int]) -> None:
+        """
+        标记记录已发布到消息队列
+
+        :param job_id: 任务ID
+        :param indexes: 记录下标
+        """
+        with self._lock:
+            self._db.executemany(
+                "UPDATE job_records SET status = 'queued' WHERE job_id = ? AND idx = ? AND status != 'done'",
+                [(job_id, idx) for idx in indexes]
+            )
+            self._db.commit()
+
+    def save_result(self, job_id: str, idx: int, output: Dict[str, Any], status: str) -> None:
+        """
+        写入单条记录结果（检查点）
+
+        :param job_id: 任务ID
+        :param idx: 记录下标
+        :param output: 结果
+        :param status: done 或 failed
+        """
+        with self._lock:
+            self._db.execute(
+                "UPDATE job_records SET output = ?, status = ?, finished_at = ? WHERE job_id = ? AND idx = ?",
+                (json.dumps(output, ensure_ascii=False), status, time.time(), job_id, idx)
+            )
+            self._db.commit()
+
+    def set_status(self, job_id: str, status: str, **fields: Any) -> None:
+        """
+        更新任务状态
+
+        :param job_id: 任务ID
+        :param status: 状态
+        :param fields: 其他字段（started_at、finished_at、message）
+        """
+        assignments = ", ".join(["status = ?"] + [f"{key} = ?" for key in fields])
+        with self._lock:
+            self._db.execute(
+                f"UPDATE jobs SET {assignments} WHERE job_id = ?", (status, *fields.values(), job_id)
+            )
+            self._db.commit()
+
+    def unfinished_jobs(self) -> List[str]:
+        """获取待执行或执行中断的任务ID"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT job_id FROM jobs WHERE status IN ('pending', 'running') ORDER BY created_at"
+            ).fetchall()
+        return [row["job_id"] for row in rows]
+
+    def iter_records(self, job_id: str, page_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """
+        按下标顺序分页读取记录，避免一次加载全部结果
+
+        :param job_id: 任务ID
+        :param page_size: 每页行数
+        :return: {"index", "status", "conversation", "error"?} 迭代器
+        """
+        last_idx = -1
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT idx, input, output, status FROM job_records WHERE job_id = ? AND idx > ? "
+                    "ORDER BY idx LIMIT ?",
+                    (job_id, last_idx, page_size)
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                output = json.loads(row["output"]) if row["output"] else None
+                record = {"index": row["idx"], "status": row["status"]}
+                if row["status"] == "done":
+                    record["conversation"] = output
+                else:
+                    record["conversation"] = json.loads(row["input"])
+                    if output:
+                        record["error"] = output.get("error")
+                yield record
+            last_idx = rows[-1]["idx"]
+
+    def close(self) -> None:
+        """关闭数据库连接"""
+        with self._lock:
+            self._db.close()
+
+
+class BatchJobService:
+    """
+    批量任务服务
+
+    提交批量记录后立即返回任务ID，后台按并发数处理；每条记录完成即写入检查点，
+    服务重启时自动恢复未完成的任务，只处理尚未完成的记录。
+    指定消息代理（broker）时为队列模式：记录作为单条任务发布到任务队列，由独立的工作进程（worker.py）处理，
+    本服务只负责收集结果队列并写入检查点，批量调用不占用交互服务的模型连接池。
+    """
+
+    def __init__(self, processors: Dict[str, RecordProcessor], db_path: Optional[str] = None,
+                 concurrency: Optional[int] = None, broker: Optional[TaskBroker] = None):
+        self.processors = processors
+        self.db_path = db_path or settings.BATCH_JOB_DB_PATH
+        self.concurrency = concurrency or settings.BATCH_JOB_CONCURRENCY
+        self.broker = broker
+        self._store: Optional[JobStore] = None
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._runs: Dict[str, Dict[str, float]] = {}
+        self._collector: Optional[asyncio.Task] = None
+        self.router = APIRouter(prefix="/jobs")
+        self._setup_routes()
+
+    def _setup_routes(self) -> None:
+        """设置路由"""
+        self.router.get("")(self.list_jobs)
+        self.router.post("/{task}")(self.submit_route)
+        self.router.get("/{job_id}")(self.get_progress)
+        self.router.get("/{job_id}/results")(self.download_results)
+        self.router.post("/{job_id}/cancel")(self.cancel)
+        self.router.post("/{job_id}/resume")(self.resume)
+
+    @property
+    def store(self) -> JobStore:
+        """任务存储（首次使用时创建）"""
+        if self._store is None:
+            self._store = JobStore(self.db_path)
+        return self._store
+
+    async def submit(self, task: str, records: List[Dict[str, Any]]) -> str:
+        """
+        提交批量任务
+
+        :param task: 任务类型
+        :param records: 输入记录
+        :return: 任务ID
+        """
+        if task not in self.processors:
+            raise ValueError(f"未知的任务类型: {task}")
+        job_id = uuid.uuid4().hex
+        await asyncio.to_thread(self.store.create_job, job_id, task, records)
+        logger.info(f"创建批量任务 {job_id}: {task}，共 {len(records)} 条记录")
+        self._start(job_id)
+        return job_id
+
+    def _start(self, job_id: str, requeue: bool = True) -> None:
+        """
+        启动任务的后台执行
+
+        :param job_id: 任务ID
+        :param requeue: 队列模式下是否重新发布已入队但尚未返回结果的记录
+        """
+        task = self._tasks.get(job_id)
+        if task is None or task.done():
+            self._tasks[job_id] = asyncio.create_task(self._run(job_id, requeue))
+
+    async def _run(self, job_id: str, requeue: bool = True) -> None:
+        """
+        执行任务中尚未完成的记录
+
+        :param job_id: 任务ID
+        :param requeue: 队列模式下是否重新发布已入队但尚未返回结果的记录
+        """
+        job = await asyncio.to_thread(self.store.get_job, job_id)
+        processor = self.processors[job["task"]]
+        records = await asyncio.to_thread(self.store.unfinished_records, job_id, requeue or self.broker is None)
+        await asyncio.to_thread(self.store.set_status, job_id, "running", started_at=job["started_at"] or time.time())
+        remaining = len(records) + (0 if requeue else job["counts"]["queued"])
+        self._runs[job_id] = {"started": time.monotonic(), "processed": 0, "remaining": remaining}
+        logger.info(f"开始执行批量任务 {job_id}，待处理 {remaining} 条（已完成 {job['counts']['done']} 条）")
+
+        if self.broker is not None:
+            await self._enqueue(job_id, job["task"], records)
+            return
+
+        async def process(position: int, item: Tuple[int, Dict[str, Any]]) -> Dict[str, Any]:
+            idx, record = item
+            try:
+                output, status = await processor(record), "done"
+            except Exception as e:
+                logger.error(f"批量任务 {job_id} 第 {idx} 条处理失败: {str(e)}")
+                output, status = {"error": str(e)[:200]}, "failed"
+            await asyncio.to_thread(self.store.save_result, job_id, idx, output, status)
+            self._runs[job_id]["processed"] += 1
+            return {}
+
+        try:
+            async for _ in stream_as_completed(records, process, self.concurrency):
+                pass
+        except Exception as e:
+            logger.error(f"批量任务 {job_id} 执行失败: {str(e)}")
+            await asyncio.to_thread(self.store.set_status, job_id, "failed", message=str(e)[:500])
+            return
+        await asyncio.to_thread(self.store.set_status, job_id, "completed", finished_at=time.time())
+        logger.info(f"批量任务 {job_id} 完成")
+
+    async def _enqueue(self, job_id: str, task: str, records: List[Tuple[int, Dict[str, Any]]]) -> None:
+        """
+        队列模式：逐条发布任务消息并标记为已入队
+
+        :param job_id: 任务ID
+        :param task: 任务类型
+        :param records: (下标, 输入记录) 列表
+        """
+        def publish_all() -> None:
+            for start in range(0, len(records), 500):
+                chunk = records[start:start + 500]
+                # 先标记再发布，避免工作进程返回的结果被入队状态覆盖
+                self.store.mark_queued(job_id, [idx for idx, _ in chunk])
+                for idx, record in chunk:
+                    self.broker.publish(TASKS, {"job_id": job_id, "index": idx, "task": task, "record": record})
+
+        await asyncio.to_thread(publish_all)
+        logger.info(f"批量任务 {job_id} 已发布 {len(records)} 条任务消息")
+        await self._complete_if_finished(job_id)
+
+    async def _collect(self, poll_interval: float = 0.2) -> None:
+        """队列模式：持续消费结果队列，写入检查点后确认消息"""
+        while True:
+            try:
+                delivery = await asyncio.to_thread(self.broker.get, RESULTS)
+                if delivery is None:
+                    await asyncio.sleep(poll_interval)
+                    continue
+                delivery_tag, result = delivery
+                job_id = result["job_id"]
+                await asyncio.to_thread(
+                    self.store.save_result, job_id, result["index"], result["output"], result["status"]
+                )
+                await asyncio.to_thread(self.broker.ack, delivery_tag)
+                if job_id in self._runs:
+                    self._runs[job_id]["processed"] += 1
+                await self._complete_if_finished(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"收集批量任务结果失败: {str(e)}")
+                await asyncio.sleep(poll_interval)
+
+    async def _complete_if_finished(self, job_id: str) -> None:
+        """所有记录都已返回结果时把任务标记为完成"""
+        job = await asyncio.to_thread(self.store.get_job, job_id)
+        if job is not None and job["status"] == "running" and not job["counts"]["pending"] and not job["counts"]["queued"]:
+            await asyncio.to_thread(self.store.set_status, job_id, "completed", finished_at=time.time())
+            logger.info(f"批量任务 {job_id} 完成")
+
+    async def start(self) -> List[str]:
+        """
+        队列模式下启动结果收集，并恢复服务中断前未完成的任务
+
+        :return: 恢复的任务ID
+        """
+        if self.broker is not None and (self._collector is None or self._collector.done()):
+            self._collector = asyncio.create_task(self._collect())
+        return await self.resume_unfinished()
+
+    async def resume_unfinished(self) -> List[str]:
+        """
+        恢复服务中断前未完成的任务（队列模式下已入队的记录仍在消息队列中，不重复发布）
+
+        :return: 恢复的任务ID
+        """
+        job_ids = await asyncio.to_thread(self.store.unfinished_jobs)
+        for job_id in job_ids:
+            self._start(job_id, requeue=False)
+        if job_ids:
+            logger.info(f"恢复 {len(job_ids)} 个未完成的批量任务")
+        return job_ids
+
+    async def progress(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        获取任务进度与吞吐量
+
+        :param job_id: 任务ID
+        :return: 进度信息，任务不存在时返回None
+        """
+        job = await asyncio.to_thread(self.store.get_job, job_id)
+        if job is None:
+            return None
+        counts = job.pop("counts")
+        finished = counts["done"] + counts["failed"]
+        progress = {
+            **job,
+            **counts,
+            "executor": "queue" if self.broker is not None else "local",
+            "progress": finished / job["total"] if job["total"] else 1.0,
+            "throughput": 0.0,
+            "eta_seconds": None
+        }
+        run = self._runs.get(job_id)
+        if run is not None and job["status"] == "running":
+            elapsed = time.monotonic() - run["started"]
+            throughput = run["processed"] / elapsed if elapsed > 0 else 0.0
+            progress["throughput"] = round(throughput, 3)
+            if throughput > 0:
+                progress["eta_seconds"] = round((run["remaining"] - run["processed"]) / throughput, 1)
+        return progress
+
+    async def submit_route(self, task: str, request: Request, format: Optional[str] = None) -> Dict[str, Any]:
+        """
+        提交批量任务接口，请求体为 JSON、JSONL 或 xlsx 文件内容
+
+        :param task: 任务类型
+        :param request: 请求
+        :param format: 上传格式，为空时按 Content-Type 判断
+        :return: 任务ID与记录数
+        """
+        if task not in self.processors:
+            raise HTTPException(status_code=404, detail=f"未知的任务类型: {task}")
+        body = await request.body()
+        try:
+            records = await asyncio.to_thread(parse_records, body, infer_format(request.headers.get("content-type"), format))
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"解析批量记录失败: {str(e)}")
+        if not records:
+            raise HTTPException(status_code=400, detail="批量记录为空")
+        job_id = await self.submit(task, records)
+        return {"job_id": job_id, "task": task, "total": len(records)}
+
+    async def list_jobs(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """列出最近的任务"""
+        return await asyncio.to_thread(self.store.list_jobs, limit)
+
+    async def get_progress(self, job_id: str) -> Dict[str, Any]:
+        """查询任务进度接口"""
+        progress = await self.progress(job_id)
+        if progress is None:
+            raise HTTPException(status_code=404, detail="任务不存在")
+        return progress
+
+    async def download_results(self, job_id: str, format: str = "jsonl") -> Response:
+        """
+        下载任务结果接口，按输入顺序输出，未完成的记录附带状态
+
+        :param job_id: 任务ID
+        :param format: jsonl、json 或 xlsx
+        """
+        if await asyncio.to_thread(self.store.get_job, job_id) is None:
+            raise HTTPException(status_code=404, detail="任务不存在")
+        if format == "xlsx":
+            content = await asyncio.to_thread(self._results_xlsx, job_id)
+            return Response(
+                content,
+                media_type=XLSX_CONTENT_TYPE,
+                headers={"Content-Disposition": f'attachment; filename="{job_id}.xlsx"'}
+            )
+        if format not in ("jsonl", "json"):
+            raise HTTPException(status_code=400, detail=f"不支持的格式: {format}")
+        media_type = "application/x-ndjson" if format == "jsonl" else "application/json"
+        return StreamingResponse(self._results_lines(job_id, format), media_type=media_type)
+
+    async def _results_lines(self, job_id: str, format: str) -> AsyncIterator[str]:
+        """逐条输出结果（json 格式输出为一个数组）"""
+        records = self.store.iter_records(job_id)
+        first = True
+        if format == "json":
+            yield "["
+        while True:
+            record = await asyncio.to_thread(next, records, None)
+            if record is None:
+                break
+            line = json.dumps(record, ensure_ascii=False)
+            if format == "jsonl":
+                yield line + "\n"
+            else:
+                yield ("" if first else ",") + line
+            first = False
+        if format == "json":
+            yield "]"
+
+    def _results_xlsx(self, job_id: str) -> bytes:
+        """生成结果表格，每行为处理后的对话及处理状态"""
+        import pandas as pd
+        rows = [
+            {**record["conversation"], "处理状态": record["status"], **({"错误": record["error"]} if record.get("error") else {})}
+            for record in self.store.iter_records(job_id)
+        ]
+        buffer = io.BytesIO()
+        pd.DataFrame(rows).to_excel(buffer, index=False)
+        return buffer.getvalue()
+
+    async def cancel(self, job_id: str) -> Dict[str, Any]:
+        """取消任务接口，只能取消等待或执行中的任务；已完成的记录保留，可通过 resume 继续（队列模式下已入队的任务仍会被工作进程处理）"""
+        progress = await self.get_progress(job_id)
+        if progress["status"] not in ("pending", "running"):
+            raise HTTPException(status_code=409, detail=f"任务状态为 {progress['status']}，无法取消")
+        task = self._tasks.get(job_id)
+        if task is not None and not task.done():
+            task.cancel()
+        await asyncio.to_thread(self.store.set_status, job_id, "cancelled")
+        return await self.get_progress(job_id)
+
+    async def resume(self, job_id: str) -> Dict[str, Any]:
+        """继续执行任务接口，只处理未完成与失败的记录（队列模式下重新发布尚未返回结果的记录）"""
+        progress = await self.get_progress(job_id)
+        if progress["status"] != "running":
+            self._start(job_id)
+        return progress
+
+    async def close(self) -> None:
+        """停止执行中的任务与结果收集（状态保持为 running，重启后自动恢复）并关闭存储与消息代理"""
+        tasks = [task for task in (*self._tasks.values(), self._collector) if task is not None and not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+        if self.broker is not None:
+            self.broker.close()
@@ -0,0 +1,71 @@
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Sequence
+
+
+def ndjson_line(event: Dict[str, Any]) -> str:
+    """序列化单个 NDJSON 事件"""
+    return json.dumps(event, ensure_ascii=False) + "\n"
+
+
+async def stream_as_completed(items: Sequence[Any], worker: Callable[[int, Any], Awaitable[Dict[str, Any]]],
+                              concurrency: int) -> AsyncIterator[Dict[str, Any]]:
+    """
+    以固定数量的工作协程处理记录，按完成顺序逐条产出结果
+
+    同时只有 concurrency 条记录在处理中，结果产出后即释放，内存占用与记录总数无关。
+    调用方停止迭代（如客户端断开连接）时取消所有工作协程，未开始的记录不再处理。
+
+    :param items: 输入记录
+    :param worker: 处理函数 worker(下标, 记录)，返回结果字典
+    :param concurrency: 并发数
+    :return: 结果字典（含 index 字段）的异步迭代器
+    """
+    results: asyncio.Queue = asyncio.Queue(maxsize=max(1, concurrency))
+    indexes = iter(range(len(items)))
+    done = object()
+
+    async def run() -> None:
+        # 所有工作协程共享同一个下标迭代器，处理完一条再取下一条
+        for index in indexes:
+            try:
+                result = await worker(index, items[index])
+            except Exception as e:
+                result = {"error": str(e)[:200]}
+            await results.put({"index": index, **result})
+
+    async def supervise() -> None:
+        await asyncio.gather(*workers)
+        await results.put(done)
+
+    workers = [asyncio.create_task(run()) for _ in range(max(1, min(concurrency, len(items))))]
+    supervisor = asyncio.create_task(supervise())
+    try:
+        while True:
+            result = await results.get()
+            if result is done:
+                return
+            yield result
+    finally:
+        for task in (*workers, supervisor):
+            task.cancel()
+
+
+async def ndjson_events(items: Sequence[Any], worker: Callable[[int, Any], Awaitable[Dict[str, Any]]],
+                        concurrency: int) -> AsyncIterator[str]:
+    """
+    批量处理的 NDJSON 事件流
+
+    每条记录完成后推送 {"type": "result", "index": 输入下标, ...}，
+    全部完成后推送 {"type": "done", "total": 记录数, "seconds": 耗时}。
+
+    :param items: 输入记录
+    :param worker: 处理函数 worker(下标, 记录)，返回结果字典
+    :param concurrency: 并发数
+    :return: NDJSON 行的异步迭代器
+    """
+    start_time = time.perf_counter()
+    async for result in stream_as_completed(items, worker, concurrency):
+        yield ndjson_line({"type": "result", **result})
+    yield ndjson_line({"type": "done", "total": len(items), "seconds": round(time.perf_counter() - start_time, 3)})
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import json
+import time
+from typing import Any, Dict, Optional
+
+from agents_system.core.base_agent import BaseAgent
+from agents_system.core.registry import registry
+from agents_system.core.template_registry import template_registry
+from agents_system.models.doubao import DoubaoModel, logger
+
+
+# 合并输出要求：前两部分分别复用填写与保存智能体的提示词，聊天记录只出现一次
+FILL_SAVE_PROMPT = """{{fill_prompt}}
+
+==============================
+{{save_prompt}}
+
+==============================
+【合并输出要求】
+请一次性完成以上两项任务：
+1. 按第一部分的要求，生成本轮发给对方的回复。
+2. 按第二部分的要求，基于聊天历史记录以及你在第1步生成的回复，给出表单处理结果。
+只输出一个JSON对象，不包含任何其他文字、解释或代码块标记，格式如下：
+{"reply": "第1步生成的回复", "form": 第2步要求输出的JSON内容，无表单信息时为null}
+"""
+
+# 保存提示词中聊天记录的占位内容，避免在合并提示词中重复发送聊天记录
+CONVERSATIONS_REFERENCE = "见第一部分中的聊天历史记录，并包含你在本轮生成的回复"
+
+
+class FillSaveResult:
+    """
+    合并调用的解析结果
+
+    :param reply: 智能体回复内容
+    :param form: 保存智能体格式的表单输出（完整表单或表单增量），无更新时为None
+    """
+
+    def __init__(self, reply: str, form: Any):
+        self.reply = reply
+        self.form = form
+
+
+class FillSaveAgent(BaseAgent):
+    """
+    填写与保存合并智能体
+
+    一次模型调用同时生成回复与表单结果（结构化JSON输出），相比填写、保存两次调用
+    少一次请求，且聊天记录只发送一次。输出不符合格式时由调用方退回两次调用流程。
+    """
+
+    def __init__(self, fill_agent: Any, save_agent: Any, doubao_client: Optional[DoubaoModel] = None):
+        super().__init__(name="FillSaveAgent")
+        self.name = "填写与保存合并智能体"
+        self.description = "一次调用同时生成回复与表单更新结果"
+        self.fill_agent = fill_agent
+        self.save_agent = save_agent
+        self.doubao_client = doubao_client or registry.get_model()
+        self.stats = {"calls": 0, "invalid": 0, "errors": 0, "seconds": 0.0}
+
+    async def process(self, data: dict[str, Any]) -> dict[str, Any]:
+        """
+        一次调用完成回复生成与表单更新
+
+        :param data: 包含聊天历史和当前表单状态的数据
+        :return: 处理结果，success为False时调用方应退回两次调用流程
+        """
+        start_time = time.perf_counter()
+        self.stats["calls"] += 1
+        current_form = data.get("form") or {}
+        try:
+            prompt = self._build_prompt(data.get("conversations", []), current_form)
+            response = await self.doubao_client.generate_text(prompt)
+            result = self._process_response(response)
+            updated_form = self.save_agent.apply_output(current_form, result.form)
+        except ValueError as e:
+            self.stats["invalid"] += 1
+            logger.warning(f"合并调用输出不符合格式: {str(e)}")
+            return {"response": "", "updated_form": None, "success": False, "message": f"输出格式错误: {str(e)}"}
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"合并调用失败: {str(e)}")
+            return {"response": "", "updated_form": None, "success": False, "message": f"合并调用失败: {str(e)}"}
+        finally:
+            self.stats["seconds"] += time.perf_counter() - start_time
+
+        return {
+            "response": result.reply,
+            "updated_form": updated_form,
+            "success": True,
+            "message": "回复与表单更新成功"
+        }
+
+    def _build_prompt(self, conversations: list, current_form: Dict[str, Any]) -> str:
+        """
+        构建合并提示词
+
+        :param conversations: 聊天历史记录
+        :param current_form: 当前表单状态
+        :return: 构建的提示词
+        """
+        user_input = next((m.get('content') for m in reversed(conversations) if m.get('role') == "user"), "")
+        # 与两次调用流程保持一致：填写智能体不接收表单
+        fill_prompt = self.fill_agent._build_prompt(conversations, user_input, "")
+        save_prompt = self.save_agent._build_prompt(CONVERSATIONS_REFERENCE, json.dumps(current_form, ensure_ascii=False))
+        if fill_prompt is None or save_prompt is None:
+            raise RuntimeError("读取填写或保存提示词失败")
+        return template_registry.render_string(
+            "fill_save",
+            FILL_SAVE_PROMPT,
+            fill_prompt=fill_prompt,
+            save_prompt=save_prompt
+        )
+
+    @staticmethod
+    def _process_response(response: str) -> FillSaveResult:
+        """
+        解析并校验模型输出
+
+        :param response: 模型响应
+        :return: 解析结果
+        :raises ValueError: 输出不是合法JSON或不符合 {"reply": str, "form": object|array|null} 格式
+        """
+        cleaned_response = response.strip()
+        if cleaned_response.startswith("```"):
+            cleaned_response = cleaned_response.strip("`").removeprefix("json").strip()
+        try:
+            output = json.loads(cleaned_response)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"不是合法JSON: {str(e)}")
+        if not isinstance(output, dict):
+            raise ValueError("输出不是JSON对象")
+        reply = output.get("reply")
+        if not isinstance(reply, str) or not reply.strip():
+            raise ValueError("reply 缺失或为空")
+        form = output.get("form")
+        if form is not None and not isinstance(form, (dict, list)):
+            raise ValueError("form 必须为JSON对象、数组或null")
+        return FillSaveResult(reply.strip(), form)
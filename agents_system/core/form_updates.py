@@ -0,0 +1,140 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from agents_system.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+class _SessionForms:
+    """单个会话的表单版本状态"""
+
+    def __init__(self):
+        self.version = 0
+        self.results: OrderedDict = OrderedDict()
+        self.last_task: Optional[asyncio.Task] = None
+        self.condition = asyncio.Condition()
+        self.touched_at = time.monotonic()
+
+
+class FormUpdateManager:
+    """
+    后台表单更新管理器
+
+    智能体回复先返回给用户，表单提取在后台执行。同一会话的更新严格按提交顺序串行执行，
+    每次更新的基础表单由调用方提供（请求中的表单，或在执行时从会话存储读取，从而以上一次回写的结果为基础）；
+    进程内只负责排序，不缓存表单。每次提交得到一个递增的版本号，可查询或等待其结果。
+    """
+
+    def __init__(self, session_ttl: float = 3600.0, max_versions: int = 20):
+        self.session_ttl = session_ttl
+        self.max_versions = max_versions
+        self._sessions: Dict[str, _SessionForms] = {}
+
+    def submit(self, session_id: str, form: Dict[str, Any],
+               update: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+               on_done: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+               load_form: Optional[Callable[[], Awaitable[Optional[Dict[str, Any]]]]] = None) -> int:
+        """
+        提交一次后台表单更新
+
+        :param session_id: 会话ID
+        :param form: 基础表单（请求中的表单）
+        :param update: 接收基础表单并返回更新后表单的协程函数
+        :param on_done: 更新结束后接收结果表单（失败时为基础表单）的协程函数，如回写会话存储；按提交顺序执行
+        :param load_form: 在本次更新开始执行时读取基础表单的协程函数（如读取会话存储），返回None时使用 form
+        :return: 本次更新的表单版本号
+        """
+        self._purge_expired()
+        session = self._sessions.setdefault(session_id, _SessionForms())
+        session.touched_at = time.monotonic()
+        session.version += 1
+        version = session.version
+        session.results[version] = {"version": version, "status": "pending", "form": None, "message": ""}
+        while len(session.results) > self.max_versions:
+            session.results.popitem(last=False)
+        session.last_task = asyncio.create_task(
+            self._run(session, version, session.last_task, form, update, on_done, load_form)
+        )
+        return version
+
+    async def _run(self, session: _SessionForms, version: int, previous: Optional[asyncio.Task],
+                   form: Dict[str, Any], update: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+                   on_done: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+                   load_form: Optional[Callable[[], Awaitable[Optional[Dict[str, Any]]]]] = None) -> None:
+        """等待同会话上一次更新完成后执行本次更新"""
+        if previous is not None:
+            await asyncio.wait([previous])
+        result = session.results.get(version, {"version": version})
+        base_form = form
+        try:
+            if load_form is not None:
+                loaded = await load_form()
+                base_form = loaded if loaded is not None else form
+            updated_form = await update(base_form)
+            result.update(status="done", form=updated_form, message="表单更新成功")
+        except Exception as e:
+            logger.error(f"后台表单更新失败, 版本 {version}: {str(e)}")
+            result.update(status="failed", form=base_form, message=f"表单更新失败: {str(e)}")
+        if on_done is not None:
+            try:
+                await on_done(result["form"])
+            except Exception as e:
+                logger.error(f"回写表单失败, 版本 {version}: {str(e)}")
+        async with session.condition:
+            session.condition.notify_all()
+
+    def get(self, session_id: str, version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        查询表单版本状态
+
+        :param session_id: 会话ID
+        :param version: 版本号，为空时返回最新版本
+        :return: 版本状态，会话或版本不存在时返回None
+        """
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        session.touched_at = time.monotonic()
+        result = session.results.get(version or session.version)
+        return dict(result) if result is not None else None
+
+    async def wait(self, session_id: str, version: Optional[int] = None,
+                   timeout: float = 30.0) -> Optional[Dict[str, Any]]:
+        """
+        等待指定版本更新完成（长轮询订阅）
+
+        :param session_id: 会话ID
+        :param version: 版本号，为空时等待最新版本
+        :param timeout: 最长等待秒数，超时返回当前状态
+        :return: 版本状态，会话或版本不存在时返回None
+        """
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        version = version or session.version
+        if version not in session.results:
+            return None
+        try:
+            async with session.condition:
+                await asyncio.wait_for(
+                    session.condition.wait_for(lambda: session.results[version]["status"] != "pending"),
+                    timeout=timeout
+                )
+        except (asyncio.TimeoutError, KeyError):
+            pass
+        return self.get(session_id, version)
+
+    def _purge_expired(self) -> None:
+        """清理长时间无访问且没有进行中更新的会话"""
+        now = time.monotonic()
+        expired = [
+            session_id for session_id, session in self._sessions.items()
+            if now - session.touched_at > self.session_ttl
+            and (session.last_task is None or session.last_task.done())
+        ]
+        for session_id in expired:
+            del self._sessions[session_id]
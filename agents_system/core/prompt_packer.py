@@ -0,0 +1,133 @@
+import asyncio
+import re
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from agents_system.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+_CJK = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+# 打包调用：输入 [(ID, 文本)]，返回通过校验的 {ID: 结果}，缺失的ID由调用方单独处理
+PackSender = Callable[[List[Tuple[str, str]]], Awaitable[Dict[str, Any]]]
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的 token 数（中文及全角字符按每字1个，其余字符按每4个1个）
+
+    :param text: 文本
+    :return: 估算的 token 数
+    """
+    cjk = len(_CJK.findall(text or ""))
+    return cjk + (len(text or "") - cjk + 3) // 4
+
+
+class _PackItem:
+    """等待打包的单条记录"""
+
+    def __init__(self, item_id: str, text: str, tokens: int, future: asyncio.Future):
+        self.item_id = item_id
+        self.text = text
+        self.tokens = tokens
+        self.future = future
+
+
+class PromptPacker:
+    """
+    短记录打包调用
+
+    window 秒内到达的短记录合并为一次模型调用，静态的长提示词（如标签目录）由多条记录分摊；
+    每批最多 max_items 条，记录估算 token 合计不超过 token_budget，达到上限时立即发送。
+    单条记录的结果缺失、格式错误或整批调用失败时返回None，由调用方单独重跑该记录。
+    """
+
+    def __init__(self, send: PackSender, token_budget: int, max_items: int, window: float):
+        self.send = send
+        self.token_budget = token_budget
+        self.max_items = max_items
+        self.window = window
+        self._queue: List[_PackItem] = []
+        self._queued_tokens = 0
+        self._ids = 0
+        self._flush_task: Optional[asyncio.Task] = None
+        self._pack_tasks: set = set()
+        self._stats = {"packs": 0, "items": 0, "fallbacks": 0, "max_pack": 0, "singles": 0}
+
+    async def submit(self, text: str) -> Optional[Any]:
+        """
+        提交一条记录，等待所在批次的结果
+
+        :param text: 记录文本
+        :return: 该记录的结果，需要单独重跑时返回None
+        """
+        tokens = estimate_tokens(text)
+        if self._queue and (len(self._queue) >= self.max_items or self._queued_tokens + tokens > self.token_budget):
+            self._send_queue()
+        self._ids += 1
+        item = _PackItem(str(self._ids), text, tokens, asyncio.get_running_loop().create_future())
+        self._queue.append(item)
+        self._queued_tokens += tokens
+        if len(self._queue) >= self.max_items or self._queued_tokens >= self.token_budget:
+            self._send_queue()
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_after_window())
+        # shield：单条记录的调用方被取消时不影响同批的其他记录
+        return await asyncio.shield(item.future)
+
+    def _send_queue(self) -> None:
+        """把当前队列作为一批发送"""
+        batch, self._queue, self._queued_tokens = self._queue, [], 0
+        task = asyncio.create_task(self._send_pack(batch))
+        self._pack_tasks.add(task)
+        task.add_done_callback(self._pack_tasks.discard)
+
+    async def _flush_after_window(self) -> None:
+        """等待打包窗口后发送队列中的全部记录"""
+        await asyncio.sleep(self.window)
+        if self._queue:
+            self._send_queue()
+
+    async def _send_pack(self, batch: List[_PackItem]) -> None:
+        """
+        发送一批记录并分发结果
+
+        :param batch: 同一批次的记录
+        """
+        if len(batch) == 1:
+            # 窗口内只有一条记录时直接按单条处理
+            self._stats["singles"] += 1
+            batch[0].future.set_result(None)
+            return
+        self._stats["packs"] += 1
+        self._stats["items"] += len(batch)
+        self._stats["max_pack"] = max(self._stats["max_pack"], len(batch))
+        try:
+            results = await self.send([(item.item_id, item.text) for item in batch])
+        except Exception as e:
+            logger.warning(f"打包调用失败，{len(batch)} 条记录改为单独处理: {str(e)}")
+            results = {}
+        for item in batch:
+            result = results.get(item.item_id)
+            if result is None:
+                self._stats["fallbacks"] += 1
+            if not item.future.done():
+                item.future.set_result(result)
+        if len(results) < len(batch):
+            logger.warning(f"打包调用 {len(batch)} 条记录中 {len(batch) - len(results)} 条结果缺失或格式错误，改为单独处理")
+
+    def stats(self) -> Dict[str, Any]:
+        """获取打包统计"""
+        packs = self._stats["packs"]
+        return {
+            **self._stats,
+            "avg_pack": self._stats["items"] / packs if packs else 0.0,
+            "queued": len(self._queue)
+        }
+
+    async def close(self) -> None:
+        """等待进行中的批次完成"""
+        tasks = [task for task in (self._flush_task, *self._pack_tasks) if task is not None and not task.done()]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,210 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from agents_system.config.settings import settings
+from agents_system.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+_ZERO_WIDTH = re.compile("[\u200b-\u200f\u2060\ufeff]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_chat_content(text: str) -> str:
+    """
+    归一化聊天记录，用于判断重复记录（重新导出、同一博主多次联系产生的格式差异不影响结果）
+
+    全角/半角统一（NFKC）、去除零宽字符、每行内连续空白合并为一个空格、去除空行与首尾空白
+
+    :param text: 原始聊天记录
+    :return: 归一化文本
+    """
+    text = _ZERO_WIDTH.sub("", unicodedata.normalize("NFKC", text or ""))
+    lines = (_WHITESPACE.sub(" ", line).strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def content_hash(text: str) -> str:
+    """
+    计算聊天记录的内容哈希
+
+    :param text: 原始聊天记录
+    :return: 归一化文本的 SHA-256 十六进制哈希
+    """
+    return hashlib.sha256(normalize_chat_content(text).encode("utf-8")).hexdigest()
+
+
+def prompt_version(template: str, model: Optional[str] = None, options: Optional[Dict[str, Any]] = None) -> str:
+    """
+    计算提示词版本：模板内容、模型名称、影响结果的其他配置与 RECORD_STORE_VERSION 的哈希，
+    提示词或模型不变的部署沿用已有结果，任一变化即自动失效
+
+    :param template: 提示词模板内容
+    :param model: 模型名称，为空时使用配置 DOUBAO_MODEL_NAME
+    :param options: 其他影响结果的提示词与配置（如打包调用的模板与打包参数），需可JSON序列化
+    :return: 16位十六进制版本号
+    """
+    payload = {"template": template, "model": model or settings.DOUBAO_MODEL_NAME, "version": settings.RECORD_STORE_VERSION}
+    if options:
+        payload["options"] = options
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+class RecordResultStore:
+    """
+    批量记录结果存储（SQLite）
+
+    以 (提示词版本, 内容哈希) 为键保存单条记录的分析结果，跨批次与跨进程共享（队列模式的工作进程可挂载同一文件）；
+    db_path 为空时只在进程内保存。
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        if db_path:
+            db_dir = os.path.dirname(db_path)
+            if db_dir and not os.path.exists(db_dir):
+                os.makedirs(db_dir)
+        self._db = sqlite3.connect(db_path or ":memory:", check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            if db_path:
+                self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS record_results ("
+                "prompt_version TEXT NOT NULL, content_hash TEXT NOT NULL, result TEXT NOT NULL, created_at REAL NOT NULL, "
+                "PRIMARY KEY (prompt_version, content_hash))"
+            )
+            self._db.commit()
+
+    def get(self, version: str, key: str) -> Optional[Any]:
+        """
+        读取结果
+
+        :param version: 提示词版本
+        :param key: 内容哈希
+        :return: 结果，不存在时返回None
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT result FROM record_results WHERE prompt_version = ? AND content_hash = ?", (version, key)
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def set(self, version: str, key: str, result: Any) -> None:
+        """
+        写入结果
+
+        :param version: 提示词版本
+        :param key: 内容哈希
+        :param result: 可JSON序列化的结果
+        """
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO record_results (prompt_version, content_hash, result, created_at) VALUES (?, ?, ?, ?)",
+                (version, key, json.dumps(result, ensure_ascii=False), time.time())
+            )
+            self._db.commit()
+
+    def count(self) -> int:
+        """获取保存的结果数"""
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM record_results").fetchone()[0]
+
+    def close(self) -> None:
+        """关闭数据库连接"""
+        with self._lock:
+            self._db.close()
+
+
+class RecordDeduplicator:
+    """
+    按内容哈希去重的单条记录处理
+
+    同一批次中内容相同的记录只调用一次模型：正在处理的记录由后续重复记录共同等待，
+    处理完成的结果写入结果存储，之后的重复记录与提示词未变化的重跑直接复用。处理失败的结果不保存。
+    """
+
+    def __init__(self, version: str, store: Optional[RecordResultStore] = None):
+        self.version = version
+        self._store = store
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._stats = {"computed": 0, "inflight_hits": 0, "store_hits": 0}
+
+    @property
+    def store(self) -> RecordResultStore:
+        """结果存储，未指定时使用全局结果存储"""
+        return self._store or get_record_store()
+
+    async def get_or_compute(self, text: str, compute: Callable[[str], Awaitable[Any]]) -> Any:
+        """
+        获取记录的处理结果，相同内容只计算一次
+
+        :param text: 原始聊天记录
+        :param compute: 处理函数 compute(原始聊天记录)，失败时抛出异常
+        :return: 处理结果
+        """
+        key = content_hash(text)
+        task = self._inflight.get(key)
+        if task is not None:
+            self._stats["inflight_hits"] += 1
+        else:
+            task = asyncio.ensure_future(self._compute(key, text, compute))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._on_inflight_done(key, t))
+        # shield：单个调用方被取消（如流式客户端断开）时不影响等待同一结果的重复记录
+        return await asyncio.shield(task)
+
+    async def _compute(self, key: str, text: str, compute: Callable[[str], Awaitable[Any]]) -> Any:
+        """查询结果存储，未命中时处理记录并保存结果"""
+        result = await asyncio.to_thread(self.store.get, self.version, key)
+        if result is not None:
+            self._stats["store_hits"] += 1
+            return result
+        result = await compute(text)
+        self._stats["computed"] += 1
+        await asyncio.to_thread(self.store.set, self.version, key, result)
+        return result
+
+    def _on_inflight_done(self, key: str, task: asyncio.Future) -> None:
+        """处理结束后移出在途表，并取走异常以免所有等待者都已取消时告警"""
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        """获取去重命中统计"""
+        total = sum(self._stats.values())
+        return {
+            "version": self.version,
+            **self._stats,
+            "dedup_ratio": round(1 - self._stats["computed"] / total, 4) if total else 0.0
+        }
+
+
+_store: Optional[RecordResultStore] = None
+
+
+def get_record_store() -> RecordResultStore:
+    """获取全局结果存储（首次使用时创建）"""
+    global _store
+    if _store is None:
+        _store = RecordResultStore(settings.RECORD_STORE_DB_PATH)
+    return _store
+
+
+def close_record_store() -> None:
+    """关闭全局结果存储"""
+    global _store
+    if _store is not None:
+        _store.close()
+        _store = None
@@ -3,6 +3,7 @@ import os
 from typing import Dict, Type, Any, Optional
 from fastapi import APIRouter
 
+from agents_system.models.doubao import DoubaoModel, get_doubao_model, close_doubao_model
 from agents_system.utils.logger import get_logger
 
 # 添加项目根目录到Python路径
@@ -18,6 +19,7 @@ class AgentRegistry:
     def __init__(self):
         self._agents: Dict[str, Type] = {}
         self._agent_instances: Dict[str, Any] = {}
+        self._model: Optional[DoubaoModel] = None
         self._router = APIRouter(prefix="/agents")
         logger.info("Initialized AgentRegistry")
     
@@ -84,6 +86,34 @@ class AgentRegistry:
         
         return self._agent_instances[name]
     
+    def get_model(self) -> DoubaoModel:
+        """
+        获取进程内共享的豆包模型实例，所有智能体通过它复用同一HTTP连接池
+
+        Returns:
+            豆包模型实例
+        """
+        if self._model is None:
+            self._model = get_doubao_model()
+        return self._model
+
+    def set_model(self, model: DoubaoModel):
+        """
+        注入共享的豆包模型实例（须在智能体实例化之前调用）
+
+        Args:
+            model: 豆包模型实例
+        """
+        self._model = model
+        logger.info("Injected shared DoubaoModel into registry")
+
+    async def close_model(self):
+        """关闭共享的豆包模型实例"""
+        if self._model is not None:
+            await self._model.close()
+            self._model = None
+        await close_doubao_model()
+
     def list_agents(self) -> Dict[str, str]:
         """
         列出所有已注册的智能体
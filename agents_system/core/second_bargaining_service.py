@@ -1,13 +1,21 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-from typing import List, Dict, Any
-from pydantic import BaseModel
-from fastapi import APIRouter
+import json
+import time
+import uuid
+from typing import List, Dict, Any, AsyncGenerator, Optional
+from pydantic import BaseModel, PrivateAttr
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 
 from agents_system.agents.second_bargaining_agent.dispatch_agent import DispatchAgent, DispatchRequest
 from agents_system.agents.second_bargaining_agent.fill_agent import FillAgent, FillRequest
 from agents_system.agents.second_bargaining_agent.globalqaagent import GlobalQARequest, GlobalQAgent
 from agents_system.agents.second_bargaining_agent.save_agent import SaveAgent, SaveRequest
+from agents_system.config.settings import settings
+from agents_system.core.fill_save_agent import FillSaveAgent
+from agents_system.core.form_updates import FormUpdateManager
+from agents_system.core.session_store import create_session_store
 from agents_system.models.doubao import logger
 
 
@@ -17,10 +25,36 @@ class SecondBargainingRequest(BaseModel):
 
     :param form: 表单列表
     :param conversations: 聊天记录
+    :param session_id: 会话ID，延迟表单更新时用于保证同一会话的更新顺序
+    :param defer_form: 是否先返回回复、在后台更新表单
+    :param fill_mode: 回复与表单更新模式（two_call 或 single_call），为空时按配置
     """
     form: Dict[str, Any] = {}
     conversations: List[Dict[str, str]]
     status: str = "1"
+    session_id: str | None = None
+    defer_form: bool = False
+    fill_mode: str | None = None
+    # 会话模式请求：延迟表单更新完成后回写会话存储；未显式传入表单时，后台更新在执行时从会话存储读取基础表单
+    _persist_session: bool = PrivateAttr(default=False)
+    _form_from_session: bool = PrivateAttr(default=False)
+
+
+class SecondBargainingSessionRequest(BaseModel):
+    """
+    会话模式请求模型，聊天记录与表单保存在服务端
+
+    :param session_id: 会话ID
+    :param message: 用户本轮新消息
+    :param form: 表单，传入时覆盖服务端保存的表单
+    :param defer_form: 是否先返回回复、在后台更新表单
+    :param fill_mode: 回复与表单更新模式（two_call 或 single_call），为空时按配置
+    """
+    session_id: str
+    message: str
+    form: Dict[str, Any] | None = None
+    defer_form: bool = False
+    fill_mode: str | None = None
 
 
 class SecondBargainingResponse(BaseModel):
@@ -32,12 +66,26 @@ class SecondBargainingResponse(BaseModel):
     :param agent_response: 智能体回复内容
     :param status: 处理状态，1表示成功，0表示失败
     :param reference: 参考信息
+    :param session_id: 会话ID
+    :param form_version: 延迟表单更新的版本号，可据此查询或等待更新后的表单
     """
     form: Dict[str, Any] = {}
     is_manual: bool = False
     agent_response: str | None = ""
     status: str = "1"
     reference: str | None = ""
+    session_id: str | None = None
+    form_version: int | None = None
+
+
+def _ndjson(event: Dict[str, Any]) -> str:
+    """序列化单个 NDJSON 事件"""
+    return json.dumps(event, ensure_ascii=False) + "\n"
+
+
+def _ndjson_result(response: SecondBargainingResponse) -> str:
+    """序列化最终结果事件"""
+    return _ndjson({"type": "result", **response.model_dump()})
 
 
 class SecondBargainingService:
@@ -47,7 +95,14 @@ class SecondBargainingService:
         self.dispatch_agent = DispatchAgent()
         self.fill_agent = FillAgent()
         self.save_agent = SaveAgent()
+        self.fill_save_agent = FillSaveAgent(self.fill_agent, self.save_agent)
+        self.fill_mode_stats = {
+            "two_call": {"turns": 0, "seconds": 0.0},
+            "single_call": {"turns": 0, "seconds": 0.0, "fallbacks": 0}
+        }
         self.globalqa_agent = GlobalQAgent()
+        self.form_updates = FormUpdateManager()
+        self.session_store = create_session_store("secondbargaining")
         self.router = APIRouter(prefix="/secondbargaining")
         self._setup_routes()
         logger.info("Initialized SecondBargainingService")
@@ -55,6 +110,96 @@ class SecondBargainingService:
     def _setup_routes(self) -> None:
         """设置路由"""
         self.router.post("/process", response_model=SecondBargainingResponse)(self.process_request)
+        self.router.post("/process-stream")(self.process_request_stream)
+        self.router.get("/form/{session_id}")(self.get_form)
+        self.router.get("/fill-mode-stats")(self.get_fill_mode_stats)
+        self.router.post("/session/process", response_model=SecondBargainingResponse)(self.process_session_request)
+        self.router.get("/session/{session_id}")(self.get_session)
+        self.router.delete("/session/{session_id}")(self.delete_session)
+
+    async def get_fill_mode_stats(self) -> Dict[str, Any]:
+        """获取两种回复与表单更新模式的耗时对比统计"""
+        return {
+            "default_mode": settings.FILL_MODE,
+            **{
+                mode: {**stats, "avg_seconds": stats["seconds"] / stats["turns"] if stats["turns"] else 0.0}
+                for mode, stats in self.fill_mode_stats.items()
+            },
+            "single_call_agent": dict(self.fill_save_agent.stats)
+        }
+
+    async def get_form(self, session_id: str, version: Optional[int] = None, wait: float = 0.0) -> Dict[str, Any]:
+        """
+        查询延迟表单更新结果
+
+        :param session_id: 会话ID
+        :param version: 表单版本号，为空时查询最新版本
+        :param wait: 更新未完成时最长等待秒数（长轮询）
+        """
+        if wait > 0:
+            result = await self.form_updates.wait(session_id, version, timeout=min(wait, 60.0))
+        else:
+            result = self.form_updates.get(session_id, version)
+        if result is None:
+            raise HTTPException(status_code=404, detail="表单版本不存在")
+        return result
+
+    async def process_session_request(self, request: SecondBargainingSessionRequest) -> SecondBargainingResponse:
+        """
+        会话模式处理请求：从会话存储读取历史，追加本轮消息后走完整流程，再只回写新增消息；
+        同一会话的轮次持有会话锁串行执行
+
+        :param request: 会话模式请求对象
+        """
+        async with self.session_store.lock(request.session_id):
+            session = await self.session_store.get(request.session_id) or {"conversations": [], "form": {}}
+            form = request.form if request.form is not None else session["form"]
+            conversations = session["conversations"]
+            history_length = len(conversations)
+            conversations.append({"role": "user", "content": request.message})
+
+            # 历史记录来自服务端存储，无需再次校验
+            full_request = SecondBargainingRequest.model_construct(
+                form=form,
+                conversations=conversations,
+                status="1",
+                session_id=request.session_id,
+                defer_form=request.defer_form,
+                fill_mode=request.fill_mode
+            )
+            full_request._persist_session = True
+            full_request._form_from_session = request.form is None
+            response = await self.process_request(full_request)
+
+            new_messages = conversations[history_length:]
+            if response.agent_response and new_messages[-1].get("role") != "assistant":
+                new_messages.append({"role": "assistant", "content": response.agent_response})
+            await self.session_store.append_messages(request.session_id, new_messages)
+            if response.form_version is None:
+                # 延迟更新的表单由后台更新完成后按顺序回写
+                await self.session_store.set_form(request.session_id, response.form)
+        response.session_id = request.session_id
+        return response
+
+    async def get_session(self, session_id: str) -> Dict[str, Any]:
+        """
+        获取会话的聊天记录与表单
+
+        :param session_id: 会话ID
+        """
+        session = await self.session_store.get(session_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail="会话不存在")
+        return {"session_id": session_id, **session}
+
+    async def delete_session(self, session_id: str) -> Dict[str, Any]:
+        """
+        删除会话
+
+        :param session_id: 会话ID
+        """
+        await self.session_store.delete(session_id)
+        return {"session_id": session_id, "deleted": True}
 
     async def process_request(self, request: SecondBargainingRequest) -> SecondBargainingResponse:
         """
@@ -83,21 +228,7 @@ class SecondBargainingService:
             if route_code == "1":
                 # 转接至二次议价智能体
                 return await self._handle_fill_agent(request)
-            elif route_code == "2":
-                # 转接至全局QA智能体（预留接口）
-                return await self._handle_global_qa(request)
-            elif route_code == "3":
-                return SecondBargainingResponse(
-                    agent_response="好的，清单已确认，后续将按此推进合作",
-                    form=request.form,
-                    status="0",
-                )
-            else:
-                return SecondBargainingResponse(
-                    form=request.form,
-                    agent_response="",
-                    status="1"
-                )
+            return await self._handle_other_route(request, route_code)
 
         except Exception as e:
             logger.error(f"Error processing SecondBargaining request: {str(e)}")
@@ -106,9 +237,175 @@ class SecondBargainingService:
                 agent_response="",
             )
 
+    async def _handle_other_route(self, request: SecondBargainingRequest, route_code: str) -> SecondBargainingResponse:
+        """
+        处理非二次议价路由
+
+        :param request: 原始请求
+        :param route_code: 路由代码
+        """
+        if route_code == "2":
+            # 转接至全局QA智能体（预留接口）
+            return await self._handle_global_qa(request)
+        elif route_code == "3":
+            return SecondBargainingResponse(
+                agent_response="好的，清单已确认，后续将按此推进合作",
+                form=request.form,
+                status="0",
+            )
+        return SecondBargainingResponse(
+            form=request.form,
+            agent_response="",
+            status="1"
+        )
+
+    async def process_request_stream(self, request: SecondBargainingRequest) -> StreamingResponse:
+        """
+        流式处理二次议价请求，以 NDJSON 逐行推送
+
+        每行为一个事件：{"type": "delta", "content": ...} 为二次议价智能体回复片段，
+        最后一行 {"type": "result", ...} 为包含更新后表单的完整响应。
+
+        :param request: 统一请求对象
+        """
+        return StreamingResponse(self._stream_events(request), media_type="application/x-ndjson")
+
+    async def _stream_events(self, request: SecondBargainingRequest) -> AsyncGenerator[str, None]:
+        """
+        生成流式处理事件
+
+        :param request: 统一请求对象
+        """
+        try:
+            dispatch_request = DispatchRequest(
+                conversations=request.conversations
+            )
+            dispatch_response = await self.dispatch_agent.dispatch_route(dispatch_request)
+
+            if not dispatch_response.success:
+                yield _ndjson_result(SecondBargainingResponse(form=request.form, agent_response=""))
+                return
+
+            route_code = dispatch_response.route_code
+            logger.info(f"Dispatch agent returned route code: {route_code}")
+
+            if route_code != "1":
+                yield _ndjson_result(await self._handle_other_route(request, route_code))
+                return
+
+            # 二次议价智能体回复逐段推送，表单更新在回复结束后进行
+            chunks = []
+            async for chunk in self.fill_agent.process_stream({"conversations": request.conversations}):
+                chunks.append(chunk)
+                yield _ndjson({"type": "delta", "content": chunk})
+            fill_text = "".join(chunks).strip()
+
+            request.conversations.append({"role": "assistant", "content": fill_text})
+            save_request = SaveRequest(
+                conversations=request.conversations,
+                form=request.form
+            )
+            save_response = await self.save_agent.save_route(save_request)
+            logger.info(f"豆包回答: {fill_text}")
+            logger.info(f"表单:{save_response.updated_form}")
+
+            yield _ndjson_result(SecondBargainingResponse(
+                form=save_response.updated_form if save_response.success else request.form,
+                agent_response=fill_text,
+            ))
+
+        except Exception as e:
+            logger.error(f"Error streaming SecondBargaining request: {str(e)}")
+            yield _ndjson_result(SecondBargainingResponse(
+                form=request.form,
+                agent_response="",
+                status="1",
+                reference="666"
+            ))
+
+    def _defer_save(self, request: SecondBargainingRequest, agent_response: str) -> SecondBargainingResponse:
+        """
+        先返回智能体回复，表单更新提交到后台按会话顺序执行
+
+        :param request: 原始请求（聊天记录已包含本轮回复）
+        :param agent_response: 智能体回复内容
+        """
+        session_id = request.session_id or uuid.uuid4().hex
+        conversations = list(request.conversations)
+
+        async def update(base_form: Dict[str, Any]) -> Dict[str, Any]:
+            save_response = await self.save_agent.save_route(SaveRequest(conversations=conversations, form=base_form))
+            if not save_response.success:
+                raise RuntimeError(save_response.message)
+            return save_response.updated_form
+
+        async def persist(form: Dict[str, Any]) -> None:
+            await self.session_store.set_form(session_id, form)
+
+        async def load_form() -> Optional[Dict[str, Any]]:
+            # 以前一次后台更新回写后的会话表单为基础（包括其他工作进程写入的表单）
+            session = await self.session_store.get(session_id)
+            return session["form"] if session is not None else None
+
+        form_version = self.form_updates.submit(
+            session_id,
+            request.form,
+            update,
+            on_done=persist if request._persist_session else None,
+            load_form=load_form if request._form_from_session else None
+        )
+        return SecondBargainingResponse(
+            form=request.form,
+            agent_response=agent_response,
+            session_id=session_id,
+            form_version=form_version
+        )
+
     async def _handle_fill_agent(self, request: SecondBargainingRequest) -> SecondBargainingResponse:
         """
-        处理选号智能体流程
+        处理选号智能体流程，按模式选择单次调用或填写、保存两次调用
+
+        :param request: 原始请求
+        """
+        mode = request.fill_mode or settings.FILL_MODE
+        start_time = time.perf_counter()
+        try:
+            if mode == "single_call":
+                response = await self._handle_fill_save_agent(request)
+                if response is not None:
+                    return response
+                # 输出不符合格式时退回两次调用流程
+                self.fill_mode_stats["single_call"]["fallbacks"] += 1
+            return await self._handle_fill_and_save(request)
+        finally:
+            stats = self.fill_mode_stats.get(mode, self.fill_mode_stats["two_call"])
+            stats["turns"] += 1
+            stats["seconds"] += time.perf_counter() - start_time
+
+    async def _handle_fill_save_agent(self, request: SecondBargainingRequest) -> Optional[SecondBargainingResponse]:
+        """
+        单次调用同时生成回复与表单
+
+        :param request: 原始请求
+        :return: 处理结果，输出不符合格式或调用失败时返回None
+        """
+        result = await self.fill_save_agent.process({
+            "conversations": request.conversations,
+            "form": request.form
+        })
+        if not result["success"]:
+            return None
+        request.conversations.append({"role": "assistant", "content": result["response"]})
+        logger.info(f"豆包回答: {result['response']}")
+        logger.info(f"表单:{result['updated_form']}")
+        return SecondBargainingResponse(
+            form=result["updated_form"],
+            agent_response=result["response"]
+        )
+
+    async def _handle_fill_and_save(self, request: SecondBargainingRequest) -> SecondBargainingResponse:
+        """
+        填写、保存两次调用处理选号智能体流程
 
         :param request: 原始请求
         """
@@ -128,6 +425,9 @@ class SecondBargainingService:
                 )
             request.conversations.append({"role": "assistant", "content": fill_response.response})
             # 步骤5：调用保存智能体
+            if request.defer_form:
+                return self._defer_save(request, fill_response.response)
+
             save_request = SaveRequest(
                 conversations=request.conversations,
                 form=request.form
@@ -0,0 +1,191 @@
+import asyncio
+import json
+import time
+import weakref
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, AsyncContextManager, Dict, List, Optional
+
+from agents_system.config.settings import settings
+from agents_system.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+class SessionStore(ABC):
+    """会话存储基类，按会话ID保存聊天记录与表单"""
+
+    def __init__(self):
+        self._locks: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+
+    def lock(self, session_id: str) -> AsyncContextManager:
+        """
+        获取会话锁，同一会话的“读取-追加-回写”串行执行，避免并发轮次互相覆盖
+
+        :param session_id: 会话ID
+        :return: 异步上下文管理器（默认为进程内锁）
+        """
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[session_id] = lock
+        return lock
+
+    @abstractmethod
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """
+        获取会话
+
+        :param session_id: 会话ID
+        :return: 包含 conversations 与 form 的字典，不存在时返回None
+        """
+
+    @abstractmethod
+    async def append_messages(self, session_id: str, messages: List[Dict[str, str]]) -> None:
+        """
+        向会话追加聊天记录
+
+        :param session_id: 会话ID
+        :param messages: 新增的消息
+        """
+
+    @abstractmethod
+    async def set_form(self, session_id: str, form: Dict[str, Any]) -> None:
+        """
+        更新会话表单
+
+        :param session_id: 会话ID
+        :param form: 表单内容
+        """
+
+    @abstractmethod
+    async def delete(self, session_id: str) -> None:
+        """
+        删除会话
+
+        :param session_id: 会话ID
+        """
+
+    async def close(self) -> None:
+        """释放存储连接"""
+
+
+class InMemorySessionStore(SessionStore):
+    """进程内会话存储，按最近访问淘汰并支持过期"""
+
+    def __init__(self, ttl: float, max_sessions: int):
+        super().__init__()
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions: OrderedDict = OrderedDict()
+
+    def _touch(self, session_id: str, create: bool = False) -> Optional[Dict[str, Any]]:
+        """获取会话并刷新访问时间，过期会话视为不存在"""
+        now = time.monotonic()
+        session = self._sessions.get(session_id)
+        if session is not None and now - session["touched_at"] > self.ttl:
+            del self._sessions[session_id]
+            session = None
+        if session is None:
+            if not create:
+                return None
+            session = {"conversations": [], "form": {}, "touched_at": now}
+            self._sessions[session_id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        session["touched_at"] = now
+        self._sessions.move_to_end(session_id)
+        return session
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        session = self._touch(session_id)
+        if session is None:
+            return None
+        return {"conversations": list(session["conversations"]), "form": dict(session["form"])}
+
+    async def append_messages(self, session_id: str, messages: List[Dict[str, str]]) -> None:
+        self._touch(session_id, create=True)["conversations"].extend(messages)
+
+    async def set_form(self, session_id: str, form: Dict[str, Any]) -> None:
+        self._touch(session_id, create=True)["form"] = dict(form)
+
+    async def delete(self, session_id: str) -> None:
+        self._sessions.pop(session_id, None)
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Redis会话存储
+
+    聊天记录保存为 Redis 列表，每轮只追加新消息；表单单独保存为JSON字符串，两者共享过期时间。
+    会话锁为 Redis 分布式锁，多个工作进程处理同一会话时同样串行。
+    """
+
+    def __init__(self, url: str, ttl: float, namespace: str, lock_timeout: float = 120.0):
+        import redis.asyncio as redis
+
+        super().__init__()
+        self.ttl = int(ttl)
+        self.lock_timeout = lock_timeout
+        self.namespace = namespace
+        self._redis = redis.from_url(url, decode_responses=True)
+
+    def _keys(self, session_id: str) -> tuple:
+        """会话对应的聊天记录键与表单键"""
+        prefix = f"{self.namespace}:session:{session_id}"
+        return f"{prefix}:conversations", f"{prefix}:form"
+
+    def lock(self, session_id: str) -> AsyncContextManager:
+        return self._redis.lock(
+            f"{self.namespace}:session:{session_id}:lock",
+            timeout=self.lock_timeout,
+            blocking_timeout=self.lock_timeout
+        )
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        conversations_key, form_key = self._keys(session_id)
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.lrange(conversations_key, 0, -1)
+            pipe.get(form_key)
+            pipe.expire(conversations_key, self.ttl)
+            pipe.expire(form_key, self.ttl)
+            messages, form, _, _ = await pipe.execute()
+        if not messages and form is None:
+            return None
+        return {
+            "conversations": [json.loads(message) for message in messages],
+            "form": json.loads(form) if form else {}
+        }
+
+    async def append_messages(self, session_id: str, messages: List[Dict[str, str]]) -> None:
+        if not messages:
+            return
+        conversations_key, _ = self._keys(session_id)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.rpush(conversations_key, *[json.dumps(message, ensure_ascii=False) for message in messages])
+            pipe.expire(conversations_key, self.ttl)
+            await pipe.execute()
+
+    async def set_form(self, session_id: str, form: Dict[str, Any]) -> None:
+        _, form_key = self._keys(session_id)
+        await self._redis.set(form_key, json.dumps(form, ensure_ascii=False), ex=self.ttl)
+
+    async def delete(self, session_id: str) -> None:
+        await self._redis.delete(*self._keys(session_id))
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+def create_session_store(namespace: str) -> SessionStore:
+    """
+    按配置创建会话存储
+
+    :param namespace: 命名空间，区分不同业务流程的会话
+    :return: 会话存储实例
+    """
+    if settings.SESSION_STORE_BACKEND == "redis":
+        logger.info(f"Using Redis session store for {namespace}")
+        return RedisSessionStore(settings.REDIS_URL, settings.SESSION_TTL, namespace, settings.SESSION_LOCK_TIMEOUT)
+    return InMemorySessionStore(settings.SESSION_TTL, settings.SESSION_MAX_SESSIONS)
@@ -0,0 +1,228 @@
+import itertools
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from agents_system.config.settings import settings
+from agents_system.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+# 逻辑队列：tasks 为待处理任务，results 为处理结果，dead 为超过重试次数的死信
+TASKS = "tasks"
+RESULTS = "results"
+DEAD = "dead"
+
+# (投递标签, 消息)
+Delivery = Tuple[Any, Dict[str, Any]]
+
+
+class TaskBroker(ABC):
+    """
+    批量任务消息代理
+
+    消息至少投递一次：消费方处理完成后 ack，处理失败时按延迟重新发布到任务队列，超过重试次数后转入死信队列。
+    方法均为同步调用，异步代码中通过 asyncio.to_thread 调用。
+    """
+
+    @abstractmethod
+    def publish(self, queue_name: str, message: Dict[str, Any], delay_ms: int = 0) -> None:
+        """
+        发布消息
+
+        :param queue_name: 逻辑队列名（tasks/results/dead）
+        :param message: 消息内容
+        :param delay_ms: 延迟投递毫秒数（用于重试）
+        """
+
+    @abstractmethod
+    def get(self, queue_name: str) -> Optional[Delivery]:
+        """
+        取出一条消息（不阻塞），处理完成后需调用 ack 或 dead_letter
+
+        :param queue_name: 逻辑队列名
+        :return: (投递标签, 消息)，队列为空时返回None
+        """
+
+    @abstractmethod
+    def ack(self, delivery_tag: Any) -> None:
+        """
+        确认消息已处理
+
+        :param delivery_tag: 投递标签
+        """
+
+    @abstractmethod
+    def dead_letter(self, delivery_tag: Any) -> None:
+        """
+        拒绝消息并转入死信队列
+
+        :param delivery_tag: 投递标签
+        """
+
+    def queue_sizes(self) -> Dict[str, int]:
+        """获取各队列的消息数"""
+        return {}
+
+    def close(self) -> None:
+        """关闭连接"""
+
+
+class InMemoryBroker(TaskBroker):
+    """进程内消息代理（本地测试替身），语义与 RabbitMQ 实现一致，未确认的消息在 close 前不会丢失"""
+
+    def __init__(self):
+        self._queues: Dict[str, Deque[Tuple[float, Dict[str, Any]]]] = {TASKS: deque(), RESULTS: deque(), DEAD: deque()}
+        self._unacked: Dict[int, Tuple[str, Dict[str, Any]]] = {}
+        self._tags = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def publish(self, queue_name: str, message: Dict[str, Any], delay_ms: int = 0) -> None:
+        # 序列化一次，与真实代理一样不共享可变对象
+        payload = json.loads(json.dumps(message, ensure_ascii=False))
+        with self._lock:
+            self._queues[queue_name].append((time.monotonic() + delay_ms / 1000, payload))
+
+    def get(self, queue_name: str) -> Optional[Delivery]:
+        now = time.monotonic()
+        with self._lock:
+            queue = self._queues[queue_name]
+            for i, (ready_at, message) in enumerate(queue):
+                if ready_at <= now:
+                    del queue[i]
+                    tag = next(self._tags)
+                    self._unacked[tag] = (queue_name, message)
+                    return tag, message
+        return None
+
+    def ack(self, delivery_tag: Any) -> None:
+        with self._lock:
+            self._unacked.pop(delivery_tag, None)
+
+    def dead_letter(self, delivery_tag: Any) -> None:
+        with self._lock:
+            delivery = self._unacked.pop(delivery_tag, None)
+            if delivery is not None:
+                self._queues[DEAD].append((0.0, delivery[1]))
+
+    def queue_sizes(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                **{name: len(queue) for name, queue in self._queues.items()},
+                "unacked": len(self._unacked)
+            }
+
+
+class RabbitMQBroker(TaskBroker):
+    """
+    RabbitMQ 消息代理（pika）
+
+    队列均为持久化队列，消息持久化投递：
+    - {prefix}.tasks：任务队列，被拒绝的消息经死信路由进入 {prefix}.dead
+    - {prefix}.retry：重试队列，消息按 expiration 过期后经死信路由回到任务队列，实现延迟重试
+    - {prefix}.results：结果队列，由收集方消费
+    pika 的阻塞连接不是线程安全的，所有操作在同一个专用线程中执行。
+    """
+
+    def __init__(self, url: Optional[str] = None, prefix: Optional[str] = None):
+        self.url = url or settings.RABBITMQ_URL
+        prefix = prefix or settings.TASK_QUEUE_PREFIX
+        self.queue_names = {TASKS: f"{prefix}.tasks", RESULTS: f"{prefix}.results", DEAD: f"{prefix}.dead"}
+        self.retry_queue = f"{prefix}.retry"
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rabbitmq")
+        self._connection = None
+        self._channel = None
+
+    def _call(self, fn: Callable[[], Any]) -> Any:
+        """在专用线程中执行操作，连接异常时丢弃连接，下次调用重新连接（未确认的消息由代理重新投递）"""
+        def run():
+            import pika
+            try:
+                if self._channel is None or self._channel.is_closed:
+                    self._connect()
+                return fn()
+            except (pika.exceptions.AMQPConnectionError, pika.exceptions.AMQPChannelError):
+                self._connection = self._channel = None
+                raise
+        return self._executor.submit(run).result()
+
+    def _connect(self) -> None:
+        """建立连接并声明队列拓扑"""
+        import pika
+        if self._connection is not None and self._connection.is_open:
+            self._connection.close()
+        self._connection = pika.BlockingConnection(pika.URLParameters(self.url))
+        channel = self._connection.channel()
+        channel.queue_declare(self.queue_names[DEAD], durable=True)
+        channel.queue_declare(self.queue_names[RESULTS], durable=True)
+        channel.queue_declare(self.queue_names[TASKS], durable=True, arguments={
+            "x-dead-letter-exchange": "",
+            "x-dead-letter-routing-key": self.queue_names[DEAD]
+        })
+        channel.queue_declare(self.retry_queue, durable=True, arguments={
+            "x-dead-letter-exchange": "",
+            "x-dead-letter-routing-key": self.queue_names[TASKS]
+        })
+        self._channel = channel
+        logger.info(f"Connected to RabbitMQ, task queue {self.queue_names[TASKS]}")
+
+    def publish(self, queue_name: str, message: Dict[str, Any], delay_ms: int = 0) -> None:
+        import pika
+        routing_key = self.retry_queue if delay_ms > 0 else self.queue_names[queue_name]
+        properties = pika.BasicProperties(
+            content_type="application/json",
+            delivery_mode=2,
+            expiration=str(int(delay_ms)) if delay_ms > 0 else None
+        )
+        body = json.dumps(message, ensure_ascii=False).encode("utf-8")
+        self._call(lambda: self._channel.basic_publish("", routing_key, body, properties))
+
+    def get(self, queue_name: str) -> Optional[Delivery]:
+        def fetch():
+            method, _, body = self._channel.basic_get(self.queue_names[queue_name], auto_ack=False)
+            if method is None:
+                # 空闲时处理心跳等网络事件
+                self._connection.process_data_events(0)
+                return None
+            return method.delivery_tag, json.loads(body)
+        return self._call(fetch)
+
+    def ack(self, delivery_tag: Any) -> None:
+        self._call(lambda: self._channel.basic_ack(delivery_tag))
+
+    def dead_letter(self, delivery_tag: Any) -> None:
+        self._call(lambda: self._channel.basic_reject(delivery_tag, requeue=False))
+
+    def queue_sizes(self) -> Dict[str, int]:
+        def sizes():
+            return {
+                name: self._channel.queue_declare(queue, passive=True).method.message_count
+                for name, queue in {**self.queue_names, "retry": self.retry_queue}.items()
+            }
+        return self._call(sizes)
+
+    def close(self) -> None:
+        def close_connection():
+            if self._connection is not None and self._connection.is_open:
+                self._connection.close()
+            self._connection = self._channel = None
+        self._executor.submit(close_connection).result()
+        self._executor.shutdown()
+
+
+def create_task_broker() -> TaskBroker:
+    """
+    按配置创建消息代理
+
+    :return: TASK_BROKER_BACKEND 为 rabbitmq 时返回 RabbitMQ 代理，memory 时返回进程内代理
+    """
+    if settings.TASK_BROKER_BACKEND == "rabbitmq":
+        return RabbitMQBroker()
+    if settings.TASK_BROKER_BACKEND == "memory":
+        return InMemoryBroker()
+    raise ValueError(f"不支持的消息代理: {settings.TASK_BROKER_BACKEND}")
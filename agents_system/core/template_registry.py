@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from jinja2 import Template
+
+from agents_system.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+class _CompiledTemplate:
+    """已编译的模板及其来源信息"""
+
+    def __init__(self, template: Template, mtime: Optional[float]):
+        self.template = template
+        self.mtime = mtime
+        self.checked_at = time.monotonic()
+
+
+class TemplateRegistry:
+    """
+    提示词模板注册表
+
+    每个模板只读取并编译一次；文件模板在 mtime 变化时自动重新加载，
+    且两次 mtime 检查之间至少间隔 check_interval 秒，避免每次请求都访问磁盘。
+    """
+
+    def __init__(self, check_interval: float = 1.0):
+        self.check_interval = check_interval
+        self._templates: Dict[str, _CompiledTemplate] = {}
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def _compile(self, name: str, source: str, mtime: Optional[float]) -> _CompiledTemplate:
+        """编译模板并记录耗时"""
+        start_time = time.perf_counter()
+        compiled = _CompiledTemplate(Template(source), mtime)
+        elapsed = time.perf_counter() - start_time
+        stats = self._stats.setdefault(name, {"compiles": 0, "compile_seconds": 0.0, "renders": 0, "render_seconds": 0.0})
+        stats["compiles"] += 1
+        stats["compile_seconds"] += elapsed
+        logger.info(f"Compiled template {name} in {elapsed * 1000:.2f}ms")
+        return compiled
+
+    def get_file(self, path: str) -> Template:
+        """
+        获取文件模板，文件修改后自动重新编译
+
+        :param path: 模板文件路径
+        :return: 编译后的模板
+        """
+        compiled = self._templates.get(path)
+        now = time.monotonic()
+        if compiled is not None and now - compiled.checked_at < self.check_interval:
+            return compiled.template
+
+        with self._lock:
+            compiled = self._templates.get(path)
+            mtime = os.stat(path).st_mtime
+            if compiled is None or compiled.mtime != mtime:
+                with open(path, 'r', encoding='utf-8') as f:
+                    source = f.read()
+                if compiled is not None:
+                    logger.info(f"Template file changed, reloading: {path}")
+                compiled = self._compile(path, source, mtime)
+                self._templates[path] = compiled
+            compiled.checked_at = now
+            return compiled.template
+
+    def get_string(self, name: str, source: str) -> Template:
+        """
+        获取字符串模板，按名称缓存，只编译一次
+
+        :param name: 模板名称
+        :param source: 模板内容
+        :return: 编译后的模板
+        """
+        compiled = self._templates.get(name)
+        if compiled is None:
+            with self._lock:
+                compiled = self._templates.get(name)
+                if compiled is None:
+                    compiled = self._compile(name, source, None)
+                    self._templates[name] = compiled
+        return compiled.template
+
+    def _render(self, name: str, template: Template, context: Dict[str, Any]) -> str:
+        """渲染模板并记录耗时"""
+        start_time = time.perf_counter()
+        result = template.render(**context)
+        stats = self._stats[name]
+        stats["renders"] += 1
+        stats["render_seconds"] += time.perf_counter() - start_time
+        return result
+
+    def render_file(self, path: str, **context) -> str:
+        """
+        渲染文件模板
+
+        :param path: 模板文件路径
+        :param context: 模板变量
+        :return: 渲染结果
+        """
+        return self._render(path, self.get_file(path), context)
+
+    def render_string(self, name: str, source: str, **context) -> str:
+        """
+        渲染字符串模板
+
+        :param name: 模板名称
+        :param source: 模板内容
+        :param context: 模板变量
+        :return: 渲染结果
+        """
+        return self._render(name, self.get_string(name, source), context)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """获取各模板的编译与渲染耗时统计"""
+        return {
+            name: {
+                **stats,
+                "avg_render_ms": stats["render_seconds"] * 1000 / stats["renders"] if stats["renders"] else 0.0
+            }
+            for name, stats in self._stats.items()
+        }
+
+
+# 全局模板注册表实例
+template_registry = TemplateRegistry()
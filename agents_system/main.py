@@ -1,3 +1,4 @@
+import asyncio
 import sys
 import os
 
@@ -13,11 +14,17 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from config.settings import settings
-from core.registry import registry
-from core.choose_number_service import unified_service
+from agents_system.config.settings import settings
+from agents_system.core.batch_jobs import BatchJobService
+from agents_system.core.record_store import close_record_store
+from agents_system.core.registry import registry
+from agents_system.core.task_queue import create_task_broker
+from agents_system.core.template_registry import template_registry
+from agents_system.core.choose_number_service import unified_service
+from agents_system.models.embedding import close_embedding_model, get_embedding_model
+from agents_system.utils.similarity_retrieve_json import get_retrieval_index
 
-from utils.logger import get_logger
+from agents_system.utils.logger import get_logger
 
 logger = get_logger(__name__)
 
@@ -62,6 +69,16 @@ app.include_router(rebate_identification_agent.router)
 app.include_router(unified_service.router)
 app.include_router(SecondBargaining_service.router)
 
+# 批量任务服务（提交后异步执行，按记录检查点续跑；队列模式下由 worker.py 工作进程处理）
+batch_job_service = BatchJobService(
+    {
+        "rebate-identification": lambda record: rebate_identification_agent.process_record(record, raise_errors=True),
+        "conversation-process": lambda record: conversation_processor_agent.process_record(record, raise_errors=True)
+    },
+    broker=create_task_broker() if settings.BATCH_JOB_EXECUTOR == "queue" else None
+)
+app.include_router(batch_job_service.router)
+
 # 添加根路径
 @app.get("/")
 async def root():
@@ -71,10 +88,77 @@ async def root():
         "agents": registry.list_agents()
     }
 
+@app.on_event("startup")
+async def startup():
+    """预加载全局QA知识库索引，避免首个问题承担加载耗时；数据库数据源同时启动后台增量同步；恢复未完成的批量任务"""
+    if settings.QA_SOURCE == "file":
+        await asyncio.to_thread(get_retrieval_index().refresh)
+    else:
+        await get_retrieval_index().start()
+    await batch_job_service.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    """关闭所有智能体共享的豆包连接池、向量模型与会话存储，停止批量任务（重启后续跑）"""
+    await batch_job_service.close()
+    close_record_store()
+    await registry.close_model()
+    await close_embedding_model()
+    if settings.QA_SOURCE != "file":
+        await get_retrieval_index().stop()
+    await unified_service.session_store.close()
+    await SecondBargaining_service.session_store.close()
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics/doubao")
+async def doubao_metrics():
+    return registry.get_model().stats()
+
+@app.get("/metrics/templates")
+async def template_metrics():
+    return template_registry.stats()
+
+@app.get("/metrics/retrieval")
+async def retrieval_metrics():
+    return {
+        **get_retrieval_index().stats(),
+        "global_qa": {
+            "choose_number": unified_service.globalqa_agent.stats,
+            "second_bargaining": SecondBargaining_service.globalqa_agent.stats
+        }
+    }
+
+@app.get("/metrics/embedding")
+async def embedding_metrics():
+    return get_embedding_model().stats()
+
+@app.get("/metrics/batch-dedup")
+async def batch_dedup_metrics():
+    return {
+        name: agent.deduplicator.stats()
+        for name, agent in (
+            ("rebate_identification", rebate_identification_agent),
+            ("conversation_process", conversation_processor_agent)
+        )
+        if agent.deduplicator is not None
+    }
+
+@app.get("/metrics/rebate-packing")
+async def rebate_packing_metrics():
+    packer = rebate_identification_agent.packer
+    return packer.stats() if packer is not None else {}
+
+@app.get("/metrics/pre-router")
+async def pre_router_metrics():
+    return {
+        name: service.dispatch_agent.pre_router.stats()
+        for name, service in (("choose_number", unified_service), ("second_bargaining", SecondBargaining_service))
+        if service.dispatch_agent.pre_router is not None
+    }
+
 if __name__ == "__main__":
     import uvicorn
     logger.info("Starting Agents System")
@@ -1,8 +1,17 @@
+import asyncio
+import hashlib
 import json
+import random
+import sqlite3
+import threading
+import time
 import httpx
 import sys
 import os
-from typing import Optional, Dict, Any, AsyncGenerator
+from collections import deque, OrderedDict
+from contextlib import aclosing, asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Any, AsyncGenerator, AsyncIterator, Callable, Deque
 
 from agents_system.config.settings import settings
 from agents_system.utils.logger import get_logger
@@ -14,68 +23,636 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 logger = get_logger(__name__)
 
 
+def _build_http_client() -> httpx.AsyncClient:
+    """
+    按配置构建带连接池的HTTP客户端
+
+    :return: 复用 keep-alive 连接的异步客户端
+    """
+    limits = httpx.Limits(
+        max_connections=settings.DOUBAO_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.DOUBAO_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.DOUBAO_KEEPALIVE_EXPIRY
+    )
+    http2 = settings.DOUBAO_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("DOUBAO_HTTP2 已开启但未安装 h2 依赖，回退到 HTTP/1.1")
+            http2 = False
+    return httpx.AsyncClient(limits=limits, http2=http2, timeout=settings.DOUBAO_TIMEOUT)
+
+
+def _is_overload_error(error: BaseException) -> bool:
+    """
+    判断异常是否表示服务端过载（429/5xx/超时），用于触发并发回退
+
+    :param error: 调用过程中抛出的异常
+    :return: 是否为过载信号
+    """
+    if isinstance(error, httpx.TimeoutException):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        status_code = error.response.status_code
+        return status_code == 429 or status_code >= 500
+    return False
+
+
+class AdaptiveLimiter:
+    """
+    AIMD自适应并发限制器
+
+    延迟与错误率健康时加性增大并发窗口（每轮约 +1），
+    遇到 429/5xx/超时时乘性减小，且同一延迟窗口内只回退一次，避免连续过载信号把窗口压到底。
+    """
+
+    def __init__(self, name: str, initial_limit: int, min_limit: int, max_limit: int,
+                 latency_target: float, decrease_factor: float = 0.5, error_rate_threshold: float = 0.1):
+        self.name = name
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.error_rate_threshold = error_rate_threshold
+        self.in_flight = 0
+        self.latency_ewma: Optional[float] = None
+        self.error_rate_ewma = 0.0
+        self._last_decrease = 0.0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._stats = {"requests": 0, "overloads": 0, "errors": 0, "increases": 0, "decreases": 0}
+
+    async def acquire(self) -> None:
+        """等待直到在途请求数低于当前并发窗口"""
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                elif waiter.done() and not waiter.cancelled():
+                    # 已被唤醒却被取消，把机会让给下一个等待者
+                    self._wake_waiters()
+                raise
+        self.in_flight += 1
+
+    def _wake_waiters(self) -> None:
+        """按空闲槽位数唤醒等待者"""
+        free_slots = int(self.limit) - self.in_flight
+        while free_slots > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free_slots -= 1
+
+    def release(self, latency: float, error: Optional[BaseException] = None, record: bool = True) -> None:
+        """
+        释放并发槽位，并根据本次调用结果调整并发窗口
+
+        :param latency: 本次调用耗时（秒）
+        :param error: 本次调用抛出的异常，成功时为None
+        :param record: 是否将本次调用计入窗口调整（被取消的调用不计入）
+        """
+        self.in_flight -= 1
+        if record:
+            self._record(latency, error)
+        self._wake_waiters()
+
+    def _record(self, latency: float, error: Optional[BaseException]) -> None:
+        """根据单次调用的耗时与结果执行 AIMD 调整"""
+        self._stats["requests"] += 1
+        self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+        self.error_rate_ewma = 0.9 * self.error_rate_ewma + (0.1 if error is not None else 0.0)
+
+        if error is not None and _is_overload_error(error):
+            self._stats["overloads"] += 1
+            now = time.monotonic()
+            if now - self._last_decrease >= (self.latency_ewma or 0.0):
+                self.limit = max(float(self.min_limit), self.limit * self.decrease_factor)
+                self._last_decrease = now
+                self._stats["decreases"] += 1
+                logger.warning(f"Doubao {self.name} 并发池过载，并发窗口回退至 {int(self.limit)}")
+        elif error is not None:
+            self._stats["errors"] += 1
+        elif latency <= self.latency_target and self.error_rate_ewma < self.error_rate_threshold:
+            if self.in_flight + 1 >= int(self.limit):
+                # 仅在窗口被用满时增长，避免空闲时窗口无限膨胀
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+                self._stats["increases"] += 1
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """占用一个并发槽位，退出时按耗时与异常调整窗口"""
+        await self.acquire()
+        start_time = time.monotonic()
+        error: Optional[BaseException] = None
+        cancelled = False
+        try:
+            yield
+        except (asyncio.CancelledError, GeneratorExit):
+            cancelled = True
+            raise
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.release(time.monotonic() - start_time, error, record=not cancelled)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取并发池统计信息"""
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "latency_ewma": self.latency_ewma,
+            "error_rate_ewma": round(self.error_rate_ewma, 4),
+            **self._stats
+        }
+
+
+def _build_limiters() -> Dict[str, AdaptiveLimiter]:
+    """
+    按配置构建交互与批处理两个独立的并发池
+
+    :return: 并发池名称到限制器的映射
+    """
+    return {
+        "interactive": AdaptiveLimiter(
+            name="interactive",
+            initial_limit=settings.DOUBAO_INTERACTIVE_INITIAL_CONCURRENCY,
+            min_limit=settings.DOUBAO_MIN_CONCURRENCY,
+            max_limit=settings.DOUBAO_INTERACTIVE_MAX_CONCURRENCY,
+            latency_target=settings.DOUBAO_LATENCY_TARGET
+        ),
+        "batch": AdaptiveLimiter(
+            name="batch",
+            initial_limit=settings.DOUBAO_BATCH_INITIAL_CONCURRENCY,
+            min_limit=settings.DOUBAO_MIN_CONCURRENCY,
+            max_limit=settings.DOUBAO_BATCH_MAX_CONCURRENCY,
+            latency_target=settings.DOUBAO_LATENCY_TARGET
+        ),
+    }
+
+
+async def _iter_sse_data(response: httpx.Response) -> AsyncIterator[str]:
+    """
+    按 SSE 协议逐事件解析响应流
+
+    事件以空行分隔，同一事件内的多行 data 以换行拼接；
+    按行缓冲读取，因此事件跨 TCP 分片或多个事件落在同一分片时都能正确切分。
+
+    :param response: 流式HTTP响应
+    :return: 每个事件的 data 内容
+    """
+    data_lines = []
+    async for line in response.aiter_lines():
+        line = line.rstrip("\r")
+        if not line:
+            if data_lines:
+                yield "\n".join(data_lines)
+                data_lines = []
+            continue
+        if line.startswith(":"):
+            # 注释行（心跳）
+            continue
+        field, _, value = line.partition(":")
+        if field == "data":
+            data_lines.append(value[1:] if value.startswith(" ") else value)
+    if data_lines:
+        yield "\n".join(data_lines)
+
+
+class RetryPolicy:
+    """带抖动的指数退避重试策略，优先遵循服务端返回的 Retry-After"""
+
+    def __init__(self, max_retries: int, base_delay: float, max_delay: float):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @staticmethod
+    def is_retryable(error: BaseException) -> bool:
+        """
+        判断异常是否值得重试
+
+        :param error: 调用过程中抛出的异常
+        :return: 过载或网络传输错误时返回True
+        """
+        return _is_overload_error(error) or isinstance(error, httpx.TransportError)
+
+    @staticmethod
+    def _parse_retry_after(error: BaseException) -> Optional[float]:
+        """从 429/503 响应的 Retry-After 头中解析等待秒数"""
+        if not isinstance(error, httpx.HTTPStatusError):
+            return None
+        retry_after = error.response.headers.get("Retry-After")
+        if not retry_after:
+            return None
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def compute_delay(self, attempt: int, error: BaseException) -> float:
+        """
+        计算第 attempt 次重试前的等待时间
+
+        :param attempt: 重试序号，从0开始
+        :param error: 触发重试的异常
+        :return: 等待秒数
+        """
+        retry_after = self._parse_retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        # full jitter：在 [0, base * 2^attempt] 内均匀取值，避免重试同步成风暴
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+class LatencyTracker:
+    """记录最近成功调用的耗时，用于推算对冲请求的触发延迟"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self._samples: Deque[float] = deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def record(self, latency: float) -> None:
+        """记录一次成功调用的耗时"""
+        self._samples.append(latency)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        获取耗时分位数
+
+        :param q: 分位点，取值 0~1
+        :return: 分位数耗时，样本不足时返回None
+        """
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class CompletionCache:
+    """
+    内容寻址的补全结果缓存
+
+    以 模型 + 完整提示词 + 生成参数 的哈希为键，内存LRU为一级缓存，SQLite为二级持久化缓存，
+    两级均按TTL过期，并分别按条目数上限淘汰最久未使用的记录。
+    """
+
+    def __init__(self, max_entries: int, ttl: float, db_path: Optional[str] = None, max_db_entries: int = 100000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_db_entries = max_db_entries
+        self._memory: OrderedDict = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        if db_path:
+            db_dir = os.path.dirname(db_path)
+            if db_dir and not os.path.exists(db_dir):
+                os.makedirs(db_dir)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS completion_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_completion_cache_accessed ON completion_cache(accessed_at)")
+            self._db.commit()
+
+    @staticmethod
+    def make_key(model: str, prompt: str, params: Dict[str, Any]) -> str:
+        """
+        生成缓存键
+
+        :param model: 模型名称
+        :param prompt: 渲染后的提示词
+        :param params: 生成参数
+        :return: 十六进制哈希
+        """
+        raw = json.dumps({"model": model, "prompt": prompt, "params": params}, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Optional[str]:
+        """
+        读取缓存，内存未命中时查询SQLite并回填内存
+
+        :param key: 缓存键
+        :return: 缓存的文本，未命中或已过期时返回None
+        """
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            value, created_at = entry
+            if now - created_at <= self.ttl:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return value
+            del self._memory[key]
+
+        if self._db is not None:
+            row = await asyncio.to_thread(self._db_get, key, now)
+            if row is not None:
+                value, created_at = row
+                self._memory_set(key, value, created_at)
+                self._stats["disk_hits"] += 1
+                return value
+
+        self._stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: str) -> None:
+        """
+        写入缓存
+
+        :param key: 缓存键
+        :param value: 生成的文本
+        """
+        now = time.time()
+        self._memory_set(key, value, now)
+        if self._db is not None:
+            await asyncio.to_thread(self._db_set, key, value, now)
+
+    def _memory_set(self, key: str, value: str, created_at: float) -> None:
+        """写入内存LRU并按容量淘汰"""
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _db_get(self, key: str, now: float) -> Optional[tuple]:
+        """从SQLite读取未过期的记录并刷新访问时间"""
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT value, created_at FROM completion_cache WHERE key = ? AND created_at >= ?",
+                (key, now - self.ttl)
+            ).fetchone()
+            if row is not None:
+                self._db.execute("UPDATE completion_cache SET accessed_at = ? WHERE key = ?", (now, key))
+                self._db.commit()
+            return row
+
+    def _db_set(self, key: str, value: str, now: float) -> None:
+        """写入SQLite，并清理过期记录与超出容量的最久未访问记录"""
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO completion_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            self._db.execute("DELETE FROM completion_cache WHERE created_at < ?", (now - self.ttl,))
+            self._db.execute(
+                "DELETE FROM completion_cache WHERE key IN ("
+                "SELECT key FROM completion_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_db_entries,)
+            )
+            self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存命中统计"""
+        return {"memory_entries": len(self._memory), **self._stats}
+
+    def close(self) -> None:
+        """关闭SQLite连接"""
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
+
+
 class DoubaoModel:
     """豆包大模型调用接口"""
     
-    def __init__(self):
+    def __init__(self, client: Optional[httpx.AsyncClient] = None):
         self.api_key = settings.DOUBAO_API_KEY
         self.model_name = settings.DOUBAO_MODEL_NAME
-        self.client = httpx.AsyncClient()
+        self.url = f"{settings.DOUBAO_BASE_URL.rstrip('/')}/chat/completions"
+        self.client = client or _build_http_client()
+        self.limiters = _build_limiters()
+        self.retry_policy = RetryPolicy(
+            max_retries=settings.DOUBAO_MAX_RETRIES,
+            base_delay=settings.DOUBAO_RETRY_BASE_DELAY,
+            max_delay=settings.DOUBAO_RETRY_MAX_DELAY
+        )
+        self.latency_trackers: Dict[str, LatencyTracker] = {name: LatencyTracker() for name in self.limiters}
+        self.hedge_stats = {"hedged": 0, "hedge_wins": 0}
+        self._cache: Optional[CompletionCache] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.coalesce_stats = {"hits": 0, "misses": 0}
+        self.early_stop_stats = {"calls": 0, "early_stops": 0}
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
         logger.info(f"Initialized DoubaoModel with model: {self.model_name}")
     
-    async def generate_text(self, prompt: str, **kwargs) -> str:
+    def _get_limiter(self, pool: str) -> AdaptiveLimiter:
+        """获取指定名称的并发池，未知名称回退到交互池"""
+        return self.limiters.get(pool) or self.limiters["interactive"]
+
+    def limiter_stats(self) -> Dict[str, Dict[str, Any]]:
+        """获取各并发池的统计信息"""
+        return {name: limiter.stats() for name, limiter in self.limiters.items()}
+
+    @property
+    def cache(self) -> CompletionCache:
+        """获取响应缓存，首次有智能体开启缓存时才创建"""
+        if self._cache is None:
+            self._cache = CompletionCache(
+                max_entries=settings.DOUBAO_CACHE_MAX_ENTRIES,
+                ttl=settings.DOUBAO_CACHE_TTL,
+                db_path=settings.DOUBAO_CACHE_DB_PATH,
+                max_db_entries=settings.DOUBAO_CACHE_MAX_DB_ENTRIES
+            )
+        return self._cache
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """获取响应缓存统计信息"""
+        return self._cache.stats() if self._cache is not None else {}
+
+    def stats(self) -> Dict[str, Any]:
+        """获取并发池、缓存、请求合并、对冲与流式提前终止的汇总统计"""
+        return {
+            "limiters": self.limiter_stats(),
+            "cache": self.cache_stats(),
+            "coalesce": {"in_flight": len(self._inflight), **self.coalesce_stats},
+            "hedge": dict(self.hedge_stats),
+            "early_stop": dict(self.early_stop_stats)
+        }
+
+    async def generate_text(self, prompt: str, pool: str = "interactive", hedge: Optional[bool] = None,
+                            cache: bool = False, coalesce: Optional[bool] = None, **kwargs) -> str:
         """
         生成文本
         
         Args:
             prompt: 输入提示
+            pool: 并发池名称，"interactive" 或 "batch"
+            hedge: 是否启用对冲请求，默认仅在配置开启时对交互池启用
+            cache: 是否读写响应缓存，仅适用于输出确定的智能体
+            coalesce: 是否与相同提示词的在途请求合并，默认按配置
             **kwargs: 其他参数
             
         Returns:
             生成的文本
         """
-        url = "https://ark.cn-beijing.volces.com/api/v3/chat/completions"
-        
+        request_key = CompletionCache.make_key(self.model_name, prompt, kwargs)
+        if cache:
+            cached_text = await self.cache.get(request_key)
+            if cached_text is not None:
+                logger.info("Doubao response served from cache")
+                return cached_text
+
+        if coalesce is None:
+            coalesce = settings.DOUBAO_COALESCE_ENABLED
+        if not coalesce:
+            return await self._generate(prompt, pool, hedge, request_key if cache else None, kwargs)
+
+        task = self._inflight.get(request_key)
+        if task is not None:
+            self.coalesce_stats["hits"] += 1
+            logger.info("Doubao request coalesced with an identical in-flight call")
+        else:
+            self.coalesce_stats["misses"] += 1
+            task = asyncio.ensure_future(self._generate(prompt, pool, hedge, request_key if cache else None, kwargs))
+            self._inflight[request_key] = task
+            task.add_done_callback(lambda t: self._on_inflight_done(request_key, t))
+        # shield：单个调用方被取消时不影响其他等待同一结果的调用方
+        return await asyncio.shield(task)
+
+    def _on_inflight_done(self, request_key: str, task: asyncio.Future) -> None:
+        """在途请求结束后移出合并表，并取走异常以免所有等待者都已取消时告警"""
+        if self._inflight.get(request_key) is task:
+            del self._inflight[request_key]
+        if not task.cancelled():
+            task.exception()
+
+    async def _generate(self, prompt: str, pool: str, hedge: Optional[bool], cache_key: Optional[str],
+                        params: Dict[str, Any]) -> str:
+        """
+        发起实际的生成请求并写入缓存
+
+        :param prompt: 输入提示
+        :param pool: 并发池名称
+        :param hedge: 是否启用对冲请求
+        :param cache_key: 缓存键，不写缓存时为None
+        :param params: 其他生成参数
+        :return: 生成的文本
+        """
         messages = [{"role": "user", "content": prompt}]
         
         payload = {
             "model": self.model_name,
             "messages": messages,
             "stream": False,
-            **kwargs
+            **params
         }
+        if hedge is None:
+            hedge = settings.DOUBAO_HEDGE_ENABLED and pool == "interactive"
         
         try:
             logger.info(f"Calling Doubao model with prompt: {prompt[:50]}...")
-            response = await self.client.post(url, headers=self.headers, json=payload, timeout=60.0)
-            response.raise_for_status()
-            
-            result = response.json()
-            generated_text = result["choices"][0]["message"]["content"]
+            if hedge:
+                generated_text = await self._post_hedged(payload, pool)
+            else:
+                generated_text = await self._post_with_retry(payload, pool)
             logger.info("Successfully generated text with Doubao model")
+            if cache_key is not None:
+                await self.cache.set(cache_key, generated_text)
             
             return generated_text
         except Exception as e:
             logger.error(f"Error calling Doubao model: {str(e)}")
             raise
+
+    async def _post_once(self, payload: Dict[str, Any], pool: str) -> str:
+        """
+        在并发池内发起一次非流式请求
+
+        :param payload: 请求体
+        :param pool: 并发池名称
+        :return: 生成的文本
+        """
+        start_time = time.monotonic()
+        async with self._get_limiter(pool).slot():
+            response = await self.client.post(self.url, headers=self.headers, json=payload)
+            response.raise_for_status()
+        result = response.json()
+        self.latency_trackers.get(pool, self.latency_trackers["interactive"]).record(time.monotonic() - start_time)
+        return result["choices"][0]["message"]["content"]
+
+    async def _post_with_retry(self, payload: Dict[str, Any], pool: str) -> str:
+        """
+        按重试策略发起请求，可重试错误之间按抖动指数退避等待
+
+        :param payload: 请求体
+        :param pool: 并发池名称
+        :return: 生成的文本
+        """
+        attempt = 0
+        while True:
+            try:
+                return await self._post_once(payload, pool)
+            except Exception as e:
+                if attempt >= self.retry_policy.max_retries or not self.retry_policy.is_retryable(e):
+                    raise
+                delay = self.retry_policy.compute_delay(attempt, e)
+                logger.warning(f"Doubao call failed ({str(e)[:100]}), retry {attempt + 1} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def _post_hedged(self, payload: Dict[str, Any], pool: str) -> str:
+        """
+        对冲请求：首个请求超过历史 p95 耗时仍未返回时再发一个相同请求，取先成功者
+
+        :param payload: 请求体
+        :param pool: 并发池名称
+        :return: 生成的文本
+        """
+        tracker = self.latency_trackers.get(pool, self.latency_trackers["interactive"])
+        hedge_delay = tracker.quantile(settings.DOUBAO_HEDGE_QUANTILE)
+        if hedge_delay is None:
+            return await self._post_with_retry(payload, pool)
+
+        primary = asyncio.create_task(self._post_with_retry(payload, pool))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=max(hedge_delay, settings.DOUBAO_HEDGE_MIN_DELAY))
+            if not done:
+                self.hedge_stats["hedged"] += 1
+                tasks.add(asyncio.create_task(self._post_with_retry(payload, pool)))
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                errors = [task.exception() for task in done]
+                for task, error in zip(done, errors):
+                    if error is None:
+                        if task is not primary:
+                            self.hedge_stats["hedge_wins"] += 1
+                        return task.result()
+                if not tasks:
+                    # 所有请求均失败，抛出最后一个异常
+                    raise errors[-1]
+        finally:
+            for task in tasks:
+                task.cancel()
     
-    async def generate_text_stream(self, prompt: str, **kwargs) -> AsyncGenerator[str, None]:
+    async def generate_text_stream(self, prompt: str, pool: str = "interactive", **kwargs) -> AsyncGenerator[str, None]:
         """
         流式生成文本
         
         Args:
             prompt: 输入提示
+            pool: 并发池名称，"interactive" 或 "batch"
             **kwargs: 其他参数
             
         Yields:
             生成的文本片段
         """
-        url = "https://ark.cn-beijing.volces.com/api/v3/chat/completions"
-        
         messages = [{"role": "user", "content": prompt}]
         
         payload = {
@@ -87,32 +664,73 @@ class DoubaoModel:
         
         try:
             logger.info(f"Calling Doubao model stream with prompt: {prompt[:50]}...")
-            async with self.client.stream("POST", url, headers=self.headers, json=payload, timeout=30.0) as response:
+            async with self._get_limiter(pool).slot(), \
+                    self.client.stream("POST", self.url, headers=self.headers, json=payload) as response:
                 response.raise_for_status()
-                async for chunk in response.aiter_text():
-                    if chunk.startswith("data:"):
-                        data = chunk[5:].strip()
-                        if data != "[DONE]":
-                            try:
-                                result = json.loads(data)
-                                if "choices" in result and len(result["choices"]) > 0:
-                                    content = result["choices"][0]["delta"]["content"]
-                                    if content:
-                                        yield content
-                            except Exception as e:
-                                logger.warning(f"Error parsing stream data: {e}")
-                                continue
+                async for data in _iter_sse_data(response):
+                    if data == "[DONE]":
+                        break
+                    try:
+                        result = json.loads(data)
+                    except json.JSONDecodeError as e:
+                        logger.warning(f"Error parsing stream data: {e}")
+                        continue
+                    choices = result.get("choices") or []
+                    if choices:
+                        content = (choices[0].get("delta") or {}).get("content")
+                        if content:
+                            yield content
             logger.info("Successfully streamed text with Doubao model")
         except Exception as e:
             logger.error(f"Error calling Doubao model stream: {str(e)}")
             raise
     
+    async def generate_text_until(self, prompt: str, until: Callable[[str], bool], pool: str = "interactive",
+                                  cache: bool = False, **kwargs) -> str:
+        """
+        流式生成文本，累计文本满足终止条件后立即断开HTTP流
+
+        适用于只需要输出开头少量内容的场景（如路由码），模型后续追加的解释不再等待。
+
+        Args:
+            prompt: 输入提示
+            until: 终止条件，接收已累计的文本，返回True时停止接收
+            pool: 并发池名称，"interactive" 或 "batch"
+            cache: 是否读写响应缓存
+            **kwargs: 其他参数
+
+        Returns:
+            截至终止时累计的文本
+        """
+        request_key = CompletionCache.make_key(self.model_name, prompt, {**kwargs, "stream_until": True})
+        if cache:
+            cached_text = await self.cache.get(request_key)
+            if cached_text is not None:
+                logger.info("Doubao response served from cache")
+                return cached_text
+
+        self.early_stop_stats["calls"] += 1
+        generated_text = ""
+        # aclosing：提前退出时立即关闭生成器，从而关闭底层响应并释放并发槽位
+        async with aclosing(self.generate_text_stream(prompt, pool=pool, **kwargs)) as chunks:
+            async for chunk in chunks:
+                generated_text += chunk
+                if until(generated_text):
+                    self.early_stop_stats["early_stops"] += 1
+                    break
+        if cache and generated_text:
+            await self.cache.set(request_key, generated_text)
+        return generated_text
+
     async def close(self):
-        """关闭HTTP客户端"""
+        """关闭HTTP客户端与响应缓存"""
         await self.client.aclose()
+        if self._cache is not None:
+            self._cache.close()
+            self._cache = None
 
 
-# 全局模型实例
+# 全局模型实例（进程内共享，所有智能体复用同一连接池）
 doubao_model: Optional[DoubaoModel] = None
 
 
@@ -124,6 +742,14 @@ def get_doubao_model() -> DoubaoModel:
     return doubao_model
 
 
+async def close_doubao_model() -> None:
+    """关闭全局豆包模型实例并释放连接池"""
+    global doubao_model
+    if doubao_model is not None:
+        await doubao_model.close()
+        doubao_model = None
+
+
 async def call_doubao(prompt: str, **kwargs) -> str:
     """
     调用豆包模型生成文本（便捷函数）
@@ -0,0 +1,317 @@
+import asyncio
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from openai import AsyncOpenAI
+
+from agents_system.config.settings import settings
+from agents_system.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """
+    归一化查询文本：全角转半角（NFKC）、去除首尾空白、合并连续空白
+
+    :param text: 原始文本
+    :return: 归一化后的文本
+    """
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+
+class EmbeddingCache:
+    """
+    向量缓存
+
+    以 模型 + 归一化文本 的哈希为键，内存LRU为一级缓存，SQLite为二级持久化缓存（向量以 float32 二进制保存），
+    SQLite 按条目数上限淘汰最久未使用的记录。向量由模型与文本唯一确定，不设过期时间。
+    """
+
+    def __init__(self, max_entries: int, db_path: Optional[str] = None, max_db_entries: int = 1000000):
+        self.max_entries = max_entries
+        self.max_db_entries = max_db_entries
+        self._memory: OrderedDict = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        if db_path:
+            db_dir = os.path.dirname(db_path)
+            if db_dir and not os.path.exists(db_dir):
+                os.makedirs(db_dir)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embedding_cache ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_embedding_cache_accessed ON embedding_cache(accessed_at)")
+            self._db.commit()
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        """
+        生成缓存键
+
+        :param model: 向量模型名称
+        :param text: 归一化后的文本
+        :return: 十六进制哈希
+        """
+        return hashlib.sha256(f"{model}\u0000{text}".encode("utf-8")).hexdigest()
+
+    async def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """
+        批量读取缓存，内存未命中的键一次性查询SQLite并回填内存
+
+        :param keys: 缓存键列表
+        :return: 命中的键到向量的映射
+        """
+        found: Dict[str, np.ndarray] = {}
+        missing = []
+        for key in keys:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                found[key] = vector
+            else:
+                missing.append(key)
+
+        if missing and self._db is not None:
+            rows = await asyncio.to_thread(self._db_get_many, missing)
+            for key, blob in rows.items():
+                vector = np.frombuffer(blob, dtype=np.float32)
+                self._memory_set(key, vector)
+                self._stats["disk_hits"] += 1
+                found[key] = vector
+
+        self._stats["misses"] += len(keys) - len(found)
+        return found
+
+    async def set_many(self, vectors: Dict[str, np.ndarray]) -> None:
+        """
+        批量写入缓存
+
+        :param vectors: 键到向量的映射
+        """
+        for key, vector in vectors.items():
+            self._memory_set(key, vector)
+        if self._db is not None and vectors:
+            await asyncio.to_thread(self._db_set_many, vectors)
+
+    def _memory_set(self, key: str, vector: np.ndarray) -> None:
+        """写入内存LRU并按容量淘汰"""
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _db_get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        """从SQLite批量读取记录并刷新访问时间"""
+        placeholders = ",".join("?" * len(keys))
+        with self._db_lock:
+            rows = self._db.execute(
+                f"SELECT key, vector FROM embedding_cache WHERE key IN ({placeholders})", keys
+            ).fetchall()
+            if rows:
+                self._db.executemany(
+                    "UPDATE embedding_cache SET accessed_at = ? WHERE key = ?",
+                    [(time.time(), key) for key, _ in rows]
+                )
+                self._db.commit()
+        return dict(rows)
+
+    def _db_set_many(self, vectors: Dict[str, np.ndarray]) -> None:
+        """批量写入SQLite，并清理超出容量的最久未访问记录"""
+        now = time.time()
+        with self._db_lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embedding_cache (key, vector, accessed_at) VALUES (?, ?, ?)",
+                [(key, vector.astype(np.float32).tobytes(), now) for key, vector in vectors.items()]
+            )
+            self._db.execute(
+                "DELETE FROM embedding_cache WHERE key IN ("
+                "SELECT key FROM embedding_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_db_entries,)
+            )
+            self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存命中统计"""
+        return {"memory_entries": len(self._memory), **self._stats}
+
+    def close(self) -> None:
+        """关闭SQLite连接"""
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
+
+
+class EmbeddingModel:
+    """
+    向量模型调用接口
+
+    查询先经过向量缓存；未命中的文本进入微批队列，batch_window 秒内到达的并发请求
+    合并为一次 embeddings.create 调用（单批最多 max_batch_size 条），相同文本只请求一次。
+    """
+
+    def __init__(self, client: Optional[AsyncOpenAI] = None, model: Optional[str] = None,
+                 batch_window: Optional[float] = None, max_batch_size: Optional[int] = None,
+                 cache: Optional[EmbeddingCache] = None):
+        self.client = client or AsyncOpenAI(api_key=settings.EMBEDDING_API_KEY, base_url=settings.EMBEDDING_BASE_URL)
+        self.model = model or settings.EMBEDDING_MODEL
+        self.batch_window = settings.EMBEDDING_BATCH_WINDOW if batch_window is None else batch_window
+        self.max_batch_size = max_batch_size or settings.EMBEDDING_MAX_BATCH_SIZE
+        self.cache = cache or EmbeddingCache(
+            max_entries=settings.EMBEDDING_CACHE_MAX_ENTRIES,
+            db_path=settings.EMBEDDING_CACHE_DB_PATH
+        )
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._queue: List[str] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._batch_tasks: set = set()
+        self.batch_stats = {"requests": 0, "texts": 0, "max_batch": 0}
+
+    async def embed(self, text: str) -> np.ndarray:
+        """
+        获取单个文本的向量
+
+        :param text: 文本
+        :return: float32 向量
+        """
+        return (await self.embed_many([text]))[0]
+
+    async def embed_many(self, texts: List[str]) -> List[np.ndarray]:
+        """
+        批量获取文本向量，结果与输入一一对应
+
+        :param texts: 文本列表
+        :return: float32 向量列表
+        """
+        normalized = [normalize_text(text) for text in texts]
+        keys = [EmbeddingCache.make_key(self.model, text) for text in normalized]
+        vectors = await self.cache.get_many(list(dict.fromkeys(keys)))
+
+        futures = {}
+        for key, text in zip(keys, normalized):
+            if key in vectors or key in futures:
+                continue
+            future = self._pending.get(key)
+            if future is None:
+                future = asyncio.get_running_loop().create_future()
+                self._pending[key] = future
+                self._queue.append(text)
+                self._schedule_flush()
+            futures[key] = future
+
+        if futures:
+            results = await asyncio.gather(*(asyncio.shield(future) for future in futures.values()))
+            vectors.update(zip(futures.keys(), results))
+        return [vectors[key] for key in keys]
+
+    def _schedule_flush(self) -> None:
+        """队列满时立即发送，否则等待 batch_window 收集更多请求"""
+        if len(self._queue) >= self.max_batch_size:
+            batch, self._queue = self._queue[:self.max_batch_size], self._queue[self.max_batch_size:]
+            task = asyncio.create_task(self._send_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+        if self._queue and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self._flush_after_window())
+
+    async def _flush_after_window(self) -> None:
+        """等待微批窗口后发送队列中的全部文本"""
+        await asyncio.sleep(self.batch_window)
+        while self._queue:
+            batch, self._queue = self._queue[:self.max_batch_size], self._queue[self.max_batch_size:]
+            await self._send_batch(batch)
+
+    async def _send_batch(self, texts: List[str]) -> None:
+        """
+        发送一批文本并分发结果
+
+        :param texts: 归一化后的文本（互不重复）
+        """
+        keys = [EmbeddingCache.make_key(self.model, text) for text in texts]
+        self.batch_stats["requests"] += 1
+        self.batch_stats["texts"] += len(texts)
+        self.batch_stats["max_batch"] = max(self.batch_stats["max_batch"], len(texts))
+        vectors: Dict[str, np.ndarray] = {}
+        error: Optional[Exception] = None
+        try:
+            response = await self.client.embeddings.create(model=self.model, input=texts)
+            # 按返回的 index 对应输入文本，不依赖返回顺序
+            for position, item in enumerate(response.data):
+                index = getattr(item, "index", position)
+                if 0 <= index < len(keys):
+                    vectors[keys[index]] = np.asarray(item.embedding, dtype=np.float32)
+            if len(vectors) != len(keys):
+                raise ValueError(f"向量模型返回 {len(vectors)} 条结果，请求 {len(keys)} 条")
+        except Exception as e:
+            logger.error(f"Error calling embedding model: {str(e)}")
+            error = e
+        finally:
+            # 无论成功与否，本批的每个等待者都必须得到结果或异常，避免调用方永久等待
+            for key in keys:
+                future = self._pending.pop(key, None)
+                if future is None or future.done():
+                    continue
+                if key in vectors:
+                    future.set_result(vectors[key])
+                else:
+                    future.set_exception(error or RuntimeError("向量模型调用已取消"))
+        if error is not None:
+            return
+        try:
+            await self.cache.set_many(vectors)
+        except Exception as e:
+            logger.warning(f"写入向量缓存失败: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存与微批统计"""
+        requests = self.batch_stats["requests"]
+        return {
+            "cache": self.cache.stats(),
+            "batch": {
+                **self.batch_stats,
+                "avg_batch": self.batch_stats["texts"] / requests if requests else 0.0,
+                "queued": len(self._queue)
+            }
+        }
+
+    async def close(self) -> None:
+        """等待进行中的批次写入缓存后，关闭HTTP客户端与向量缓存"""
+        tasks = [task for task in (self._flush_task, *self._batch_tasks) if task is not None and not task.done()]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        await self.client.close()
+        self.cache.close()
+
+
+# 全局向量模型实例（进程内共享缓存与微批队列）
+embedding_model: Optional[EmbeddingModel] = None
+
+
+def get_embedding_model() -> EmbeddingModel:
+    """获取向量模型实例"""
+    global embedding_model
+    if embedding_model is None:
+        embedding_model = EmbeddingModel()
+    return embedding_model
+
+
+async def close_embedding_model() -> None:
+    """关闭全局向量模型实例"""
+    global embedding_model
+    if embedding_model is not None:
+        await embedding_model.close()
+        embedding_model = None
@@ -0,0 +1,371 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from agents_system.config.settings import settings
+from agents_system.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+# 分类文本中上一条智能体消息与当前用户消息的分隔符，单独的分隔符不作为特征（每条文本都有）
+_SEPARATOR = "\u0001"
+
+
+def _last_message(conversations: List[Dict[str, str]], role: str) -> str:
+    """获取指定角色的最后一条消息"""
+    return next((m.get("content", "") for m in reversed(conversations) if m.get("role") == role), "")
+
+
+def build_route_text(conversations: List[Dict[str, str]]) -> str:
+    """
+    构建路由分类文本：上一条智能体消息 + 当前用户消息，二者决定了绝大多数路由
+
+    :param conversations: 聊天历史记录
+    :return: 分类文本
+    """
+    return f"{_last_message(conversations, 'assistant')[-200:]}{_SEPARATOR}{_last_message(conversations, 'user')[-200:]}"
+
+
+class RouteRule:
+    """
+    路由规则：上一条智能体消息与当前用户消息同时命中时直接给出路由码
+
+    :param route_code: 命中时的路由码
+    :param assistant_pattern: 上一条智能体消息需匹配的正则
+    :param user_pattern: 当前用户消息需匹配的正则
+    """
+
+    def __init__(self, route_code: str, assistant_pattern: str, user_pattern: str):
+        self.route_code = route_code
+        self.assistant_pattern = re.compile(assistant_pattern)
+        self.user_pattern = re.compile(user_pattern)
+
+    def match(self, conversations: List[Dict[str, str]]) -> bool:
+        """判断规则是否命中"""
+        return bool(
+            self.assistant_pattern.search(_last_message(conversations, "assistant"))
+            and self.user_pattern.search(_last_message(conversations, "user").strip())
+        )
+
+
+class CharNgramClassifier:
+    """基于字符 n-gram TF-IDF 与多分类逻辑回归的轻量分类器（纯 NumPy 实现）"""
+
+    def __init__(self, ngram_range: Tuple[int, int] = (1, 3), max_features: int = 5000):
+        self.ngram_range = ngram_range
+        self.max_features = max_features
+        self.vocabulary: Dict[str, int] = {}
+        self.idf: Optional[np.ndarray] = None
+        self.weights: Optional[np.ndarray] = None
+        self.bias: Optional[np.ndarray] = None
+        self.classes: List[str] = []
+
+    def _ngrams(self, text: str) -> Counter:
+        """提取字符 n-gram 计数（不含单独的分隔符）"""
+        low, high = self.ngram_range
+        return Counter(
+            text[i:i + n] for n in range(low, high + 1) for i in range(len(text) - n + 1) if text[i:i + n] != _SEPARATOR
+        )
+
+    def _transform_one(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        """将单条文本转为 L2 归一化的稀疏 TF-IDF 向量（下标, 取值）"""
+        counts = self._ngrams(text)
+        indices = [self.vocabulary[gram] for gram in counts if gram in self.vocabulary]
+        if not indices:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        idx = np.asarray(indices, dtype=np.int64)
+        values = np.asarray([counts[gram] for gram in counts if gram in self.vocabulary], dtype=np.float32)
+        values = (1.0 + np.log(values)) * self.idf[idx]
+        values /= np.linalg.norm(values) or 1.0
+        return idx, values
+
+    def _transform_dense(self, texts: List[str]) -> np.ndarray:
+        """将多条文本转为稠密 TF-IDF 矩阵（仅用于训练与评估）"""
+        matrix = np.zeros((len(texts), len(self.vocabulary)), dtype=np.float32)
+        for row, text in enumerate(texts):
+            idx, values = self._transform_one(text)
+            matrix[row, idx] = values
+        return matrix
+
+    def fit(self, texts: List[str], labels: List[str], epochs: int = 300, learning_rate: float = 1.0,
+            l2: float = 1e-4) -> None:
+        """
+        训练分类器
+
+        :param texts: 训练文本
+        :param labels: 路由码标签
+        :param epochs: 全量梯度下降轮数
+        :param learning_rate: 学习率
+        :param l2: L2 正则系数
+        :raises ValueError: 标签少于两类
+        """
+        if len(set(labels)) < 2:
+            raise ValueError(f"训练样本至少需要两类路由码，当前为 {sorted(set(labels))}")
+        document_frequency: Counter = Counter()
+        for text in texts:
+            document_frequency.update(set(self._ngrams(text)))
+        grams = [gram for gram, _ in document_frequency.most_common(self.max_features)]
+        self.vocabulary = {gram: i for i, gram in enumerate(grams)}
+        df = np.asarray([document_frequency[gram] for gram in grams], dtype=np.float32)
+        self.idf = np.log((1.0 + len(texts)) / (1.0 + df)) + 1.0
+
+        self.classes = sorted(set(labels))
+        x = self._transform_dense(texts)
+        y = np.zeros((len(texts), len(self.classes)), dtype=np.float32)
+        y[np.arange(len(texts)), [self.classes.index(label) for label in labels]] = 1.0
+
+        self.weights = np.zeros((x.shape[1], len(self.classes)), dtype=np.float32)
+        self.bias = np.zeros(len(self.classes), dtype=np.float32)
+        for _ in range(epochs):
+            probabilities = self._softmax(x @ self.weights + self.bias)
+            gradient = probabilities - y
+            self.weights -= learning_rate * (x.T @ gradient / len(texts) + l2 * self.weights)
+            self.bias -= learning_rate * gradient.mean(axis=0)
+
+    @staticmethod
+    def _softmax(logits: np.ndarray) -> np.ndarray:
+        """数值稳定的 softmax"""
+        logits = logits - logits.max(axis=-1, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=-1, keepdims=True)
+
+    def predict_proba(self, text: str) -> Dict[str, float]:
+        """
+        预测各路由码概率
+
+        :param text: 分类文本
+        :return: 路由码到概率的映射；文本与词表没有任何重合的 n-gram 时返回空字典（概率只由偏置决定，不可信）
+        """
+        idx, values = self._transform_one(text)
+        if not len(idx):
+            return {}
+        logits = values @ self.weights[idx] + self.bias
+        return dict(zip(self.classes, self._softmax(logits).tolist()))
+
+    @property
+    def is_trained(self) -> bool:
+        """是否已训练"""
+        return self.weights is not None
+
+    def save(self, path: str) -> None:
+        """保存模型到 .npz 文件"""
+        model_dir = os.path.dirname(path)
+        if model_dir and not os.path.exists(model_dir):
+            os.makedirs(model_dir)
+        grams = sorted(self.vocabulary, key=self.vocabulary.get)
+        np.savez(
+            path,
+            vocabulary=np.asarray(json.dumps(grams, ensure_ascii=False)),
+            classes=np.asarray(json.dumps(self.classes)),
+            ngram_range=np.asarray(self.ngram_range),
+            idf=self.idf,
+            weights=self.weights,
+            bias=self.bias
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "CharNgramClassifier":
+        """从 .npz 文件加载模型"""
+        data = np.load(path)
+        ngram_range = tuple(int(n) for n in data["ngram_range"])
+        grams = json.loads(str(data["vocabulary"]))
+        classifier = cls(ngram_range=ngram_range, max_features=len(grams))
+        classifier.vocabulary = {gram: i for i, gram in enumerate(grams)}
+        classifier.classes = json.loads(str(data["classes"]))
+        classifier.idf = data["idf"]
+        classifier.weights = data["weights"]
+        classifier.bias = data["bias"]
+        return classifier
+
+
+class PreRouter:
+    """
+    调度智能体前置的本地路由器
+
+    先匹配规则，再用本地分类器预测；置信度达到阈值时直接返回路由码，否则交给大模型判断。
+    大模型给出的路由结果会写入样本日志，用于离线训练分类器。
+    """
+
+    def __init__(self, name: str, rules: Optional[List[RouteRule]] = None, threshold: float = 0.9,
+                 model_path: Optional[str] = None, log_path: Optional[str] = None, shadow_rate: float = 0.0):
+        self.name = name
+        self.rules = rules or []
+        self.threshold = threshold
+        self.log_path = log_path
+        self.shadow_rate = shadow_rate
+        self.classifier: Optional[CharNgramClassifier] = None
+        if model_path and os.path.exists(model_path):
+            self.classifier = CharNgramClassifier.load(model_path)
+            logger.info(f"Loaded pre-router model for {name} from {model_path}")
+        self._log_lock = threading.Lock()
+        self._stats = {"requests": 0, "rule_hits": 0, "model_hits": 0, "fallbacks": 0,
+                       "shadow_checks": 0, "shadow_agreements": 0}
+
+    @classmethod
+    def from_settings(cls, name: str, rules: Optional[List[RouteRule]] = None) -> "PreRouter":
+        """
+        按配置创建路由器，模型与样本日志位于 PRE_ROUTER_DIR/<name>.*
+
+        :param name: 流程名称
+        :param rules: 路由规则
+        """
+        return cls(
+            name=name,
+            rules=rules,
+            threshold=settings.PRE_ROUTER_THRESHOLD,
+            model_path=os.path.join(settings.PRE_ROUTER_DIR, f"{name}.npz"),
+            log_path=os.path.join(settings.PRE_ROUTER_DIR, f"{name}.jsonl"),
+            shadow_rate=settings.PRE_ROUTER_SHADOW_RATE
+        )
+
+    def predict(self, conversations: List[Dict[str, str]]) -> Tuple[Optional[str], float, str]:
+        """
+        本地预测路由码
+
+        :param conversations: 聊天历史记录
+        :return: (路由码, 置信度, 来源)，无法确定时路由码为None
+        """
+        self._stats["requests"] += 1
+        for rule in self.rules:
+            if rule.match(conversations):
+                self._stats["rule_hits"] += 1
+                return rule.route_code, 1.0, "rule"
+
+        if self.classifier is not None:
+            probabilities = self.classifier.predict_proba(build_route_text(conversations))
+            if not probabilities:
+                self._stats["fallbacks"] += 1
+                return None, 0.0, "llm"
+            route_code, confidence = max(probabilities.items(), key=lambda item: item[1])
+            if confidence >= self.threshold:
+                self._stats["model_hits"] += 1
+                return route_code, confidence, "model"
+            self._stats["fallbacks"] += 1
+            return None, confidence, "llm"
+
+        self._stats["fallbacks"] += 1
+        return None, 0.0, "llm"
+
+    def should_shadow(self) -> bool:
+        """本地命中时是否抽样再调用大模型，用于线上准确率统计"""
+        return self.shadow_rate > 0 and random.random() < self.shadow_rate
+
+    def record_shadow(self, local_code: str, llm_code: str) -> None:
+        """记录一次本地预测与大模型结果的比对"""
+        self._stats["shadow_checks"] += 1
+        if local_code == llm_code:
+            self._stats["shadow_agreements"] += 1
+
+    async def record(self, conversations: List[Dict[str, str]], route_code: str) -> None:
+        """
+        记录大模型给出的路由结果，作为训练样本（文件写入在线程中执行，不阻塞事件循环）
+
+        :param conversations: 聊天历史记录
+        :param route_code: 路由码
+        """
+        if not self.log_path:
+            return
+        line = json.dumps({"text": build_route_text(conversations), "route_code": route_code}, ensure_ascii=False)
+        await asyncio.to_thread(self._append_sample, line)
+
+    def _append_sample(self, line: str) -> None:
+        """追加一行样本到日志文件"""
+        try:
+            log_dir = os.path.dirname(self.log_path)
+            if log_dir and not os.path.exists(log_dir):
+                os.makedirs(log_dir)
+            with self._log_lock, open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            logger.warning(f"写入路由样本失败: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """获取本地命中率、回退率与抽样准确率"""
+        requests = self._stats["requests"]
+        checks = self._stats["shadow_checks"]
+        return {
+            **self._stats,
+            "local_rate": (self._stats["rule_hits"] + self._stats["model_hits"]) / requests if requests else 0.0,
+            "fallback_rate": self._stats["fallbacks"] / requests if requests else 0.0,
+            "shadow_accuracy": self._stats["shadow_agreements"] / checks if checks else None
+        }
+
+
+def train_from_log(log_path: str, model_path: str, threshold: float = 0.9, holdout: float = 0.2,
+                   seed: int = 42, min_class_samples: int = 20) -> Dict[str, Any]:
+    """
+    从样本日志训练分类器，并在留出集上报告准确率与回退率
+
+    :param log_path: JSONL 样本日志路径
+    :param model_path: 模型输出路径
+    :param threshold: 置信度阈值
+    :param holdout: 留出集比例
+    :param seed: 随机种子
+    :param min_class_samples: 每个路由码的最少样本数
+    :return: 评估报告
+    :raises ValueError: 样本为空、路由码少于两类、某类样本不足或留出集为空
+    """
+    with open(log_path, "r", encoding="utf-8") as f:
+        samples = [json.loads(line) for line in f if line.strip()]
+    if not samples:
+        raise ValueError(f"样本日志 {log_path} 为空")
+    class_counts = Counter(s["route_code"] for s in samples)
+    if len(class_counts) < 2:
+        raise ValueError(f"样本日志只有一类路由码 {list(class_counts)}，无法训练分类器")
+    rare = {code: count for code, count in class_counts.items() if count < min_class_samples}
+    if rare:
+        raise ValueError(f"以下路由码样本数少于 {min_class_samples}，请积累更多样本后再训练: {rare}")
+    random.Random(seed).shuffle(samples)
+    split = int(len(samples) * (1 - holdout))
+    train, test = samples[:split], samples[split:]
+    if not test:
+        raise ValueError(f"留出集为空（样本数 {len(samples)}，留出比例 {holdout}）")
+
+    classifier = CharNgramClassifier()
+    classifier.fit([s["text"] for s in train], [s["route_code"] for s in train])
+
+    confident = correct = overall_correct = 0
+    for sample in test:
+        probabilities = classifier.predict_proba(sample["text"])
+        if not probabilities:
+            continue
+        route_code, confidence = max(probabilities.items(), key=lambda item: item[1])
+        overall_correct += route_code == sample["route_code"]
+        if confidence >= threshold:
+            confident += 1
+            correct += route_code == sample["route_code"]
+
+    # 评估完成后使用全部样本重新训练再保存
+    classifier.fit([s["text"] for s in samples], [s["route_code"] for s in samples])
+    classifier.save(model_path)
+    return {
+        "samples": len(samples),
+        "test_samples": len(test),
+        "class_counts": dict(class_counts),
+        "accuracy": overall_correct / len(test),
+        "confident_accuracy": correct / confident if confident else None,
+        "fallback_rate": 1 - confident / len(test)
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="从调度样本日志训练本地路由分类器")
+    parser.add_argument("log_path", help="JSONL 样本日志路径")
+    parser.add_argument("model_path", help="模型输出路径（.npz）")
+    parser.add_argument("--threshold", type=float, default=settings.PRE_ROUTER_THRESHOLD)
+    parser.add_argument("--min-class-samples", type=int, default=20, help="每个路由码的最少样本数")
+    args = parser.parse_args()
+    print(json.dumps(
+        train_from_log(args.log_path, args.model_path, args.threshold, min_class_samples=args.min_class_samples),
+        ensure_ascii=False, indent=2
+    ))
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import sys
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+from agents_system.utils.ann_index import IVFFlatIndex, recall_at_k
+from agents_system.utils.logger import get_logger
+from agents_system.utils.vector_index import QAVectorIndex, normalize_rows
+
+logger = get_logger(__name__)
+
+
+class ANNRecallBenchmark:
+    """IVF 近似检索与精确检索的 recall@k 与耗时对比"""
+
+    def __init__(self, k: int = 5, num_queries: int = 200, noise: float = 0.05, seed: int = 0):
+        self.k = k
+        self.num_queries = num_queries
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+
+    def load_groups(self, file_path: str, min_group_size: int) -> Dict[str, np.ndarray]:
+        """
+        加载知识库（QAsql.json 或 .npy 向量存储）中不少于 min_group_size 条的组
+
+        :param file_path: 知识库路径
+        :param min_group_size: 最小组大小
+        :return: group_uuid 到归一化矩阵的映射
+        """
+        index = QAVectorIndex(file_path, ann_enabled=False)
+        index.load()
+        return {
+            group_uuid: group.matrix
+            for group_uuid, group in index.groups.items()
+            if len(group) >= min_group_size
+        }
+
+    def synthetic_group(self, count: int, dimension: int, clusters: int = 200) -> np.ndarray:
+        """
+        生成带聚类结构的随机向量，模拟问答知识库中大量相近问法
+
+        :param count: 条目数
+        :param dimension: 向量维度
+        :param clusters: 主题数量
+        :return: 归一化矩阵
+        """
+        centers = self.rng.standard_normal((clusters, dimension)).astype(np.float32)
+        labels = self.rng.integers(0, clusters, count)
+        vectors = centers[labels] + 0.5 * self.rng.standard_normal((count, dimension)).astype(np.float32)
+        return normalize_rows(vectors)
+
+    def make_queries(self, matrix: np.ndarray) -> np.ndarray:
+        """以随机条目加噪声作为查询，模拟用户问法与知识库问题的差异"""
+        rows = self.rng.choice(len(matrix), min(self.num_queries, len(matrix)), replace=False)
+        queries = np.asarray(matrix[rows], dtype=np.float32)
+        queries = queries + self.noise * self.rng.standard_normal(queries.shape).astype(np.float32)
+        return normalize_rows(queries)
+
+    def run_group(self, group_uuid: str, matrix: np.ndarray, nprobes: List[int],
+                  nlist: int = None) -> List[Dict[str, Any]]:
+        """
+        对单个组构建索引并测试不同 nprobe 下的 recall@k
+
+        :param group_uuid: 组ID
+        :param matrix: 归一化矩阵
+        :param nprobes: 待测试的 nprobe 列表
+        :param nlist: 倒排列表数量
+        :return: 测试结果列表
+        """
+        start_time = time.perf_counter()
+        index = IVFFlatIndex.build(matrix, nlist=nlist)
+        build_ms = (time.perf_counter() - start_time) * 1000
+        queries = self.make_queries(matrix)
+
+        results = []
+        for nprobe in nprobes:
+            result = recall_at_k(index, matrix, queries, self.k, min(nprobe, index.nlist))
+            results.append({
+                "group_uuid": group_uuid,
+                "entries": len(matrix),
+                "nlist": index.nlist,
+                "nprobe": min(nprobe, index.nlist),
+                "build_ms": round(build_ms, 1),
+                f"recall@{self.k}": round(result["recall"], 4),
+                "exact_us": round(result["exact_us"], 1),
+                "ann_us": round(result["ann_us"], 1),
+                "speedup": round(result["exact_us"] / result["ann_us"], 2) if result["ann_us"] else 0.0
+            })
+            logger.info(json.dumps(results[-1], ensure_ascii=False))
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IVF 近似检索 recall@k 检查（以精确检索为基准）")
+    parser.add_argument("--store", help="知识库路径（QAsql.json 或 .npy），不指定时使用合成数据")
+    parser.add_argument("--min-group-size", type=int, default=1000, help="只测试不少于该条目数的组")
+    parser.add_argument("--synthetic-size", type=int, default=20000, help="合成数据条目数")
+    parser.add_argument("--dimension", type=int, default=256, help="合成数据向量维度")
+    parser.add_argument("--k", type=int, default=5, help="top-k")
+    parser.add_argument("--nlist", type=int, default=None, help="倒排列表数量，默认 sqrt(N)")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32], help="待测试的 nprobe")
+    parser.add_argument("--queries", type=int, default=200, help="每组查询数")
+    parser.add_argument("--min-recall", type=float, default=None, help="最大 nprobe 下的最低召回率，低于时返回非零退出码")
+    args = parser.parse_args()
+
+    benchmark = ANNRecallBenchmark(k=args.k, num_queries=args.queries)
+    if args.store:
+        groups = benchmark.load_groups(args.store, args.min_group_size)
+    else:
+        groups = {"synthetic": benchmark.synthetic_group(args.synthetic_size, args.dimension)}
+    if not groups:
+        print(f"没有不少于 {args.min_group_size} 条的组")
+        return
+
+    results = []
+    for group_uuid, matrix in groups.items():
+        results.extend(benchmark.run_group(group_uuid, matrix, sorted(args.nprobe), args.nlist))
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+    if args.min_recall is not None:
+        # 每组取测试的最大 nprobe 作为线上配置的召回率
+        best = {}
+        for result in results:
+            if result["nprobe"] >= best.get(result["group_uuid"], {}).get("nprobe", 0):
+                best[result["group_uuid"]] = result
+        worst = min(result[f"recall@{args.k}"] for result in best.values())
+        if worst < args.min_recall:
+            print(f"recall@{args.k} = {worst} 低于 {args.min_recall}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
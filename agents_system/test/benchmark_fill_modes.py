@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from datetime import datetime
+from typing import List, Dict, Any
+import aiohttp
+
+from agents_system.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class FillModeBenchmark:
+    """填写、保存两次调用与单次结构化调用的对比测试类"""
+
+    def __init__(self, base_url: str = "http://localhost:8001", service: str = "unified"):
+        self.base_url = base_url
+        self.api_endpoint = f"{base_url}/{service}/process"
+        self.stats_endpoint = f"{base_url}/{service}/fill-mode-stats"
+        self.test_results: List[Dict[str, Any]] = []
+
+    def load_test_data(self, file_path: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """
+        加载测试数据，每条为 {"conversations": [...], "form": {...}}
+
+        :param file_path: 数据文件路径
+        :param limit: 限制加载的数据条数
+        :return: 测试数据列表
+        """
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            test_data = data[:limit]
+            logger.info(f"成功加载 {len(test_data)} 条测试数据")
+            return test_data
+        except Exception as e:
+            logger.error(f"加载测试数据失败: {str(e)}")
+            return []
+
+    async def run_case(self, session: aiohttp.ClientSession, case: Dict[str, Any], fill_mode: str) -> Dict[str, Any]:
+        """
+        以指定模式请求一条测试数据
+
+        :param session: HTTP会话
+        :param case: 测试数据
+        :param fill_mode: two_call 或 single_call
+        :return: 测试结果
+        """
+        request_data = {"conversations": case["conversations"], "form": case.get("form", {}), "fill_mode": fill_mode}
+        start_time = time.time()
+        async with session.post(self.api_endpoint, json=request_data) as response:
+            response_data = await response.json()
+        return {
+            "fill_mode": fill_mode,
+            "timestamp": datetime.now().isoformat(),
+            "processing_time_seconds": time.time() - start_time,
+            "status_code": response.status,
+            "api_response": response_data
+        }
+
+    async def run_all_tests(self, data_file_path: str, limit: int = 50) -> Dict[str, Any]:
+        """
+        对每条测试数据依次以两种模式请求，并汇总耗时
+
+        :param data_file_path: 测试数据文件路径
+        :param limit: 数据限制条数
+        :return: 汇总结果
+        """
+        test_data = self.load_test_data(data_file_path, limit)
+        async with aiohttp.ClientSession() as session:
+            for case in test_data:
+                for fill_mode in ("two_call", "single_call"):
+                    self.test_results.append(await self.run_case(session, case, fill_mode))
+            async with session.get(self.stats_endpoint) as response:
+                server_stats = await response.json()
+
+        summary = {"server_stats": server_stats}
+        for fill_mode in ("two_call", "single_call"):
+            latencies = [r["processing_time_seconds"] for r in self.test_results if r["fill_mode"] == fill_mode]
+            if latencies:
+                summary[fill_mode] = {
+                    "requests": len(latencies),
+                    "mean_seconds": statistics.mean(latencies),
+                    "median_seconds": statistics.median(latencies)
+                }
+        logger.info(f"对比测试完成: {json.dumps(summary, ensure_ascii=False)}")
+        return summary
+
+    def save_results(self, output_file: str) -> None:
+        """
+        保存测试结果
+
+        :param output_file: 输出文件路径
+        """
+        try:
+            with open(output_file, 'w', encoding='utf-8') as f:
+                json.dump(self.test_results, f, ensure_ascii=False, indent=2)
+            logger.info(f"测试结果已保存到: {output_file}")
+        except Exception as e:
+            logger.error(f"保存测试结果失败: {str(e)}")
+
+
+async def main():
+    """主测试函数"""
+    parser = argparse.ArgumentParser(description="对比两次调用与单次调用的回复与表单更新耗时")
+    parser.add_argument("data_file", help="测试数据文件路径")
+    parser.add_argument("--base-url", default="http://localhost:8001")
+    parser.add_argument("--service", default="unified", choices=["unified", "secondbargaining"])
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--output", default="fill_mode_benchmark_results.json")
+    args = parser.parse_args()
+
+    benchmark = FillModeBenchmark(args.base_url, args.service)
+    summary = await benchmark.run_all_tests(args.data_file, args.limit)
+    benchmark.save_results(args.output)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
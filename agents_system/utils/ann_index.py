@@ -0,0 +1,257 @@
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from agents_system.utils.logger import get_logger
+from agents_system.utils.vector_index import normalize_rows, top_k
+
+
+logger = get_logger(__name__)
+
+ANN_INDEX_VERSION = 1
+
+
+class IVFFlatIndex:
+    """
+    IVF-Flat 近似最近邻索引
+
+    用球面 k-means 把组内向量划分为 nlist 个倒排列表，检索时只对与查询最相近的 nprobe 个
+    列表中的向量计算精确余弦相似度。nprobe 越大召回率越高、耗时越长，nprobe == nlist 时等价于精确检索。
+    索引只保存聚类中心、列表区间与按列表排列的行号 order，向量矩阵保持原有行顺序：
+    检索时按行号只取出候选列表的向量，内存映射矩阵无需复制到进程堆内存。
+    """
+
+    def __init__(self, centroids: np.ndarray, order: np.ndarray, offsets: np.ndarray, nprobe: int = 16):
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.nprobe = nprobe
+
+    @property
+    def nlist(self) -> int:
+        """倒排列表数量"""
+        return len(self.centroids)
+
+    @staticmethod
+    def default_nlist(count: int) -> int:
+        """默认倒排列表数量：约 sqrt(N)"""
+        return max(1, int(round(np.sqrt(count))))
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, nlist: Optional[int] = None, nprobe: int = 16,
+              iterations: int = 10, seed: int = 0) -> "IVFFlatIndex":
+        """
+        训练聚类中心并构建倒排列表
+
+        :param matrix: 已归一化的 float32 矩阵
+        :param nlist: 倒排列表数量，为空时取 sqrt(N)
+        :param nprobe: 默认检索的列表数量
+        :param iterations: k-means 迭代次数
+        :param seed: 随机种子
+        :return: 索引实例
+        """
+        count = len(matrix)
+        nlist = min(nlist or cls.default_nlist(count), count)
+        rng = np.random.default_rng(seed)
+
+        # 大组只用抽样数据训练中心，每个中心约 256 个样本即可收敛
+        sample_size = min(count, nlist * 256)
+        sample_rows = np.sort(rng.choice(count, sample_size, replace=False)) if sample_size < count else np.arange(count)
+        sample = np.asarray(matrix[sample_rows], dtype=np.float32)
+
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = cls._assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            counts = np.bincount(assignments, minlength=nlist)
+            # 空列表重新随机取样本作为中心
+            empty = np.flatnonzero(counts == 0)
+            if len(empty):
+                sums[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+            centroids = normalize_rows(sums)
+
+        assignments = cls._assign(matrix, centroids)
+        order = np.argsort(assignments, kind="stable").astype(np.int64)
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assignments, minlength=nlist))
+        return cls(centroids, order, offsets, nprobe=nprobe)
+
+    @staticmethod
+    def _assign(matrix: np.ndarray, centroids: np.ndarray, chunk_size: int = 8192) -> np.ndarray:
+        """分块计算每行向量最相近的聚类中心，避免一次生成 N x nlist 的大矩阵"""
+        assignments = np.empty(len(matrix), dtype=np.int64)
+        for start in range(0, len(matrix), chunk_size):
+            block = np.asarray(matrix[start:start + chunk_size], dtype=np.float32)
+            assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        return assignments
+
+    def extended(self, vectors: np.ndarray, start: int) -> "IVFFlatIndex":
+        """
+        返回追加了新行的索引：新行分配到最相近的已有列表，聚类中心不重新训练
+
+        :param vectors: 新行的归一化向量
+        :param start: 新行在矩阵中的起始行号
+        :return: 新索引（原索引不变）
+        """
+        if not len(vectors):
+            return self
+        labels = np.concatenate([
+            np.repeat(np.arange(self.nlist), np.diff(self.offsets)),
+            self._assign(vectors, self.centroids)
+        ])
+        rows = np.concatenate([self.order, np.arange(start, start + len(vectors), dtype=np.int64)])
+        permutation = np.argsort(labels, kind="stable")
+        offsets = np.zeros(self.nlist + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(labels, minlength=self.nlist))
+        return IVFFlatIndex(self.centroids, rows[permutation], offsets, nprobe=self.nprobe)
+
+    def search(self, matrix: np.ndarray, query: np.ndarray, k: int,
+               nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        近似检索最相似的 k 个条目
+
+        :param matrix: 构建索引时的向量矩阵
+        :param query: 已归一化的查询向量
+        :param k: 返回数量
+        :param nprobe: 检索的列表数量，为空时使用默认值
+        :return: (条目下标, 相似度) 列表，按相似度降序
+        """
+        lists = top_k(self.centroids @ query, nprobe or self.nprobe)
+        rows = [self.order[self.offsets[i]:self.offsets[i + 1]] for i in lists if self.offsets[i] < self.offsets[i + 1]]
+        if not rows:
+            return []
+        # 行号升序读取，内存映射矩阵按页顺序访问
+        rows = np.sort(np.concatenate(rows))
+        scores = np.asarray(matrix[rows], dtype=np.float32) @ query
+        return [(int(rows[i]), float(scores[i])) for i in top_k(scores, k)]
+
+
+def ann_index_path(file_path: str) -> str:
+    """
+    获取知识库对应的 ANN 索引文件路径（与知识库同目录，如 QAsql.json.ivf.npz）
+
+    :param file_path: 知识库文件路径
+    :return: 索引文件路径
+    """
+    return f"{file_path}.ivf.npz"
+
+
+def _fingerprint(groups: Dict[str, Any], source_mtime: Optional[float], nlist: Optional[int]) -> str:
+    """根据知识库版本、各组大小与构建参数生成指纹，任一变化时重新构建"""
+    payload = {
+        "version": ANN_INDEX_VERSION,
+        "source_mtime": source_mtime,
+        "nlist": nlist,
+        "groups": sorted((group_uuid, len(group), group.dimension) for group_uuid, group in groups.items())
+    }
+    return hashlib.sha256(json.dumps(payload).encode("utf-8")).hexdigest()
+
+
+def _load_persisted(index_path: str, fingerprint: str, nprobe: int) -> Optional[Dict[str, IVFFlatIndex]]:
+    """读取与指纹一致的已持久化索引"""
+    if not os.path.exists(index_path):
+        return None
+    try:
+        with np.load(index_path, allow_pickle=False) as data:
+            if str(data["fingerprint"]) != fingerprint:
+                return None
+            return {
+                str(group_uuid): IVFFlatIndex(data[f"centroids_{i}"], data[f"order_{i}"], data[f"offsets_{i}"], nprobe)
+                for i, group_uuid in enumerate(data["groups"])
+            }
+    except Exception as e:
+        logger.warning(f"读取ANN索引 {index_path} 失败，将重新构建: {str(e)}")
+        return None
+
+
+def _save(index_path: str, fingerprint: str, indexes: Dict[str, IVFFlatIndex]) -> None:
+    """原子写入索引文件"""
+    arrays: Dict[str, np.ndarray] = {
+        "fingerprint": np.asarray(fingerprint),
+        "groups": np.asarray(list(indexes.keys()), dtype=str)
+    }
+    for i, index in enumerate(indexes.values()):
+        arrays[f"centroids_{i}"] = index.centroids
+        arrays[f"order_{i}"] = index.order
+        arrays[f"offsets_{i}"] = index.offsets
+    with open(index_path + ".tmp", "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(index_path + ".tmp", index_path)
+
+
+def attach_ann_indexes(groups: Dict[str, Any], index_path: Optional[str], source_mtime: Optional[float],
+                       min_group_size: int, nlist: Optional[int] = None, nprobe: int = 16,
+                       iterations: int = 10) -> int:
+    """
+    为不少于 min_group_size 条的分组挂载 IVF 索引，小组继续使用精确检索
+
+    索引文件指纹与当前知识库一致时直接加载，否则重新训练并写回索引文件。
+    分组的矩阵与条目保持不变，内存映射矩阵继续由多个 worker 共享。
+
+    :param groups: group_uuid 到分组索引的映射
+    :param index_path: 索引文件路径，为空时不持久化
+    :param source_mtime: 知识库文件修改时间
+    :param min_group_size: 使用 ANN 检索的最小组大小
+    :param nlist: 倒排列表数量，为空时按组大小自动计算
+    :param nprobe: 检索的列表数量
+    :param iterations: k-means 迭代次数
+    :return: 挂载了 ANN 索引的组数
+    """
+    large_groups = {group_uuid: group for group_uuid, group in groups.items() if len(group) >= min_group_size}
+    if not large_groups:
+        return 0
+
+    fingerprint = _fingerprint(large_groups, source_mtime, nlist)
+    indexes = _load_persisted(index_path, fingerprint, nprobe) if index_path else None
+    if indexes is None or set(indexes) != set(large_groups):
+        start_time = time.perf_counter()
+        indexes = {
+            group_uuid: IVFFlatIndex.build(group.matrix, nlist=nlist, nprobe=nprobe, iterations=iterations)
+            for group_uuid, group in large_groups.items()
+        }
+        logger.info(f"Built IVF indexes for {len(indexes)} groups in {(time.perf_counter() - start_time) * 1000:.1f}ms")
+        if index_path:
+            try:
+                _save(index_path, fingerprint, indexes)
+            except OSError as e:
+                logger.warning(f"写入ANN索引 {index_path} 失败: {str(e)}")
+
+    for group_uuid, index in indexes.items():
+        large_groups[group_uuid].ann = index
+    return len(indexes)
+
+
+def recall_at_k(index: IVFFlatIndex, matrix: np.ndarray, queries: np.ndarray, k: int,
+                nprobe: Optional[int] = None) -> Dict[str, float]:
+    """
+    以精确检索为基准计算 recall@k 与平均耗时
+
+    :param index: IVF 索引
+    :param matrix: 构建索引时的向量矩阵
+    :param queries: 已归一化的查询矩阵
+    :param k: 返回数量
+    :param nprobe: 检索的列表数量
+    :return: recall、精确检索与近似检索的平均耗时（微秒）
+    """
+    hits, exact_seconds, ann_seconds = 0, 0.0, 0.0
+    for query in queries:
+        start_time = time.perf_counter()
+        expected = set(int(i) for i in top_k(matrix @ query, k))
+        exact_seconds += time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        found = set(i for i, _ in index.search(matrix, query, k, nprobe))
+        ann_seconds += time.perf_counter() - start_time
+        hits += len(expected & found)
+
+    total = len(queries) * min(k, len(matrix))
+    return {
+        "recall": hits / total if total else 1.0,
+        "exact_us": exact_seconds * 1e6 / len(queries) if len(queries) else 0.0,
+        "ann_us": ann_seconds * 1e6 / len(queries) if len(queries) else 0.0
+    }
@@ -0,0 +1,96 @@
+import copy
+from typing import Any, Dict, List
+
+
+class FormPatchError(ValueError):
+    """表单增量无法应用"""
+
+
+def apply_merge_patch(target: Dict[str, Any], patch: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    按 RFC 7396 (JSON Merge Patch) 应用增量，值为 null 表示删除字段
+
+    :param target: 原表单，不会被修改
+    :param patch: 增量对象
+    :return: 应用后的新表单
+    """
+    result = copy.deepcopy(target)
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        elif isinstance(value, dict):
+            base = result.get(key)
+            result[key] = apply_merge_patch(base if isinstance(base, dict) else {}, value)
+        else:
+            result[key] = copy.deepcopy(value)
+    return result
+
+
+def _decode_path(path: str) -> List[str]:
+    """解析 JSON Pointer 路径"""
+    if not isinstance(path, str) or not path.startswith("/"):
+        raise FormPatchError(f"无效路径: {path}")
+    return [token.replace("~1", "/").replace("~0", "~") for token in path[1:].split("/")]
+
+
+def _resolve_parent(document: Dict[str, Any], tokens: List[str]) -> Dict[str, Any]:
+    """定位路径的父对象"""
+    parent = document
+    for token in tokens[:-1]:
+        parent = parent.get(token) if isinstance(parent, dict) else None
+        if not isinstance(parent, dict):
+            raise FormPatchError(f"路径不存在: /{'/'.join(tokens)}")
+    return parent
+
+
+def apply_json_patch(target: Dict[str, Any], operations: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    按 RFC 6902 (JSON Patch) 应用增量，支持 add/replace/remove/test，表单只包含对象
+
+    :param target: 原表单，不会被修改
+    :param operations: 操作列表
+    :return: 应用后的新表单
+    :raises FormPatchError: 操作格式错误或路径不存在
+    """
+    result = copy.deepcopy(target)
+    for operation in operations:
+        if not isinstance(operation, dict):
+            raise FormPatchError(f"无效操作: {operation}")
+        op = operation.get("op")
+        tokens = _decode_path(operation.get("path"))
+        parent = _resolve_parent(result, tokens)
+        key = tokens[-1]
+        if op in ("add", "replace"):
+            if "value" not in operation:
+                raise FormPatchError(f"{op} 操作缺少 value")
+            if op == "replace" and key not in parent:
+                raise FormPatchError(f"replace 的字段不存在: {key}")
+            parent[key] = copy.deepcopy(operation["value"])
+        elif op == "remove":
+            if key not in parent:
+                raise FormPatchError(f"remove 的字段不存在: {key}")
+            del parent[key]
+        elif op == "test":
+            if parent.get(key) != operation.get("value"):
+                raise FormPatchError(f"test 校验失败: {key}")
+        else:
+            raise FormPatchError(f"不支持的操作: {op}")
+    return result
+
+
+def apply_form_patch(target: Dict[str, Any], patch: Any) -> Dict[str, Any]:
+    """
+    应用模型输出的表单增量：对象按 Merge Patch 处理，数组按 JSON Patch 处理，null 表示无变化
+
+    :param target: 原表单
+    :param patch: 增量
+    :return: 应用后的新表单
+    :raises FormPatchError: 增量格式错误
+    """
+    if patch is None:
+        return copy.deepcopy(target)
+    if isinstance(patch, dict):
+        return apply_merge_patch(target, patch)
+    if isinstance(patch, list):
+        return apply_json_patch(target, patch)
+    raise FormPatchError("增量必须为JSON对象、JSON Patch数组或null")
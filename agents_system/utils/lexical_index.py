@@ -0,0 +1,158 @@
+import re
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from agents_system.utils.vector_index import top_k
+
+
+# 标点与空白不参与匹配，"你们和哪些平台合作？" 与 "你们和哪些平台合作" 视为相同
+_IGNORED_CHARS = re.compile(r"[\s\W_]+", re.UNICODE)
+
+# 否定词用字："不需要开发票吗" 与 "需要开发票吗" 字符重合度很高，但意思相反
+_NEGATION_CHARS = re.compile("[\u4e0d\u6ca1\u65e0\u975e\u522b\u672a\u52ff\u83ab]")
+
+
+def normalize_question(text: str) -> str:
+    """
+    归一化问题文本：全角转半角、转小写、去除标点与空白
+
+    :param text: 原始文本
+    :return: 归一化后的文本
+    """
+    return _IGNORED_CHARS.sub("", unicodedata.normalize("NFKC", text or "").lower())
+
+
+def same_polarity(text_a: str, text_b: str) -> bool:
+    """
+    判断两个问题的否定词是否一致（否定词用字的种类与个数相同）
+
+    :param text_a: 问题文本
+    :param text_b: 问题文本
+    :return: 否定词一致时返回True
+    """
+    return Counter(_NEGATION_CHARS.findall(text_a or "")) == Counter(_NEGATION_CHARS.findall(text_b or ""))
+
+
+def char_ngrams(text: str, ngram_range: Tuple[int, int] = (1, 2)) -> List[str]:
+    """
+    提取字符 n-gram（中文无需分词，单字与双字组合即可覆盖大部分词）
+
+    :param text: 归一化后的文本
+    :param ngram_range: n 的取值范围（闭区间）
+    :return: n-gram 列表
+    """
+    grams = []
+    for n in range(ngram_range[0], ngram_range[1] + 1):
+        grams.extend(text[i:i + n] for i in range(len(text) - n + 1))
+    return grams
+
+
+class BM25Index:
+    """
+    字符 n-gram BM25 倒排索引
+
+    每个 n-gram 保存命中的文档下标与词频，检索时只累加查询 n-gram 的倒排列表。
+    BM25 分数没有上界，是否"几乎逐字相同"由 match_score 判断：按 IDF 加权的 n-gram 集合 Dice 系数，
+    完全相同的问题为 1.0，与文档长度无关。
+    """
+
+    def __init__(self, documents: Sequence[str], ngram_range: Tuple[int, int] = (1, 2),
+                 k1: float = 1.2, b: float = 0.75):
+        self.ngram_range = ngram_range
+        self.k1 = k1
+        self.b = b
+        self.normalized = [normalize_question(document) for document in documents]
+        self.exact: Dict[str, int] = {}
+        for i, text in enumerate(self.normalized):
+            self.exact.setdefault(text, i)
+
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.doc_terms: List[Counter] = []
+        for i, text in enumerate(self.normalized):
+            terms = Counter(char_ngrams(text, ngram_range))
+            self.doc_terms.append(terms)
+            for term, tf in terms.items():
+                postings.setdefault(term, []).append((i, tf))
+
+        count = len(documents)
+        self.doc_lengths = np.asarray([sum(terms.values()) for terms in self.doc_terms], dtype=np.float32)
+        avg_length = float(self.doc_lengths.mean()) if count and self.doc_lengths.sum() else 1.0
+        self.length_norm = self.k1 * (1 - self.b + self.b * self.doc_lengths / avg_length)
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {
+            term: (np.asarray([doc for doc, _ in items], dtype=np.int64), np.asarray([tf for _, tf in items], dtype=np.float32))
+            for term, items in postings.items()
+        }
+        self.idf: Dict[str, float] = {
+            term: float(np.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5)))
+            for term, (docs, _) in self.postings.items()
+        }
+        # 未出现过的 n-gram 按只出现在一篇文档中计算权重
+        self.default_idf = float(np.log(1 + (count - 0.5) / 1.5)) if count else 0.0
+
+    def __len__(self) -> int:
+        return len(self.normalized)
+
+    def scores(self, query: str) -> np.ndarray:
+        """
+        计算查询与全部文档的 BM25 分数
+
+        :param query: 查询文本
+        :return: 分数向量
+        """
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term, qtf in Counter(char_ngrams(normalize_question(query), self.ngram_range)).items():
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            docs, tfs = posting
+            scores[docs] += qtf * self.idf[term] * tfs * (self.k1 + 1) / (tfs + self.length_norm[docs])
+        return scores
+
+    def match_score(self, query: str, doc: int) -> float:
+        """
+        查询与文档的 IDF 加权 n-gram Dice 系数
+
+        :param query: 查询文本
+        :param doc: 文档下标
+        :return: 0~1 的匹配度，归一化后完全相同时为 1.0
+        """
+        query_terms = set(char_ngrams(normalize_question(query), self.ngram_range))
+        doc_terms = set(self.doc_terms[doc])
+        weight = lambda terms: sum(self.idf.get(term, self.default_idf) for term in terms)
+        total = weight(query_terms) + weight(doc_terms)
+        return 2 * weight(query_terms & doc_terms) / total if total else 0.0
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float, float]]:
+        """
+        检索 BM25 分数最高的 k 个文档
+
+        :param query: 查询文本
+        :param k: 返回数量
+        :return: (文档下标, BM25 分数, 匹配度) 列表，按 BM25 分数降序；归一化后完全相同的问题排在最前
+        """
+        if not len(self):
+            return []
+        scores = self.scores(query)
+        hits = [(int(i), float(scores[i])) for i in top_k(scores, k) if scores[i] > 0]
+        exact_doc = self.exact.get(normalize_question(query))
+        if exact_doc is not None:
+            hits = [(exact_doc, float(scores[exact_doc]))] + [hit for hit in hits if hit[0] != exact_doc][:k - 1]
+        return [(i, score, 1.0 if i == exact_doc else self.match_score(query, i)) for i, score in hits]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Any]], k: int = 60) -> List[Tuple[Any, float]]:
+    """
+    倒数排名融合（RRF）：score = Σ 1 / (k + rank)，不依赖各路分数的量纲
+
+    :param rankings: 多路检索结果的键列表（各自按相关度降序）
+    :param k: 平滑常数
+    :return: (键, 融合分数) 列表，按融合分数降序
+    """
+    fused: Dict[Any, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
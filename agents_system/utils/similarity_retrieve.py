@@ -1,118 +1,451 @@
-# import asyncio
-# import json
-# import mysql.connector  # 仅使用mysql相关包
-# import numpy as np
-# from openai import AsyncOpenAI
-# from typing import List, Dict
-#
-# from agents_system.config.settings import settings
-#
-# # 初始化OpenAI客户端
-# openai_client = AsyncOpenAI(
-#     api_key=settings.API_KEY,
-#     base_url=settings.BASE_URL
-# )
-#
-# # 数据库配置（不依赖DictCursor导入）
-# DB_CONFIG = {
-#     'host': settings.DB_HOST,
-#     'user': settings.DB_USER,
-#     'password': settings.DB_PASSWORD,
-#     'database': settings.DB_NAME,
-#     'charset': 'utf8mb4'
-# }
-#
-#
-# async def batch_get_vectors(sentences: List[str], model: str = settings.EMBEDDING_MODEL) -> Dict[str, List[float]]:
-#     """获取句子向量"""
-#     response = await openai_client.embeddings.create(
-#         model=model,
-#         input=sentences
-#     )
-#     return {word: emb for word, emb in zip(sentences, [x.embedding for x in response.data])}
-#
-#
-# def cosine_similarity(vector_a: List[float], vector_b: List[float]) -> float:
-#     """计算余弦相似度"""
-#     a = np.array(vector_a, dtype=float)
-#     b = np.array(vector_b, dtype=float)
-#
-#     if len(a) != len(b):
-#         raise ValueError("向量长度必须相同")
-#     if not np.any(a) or not np.any(b):
-#         raise ValueError("不允许零向量")
-#
-#     dot_product = np.dot(a, b)
-#     norm_a = np.linalg.norm(a)
-#     norm_b = np.linalg.norm(b)
-#
-#     return np.clip(dot_product / (norm_a * norm_b), -1.0, 1.0)
-#
-#
-# async def search_similar_in_group(query: str, graph_uuid: str, top_n: int = 5):
-#     """在指定组内搜索最相似的句子（修复游标问题）"""
-#     # 1. 获取查询句子的向量
-#     query_vectors = await batch_get_vectors([query])
-#     query_vector = query_vectors[query]
-#
-#     # 2. 从数据库获取指定组的句子向量
-#     conn = None
-#     try:
-#         # 建立连接时不指定游标类型
-#         conn = mysql.connector.connect(**DB_CONFIG)
-#         # 创建游标时显式指定为字典游标（关键修复）
-#         cursor = conn.cursor(dictionary=True)  # 这里指定dictionary=True
-#
-#         # 只查询指定graph_uuid组的句子
-#         data = """
-#         SELECT id, group_uuid, question, answer, vector, vector_model, create_time
-#         FROM sentence_vector
-#         WHERE group_uuid = %s
-#         """
-#
-#         cursor.execute(data, (graph_uuid,))
-#         results = cursor.fetchall()  # 现在返回的是字典列表
-#
-#         if not results:
-#             print(f"未找到group_uuid为{graph_uuid}的句子")
-#             return []
-#
-#         # 3. 计算相似度并排序
-#         similarity_results = []
-#         for row in results:
-#             try:
-#                 stored_vector = json.loads(row['vector'])
-#                 similarity = cosine_similarity(query_vector, stored_vector)
-#                 row_with_sim = row.copy()
-#                 row_with_sim['similarity'] = float(similarity)
-#                 similarity_results.append(row_with_sim)
-#             except Exception as e:
-#                 print(f"处理句子ID {row['id']} 时出错: {str(e)}")
-#                 continue
-#
-#         # 4. 按相似度降序排序并返回前N个结果
-#         similarity_results.sort(key=lambda x: x['similarity'], reverse=True)
-#         results =  similarity_results[:top_n]
-#         info = ""
-#         for result in results:
-#             info += f"问题: {result['question']} 答案: {result['answer']}\n"
-#         return info
-#     except mysql.connector.Error as e:
-#         print(f"数据库操作出错: {str(e)}")
-#         raise
-#     finally:
-#         if conn and conn.is_connected():
-#             conn.close()
-#
-#
-# # 使用示例
-# async def main():
-#     query_sentence = "目前你们和哪些平台达人合作？"
-#     target_group_uuid = "dbd188e7-ee4d-47fb-9c8f-4b6e9da24086"
-#
-#     results = await search_similar_in_group(query_sentence, target_group_uuid)
-#     print(results)
-#
-#
-# if __name__ == "__main__":
-#     asyncio.run(main())
+import argparse
+import asyncio
+import json
+import os
+import queue
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from agents_system.config.settings import settings
+from agents_system.utils.logger import get_logger
+from agents_system.utils.vector_index import GroupIndex, QAVectorIndex
+
+
+logger = get_logger(__name__)
+
+# 同步水位：(create_time, id)，create_time 相同的行按 id 继续翻页，不会漏行
+Watermark = Tuple[str, int]
+
+BASE_COLUMNS = "id, group_uuid, question, answer, vector, create_time"
+
+
+def encode_vector(vector: Any) -> bytes:
+    """
+    向量编码为 float32 小端二进制（vector_blob 列格式）
+
+    :param vector: 向量
+    :return: 二进制内容
+    """
+    return np.asarray(vector, dtype="<f4").tobytes()
+
+
+def decode_vector(row: Dict[str, Any]) -> np.ndarray:
+    """
+    解码行中的向量，优先使用二进制列，未迁移的行回退到 JSON 文本列
+
+    :param row: 数据行
+    :return: float32 向量
+    """
+    if row.get("vector_blob"):
+        return np.frombuffer(row["vector_blob"], dtype="<f4")
+    return np.asarray(json.loads(row["vector"]), dtype=np.float32)
+
+
+class SentenceVectorStore:
+    """
+    sentence_vector 表访问
+
+    连接从连接池借出，查询在线程中执行，不阻塞事件循环；并发查询数不超过连接池大小。
+    向量优先读取 vector_blob 二进制列（float32），比逐行 json.loads 快一个数量级。
+    MySQL 使用 mysql.connector 自带连接池，SQLite 作为本地测试替身。
+    """
+
+    def __init__(self, backend: str = "mysql", pool_size: int = 5, sqlite_path: Optional[str] = None):
+        self.backend = backend
+        self.pool_size = pool_size
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._select_columns: Optional[str] = None
+        if backend == "mysql":
+            from mysql.connector import pooling
+            self._pool = pooling.MySQLConnectionPool(
+                pool_name="sentence_vector",
+                pool_size=pool_size,
+                host=settings.DB_HOST,
+                user=settings.DB_USER,
+                password=settings.DB_PASSWORD,
+                database=settings.DB_NAME,
+                charset="utf8mb4"
+            )
+        elif backend == "sqlite":
+            sqlite_path = sqlite_path or settings.QA_DB_SQLITE_PATH
+            db_dir = os.path.dirname(sqlite_path)
+            if db_dir and not os.path.exists(db_dir):
+                os.makedirs(db_dir)
+            self._pool = queue.Queue()
+            for _ in range(pool_size):
+                conn = sqlite3.connect(sqlite_path, check_same_thread=False)
+                conn.row_factory = sqlite3.Row
+                self._pool.put(conn)
+        else:
+            raise ValueError(f"不支持的检索数据源: {backend}")
+
+    @contextmanager
+    def _connection(self) -> Iterator[Any]:
+        """从连接池借出连接，用完归还"""
+        if self.backend == "mysql":
+            conn = self._pool.get_connection()
+            try:
+                yield conn
+            finally:
+                conn.close()
+        else:
+            conn = self._pool.get()
+            try:
+                yield conn
+            finally:
+                self._pool.put(conn)
+
+    def _execute(self, sql: str, params: Tuple = (), commit: bool = False) -> List[Dict[str, Any]]:
+        """在当前线程执行SQL并以字典列表返回结果（SQL 中的占位符统一写作 %s）"""
+        with self._connection() as conn:
+            if self.backend == "mysql":
+                cursor = conn.cursor(dictionary=True)
+            else:
+                sql = sql.replace("%s", "?")
+                cursor = conn.cursor()
+            try:
+                cursor.execute(sql, params)
+                rows = cursor.fetchall() if cursor.description else []
+                if commit:
+                    conn.commit()
+            finally:
+                cursor.close()
+        return [dict(row) for row in rows]
+
+    def _execute_many(self, sql: str, params: List[Tuple]) -> None:
+        """在当前线程批量执行写入SQL并提交"""
+        with self._connection() as conn:
+            if self.backend != "mysql":
+                sql = sql.replace("%s", "?")
+            cursor = conn.cursor()
+            try:
+                cursor.executemany(sql, params)
+                conn.commit()
+            finally:
+                cursor.close()
+
+    def _column_names(self) -> List[str]:
+        """读取 sentence_vector 表的列名"""
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT * FROM sentence_vector LIMIT 0")
+                cursor.fetchall()
+                return [column[0] for column in cursor.description]
+            finally:
+                cursor.close()
+
+    async def select_columns(self) -> str:
+        """查询列，未迁移（没有 vector_blob 列）的表只读取 JSON 文本列"""
+        if self._select_columns is None:
+            columns = await asyncio.to_thread(self._column_names)
+            self._select_columns = BASE_COLUMNS + (", vector_blob" if "vector_blob" in columns else "")
+        return self._select_columns
+
+    async def execute(self, sql: str, params: Tuple = (), commit: bool = False) -> List[Dict[str, Any]]:
+        """
+        在线程中执行SQL
+
+        :param sql: SQL 语句（占位符为 %s）
+        :param params: 参数
+        :param commit: 是否提交
+        :return: 结果行
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.pool_size)
+        async with self._semaphore:
+            return await asyncio.to_thread(self._execute, sql, params, commit)
+
+    async def fetch_group(self, group_uuid: str) -> List[Dict[str, Any]]:
+        """
+        读取指定组的全部句子
+
+        :param group_uuid: 问答组ID
+        :return: 结果行
+        """
+        return await self.execute(
+            f"SELECT {await self.select_columns()} FROM sentence_vector WHERE group_uuid = %s ORDER BY id",
+            (group_uuid,)
+        )
+
+    async def fetch_since(self, watermark: Optional[Watermark], limit: int) -> List[Dict[str, Any]]:
+        """
+        按 (create_time, id) 升序读取水位之后的句子
+
+        :param watermark: 同步水位，为空时从头读取
+        :param limit: 单次读取行数
+        :return: 结果行
+        """
+        columns = await self.select_columns()
+        if watermark is None:
+            return await self.execute(
+                f"SELECT {columns} FROM sentence_vector ORDER BY create_time, id LIMIT %s",
+                (limit,)
+            )
+        create_time, row_id = watermark
+        return await self.execute(
+            f"SELECT {columns} FROM sentence_vector "
+            "WHERE create_time > %s OR (create_time = %s AND id > %s) "
+            "ORDER BY create_time, id LIMIT %s",
+            (create_time, create_time, row_id, limit)
+        )
+
+    async def migrate_binary_vectors(self, batch_size: int = 1000) -> int:
+        """
+        为 vector_blob 列回填二进制向量
+
+        列需先添加，MySQL: ALTER TABLE sentence_vector ADD COLUMN vector_blob MEDIUMBLOB NULL
+
+        :param batch_size: 每批转换行数
+        :return: 转换行数
+        """
+        converted = 0
+        while True:
+            rows = await self.execute(
+                "SELECT id, vector FROM sentence_vector WHERE vector_blob IS NULL AND vector IS NOT NULL LIMIT %s",
+                (batch_size,)
+            )
+            if not rows:
+                self._select_columns = None
+                return converted
+            params = [(encode_vector(json.loads(row["vector"])), row["id"]) for row in rows]
+            await asyncio.to_thread(
+                self._execute_many, "UPDATE sentence_vector SET vector_blob = %s WHERE id = %s", params
+            )
+            converted += len(rows)
+            logger.info(f"已转换 {converted} 行向量为二进制")
+
+    def close(self) -> None:
+        """关闭连接池中的连接"""
+        if self.backend == "sqlite":
+            while not self._pool.empty():
+                self._pool.get_nowait().close()
+
+
+class SyncedQAIndex(QAVectorIndex):
+    """
+    由数据库同步的问答知识库索引
+
+    启动时全量加载，之后后台任务按 (create_time, id) 水位只拉取新增行并追加到对应分组；
+    检索接口与文件索引相同。水位同步只能发现新增行，已有行的修改与删除需要全量同步（full_sync）。
+    开启 ANN 时索引只在内存中构建：新增行并入已有倒排列表，新达到 ANN_MIN_GROUP_SIZE 的组单独训练。
+    """
+
+    def __init__(self, store: SentenceVectorStore, sync_interval: float = 30.0, batch_size: int = 1000):
+        super().__init__(file_path=f"{store.backend}://sentence_vector")
+        self.store = store
+        self.sync_interval = sync_interval
+        self.batch_size = batch_size
+        self.watermark: Optional[Watermark] = None
+        self._sync_task: Optional[asyncio.Task] = None
+        self._sync_stats = {"syncs": 0, "synced_rows": 0, "sync_errors": 0, "last_sync_at": None}
+
+    def refresh(self) -> bool:
+        """数据由后台同步任务更新，检索时不检查文件"""
+        return False
+
+    def _attach_ann(self, groups: Dict[str, GroupIndex]) -> None:
+        """为尚未挂载 ANN 索引的大组训练索引（不持久化），失败时保持精确检索"""
+        from agents_system.utils.ann_index import attach_ann_indexes
+        try:
+            attach_ann_indexes(
+                {group_uuid: group for group_uuid, group in groups.items() if group.ann is None},
+                index_path=None,
+                source_mtime=None,
+                min_group_size=settings.ANN_MIN_GROUP_SIZE,
+                nlist=settings.ANN_NLIST,
+                nprobe=settings.ANN_NPROBE,
+                iterations=settings.ANN_TRAIN_ITERATIONS
+            )
+        except Exception as e:
+            logger.error(f"构建ANN索引失败，使用精确检索: {str(e)}")
+
+    @staticmethod
+    def _rows_to_groups(rows: List[Dict[str, Any]], dimensions: Optional[Dict[str, int]] = None
+                        ) -> Dict[str, Tuple[List[np.ndarray], List[Dict[str, Any]]]]:
+        """
+        按组拆分行，并解码向量；向量无效或维度与组内其他向量不一致的行跳过，不影响整组
+
+        :param rows: 数据行
+        :param dimensions: 已有分组的向量维度，新增行需与之一致
+        :return: group_uuid 到 (向量列表, 条目列表) 的映射
+        """
+        groups: Dict[str, Tuple[List[np.ndarray], List[Dict[str, Any]]]] = {}
+        dimensions = dict(dimensions or {})
+        for row in rows:
+            try:
+                vector = decode_vector(row)
+            except Exception as e:
+                logger.warning(f"处理句子ID {row.get('id')} 时出错: {str(e)}")
+                continue
+            if vector.ndim != 1 or not len(vector) or len(vector) != dimensions.setdefault(row["group_uuid"], len(vector)):
+                logger.warning(
+                    f"跳过向量维度无效的句子ID {row.get('id')}: {vector.shape}，组内维度 {dimensions.get(row['group_uuid'])}"
+                )
+                continue
+            vectors, entries = groups.setdefault(row["group_uuid"], ([], []))
+            vectors.append(vector)
+            entries.append({
+                "id": row["id"],
+                "question": row["question"],
+                "answer": row["answer"],
+                "create_time": str(row["create_time"])
+            })
+        return groups
+
+    def _build_groups(self, rows: List[Dict[str, Any]]) -> Dict[str, GroupIndex]:
+        """由全量行构建分组索引（在线程中执行）"""
+        groups = {
+            group_uuid: GroupIndex(np.asarray(vectors, dtype=np.float32), entries)
+            for group_uuid, (vectors, entries) in self._rows_to_groups(rows).items()
+        }
+        self.prepare(groups)
+        return groups
+
+    def _merge_groups(self, groups: Dict[str, GroupIndex], rows: List[Dict[str, Any]]) -> Dict[str, GroupIndex]:
+        """
+        把新增行合并为新的分组索引（在线程中执行）；只重建有新增的分组，未变化的分组直接复用
+
+        :param groups: 当前分组索引
+        :param rows: 新增行
+        :return: 新的分组索引
+        """
+        merged = dict(groups)
+        changed = {}
+        dimensions = {group_uuid: group.dimension for group_uuid, group in groups.items() if len(group)}
+        for group_uuid, (vectors, entries) in self._rows_to_groups(rows, dimensions).items():
+            vectors = np.asarray(vectors, dtype=np.float32)
+            group = groups.get(group_uuid)
+            changed[group_uuid] = group.extended(vectors, entries) if group is not None else GroupIndex(vectors, entries)
+        self.prepare(changed)
+        merged.update(changed)
+        return merged
+
+    async def _fetch_batches(self, watermark: Optional[Watermark]) -> Tuple[List[Dict[str, Any]], Optional[Watermark]]:
+        """分批读取水位之后的全部行"""
+        rows: List[Dict[str, Any]] = []
+        while True:
+            batch = await self.store.fetch_since(watermark, self.batch_size)
+            if not batch:
+                return rows, watermark
+            rows.extend(batch)
+            watermark = (batch[-1]["create_time"], batch[-1]["id"])
+            if len(batch) < self.batch_size:
+                return rows, watermark
+
+    async def full_sync(self) -> int:
+        """
+        全量加载并整体替换索引
+
+        :return: 加载行数
+        """
+        start_time = time.perf_counter()
+        rows, watermark = await self._fetch_batches(None)
+        groups = await asyncio.to_thread(self._build_groups, rows)
+        self.groups = groups
+        self.watermark = watermark
+        elapsed = time.perf_counter() - start_time
+        self._stats["loads"] += 1
+        self._stats["load_seconds"] += elapsed
+        logger.info(f"Loaded QA index from {self.file_path}: {len(rows)} rows, {len(groups)} groups in {elapsed * 1000:.1f}ms")
+        return len(rows)
+
+    async def sync(self) -> int:
+        """
+        增量同步水位之后的新增行
+
+        :return: 新增行数
+        """
+        rows, watermark = await self._fetch_batches(self.watermark)
+        if rows:
+            self.groups = await asyncio.to_thread(self._merge_groups, self.groups, rows)
+            logger.info(f"同步新增 {len(rows)} 条问答，水位 {watermark}")
+        self.watermark = watermark
+        self._sync_stats["syncs"] += 1
+        self._sync_stats["synced_rows"] += len(rows)
+        self._sync_stats["last_sync_at"] = time.time()
+        return len(rows)
+
+    async def _sync_loop(self) -> None:
+        """后台定时同步"""
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                self._sync_stats["sync_errors"] += 1
+                logger.error(f"问答知识库同步失败: {str(e)}")
+
+    async def start(self) -> None:
+        """全量加载后启动后台同步任务"""
+        await self.full_sync()
+        if self._sync_task is None or self._sync_task.done():
+            self._sync_task = asyncio.create_task(self._sync_loop())
+
+    async def stop(self) -> None:
+        """停止后台同步任务并关闭连接池"""
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            try:
+                await self._sync_task
+            except asyncio.CancelledError:
+                pass
+            self._sync_task = None
+        self.store.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """获取加载、检索与同步统计"""
+        return {**super().stats(), "sync": {**self._sync_stats, "watermark": self.watermark}}
+
+
+# 全局数据库同步索引实例（QA_SOURCE 为 mysql 或 sqlite 时使用）
+synced_index: Optional[SyncedQAIndex] = None
+
+
+def get_synced_index() -> SyncedQAIndex:
+    """获取数据库同步索引实例"""
+    global synced_index
+    if synced_index is None:
+        synced_index = SyncedQAIndex(
+            SentenceVectorStore(settings.QA_SOURCE, pool_size=settings.QA_DB_POOL_SIZE),
+            sync_interval=settings.QA_DB_SYNC_INTERVAL,
+            batch_size=settings.QA_DB_SYNC_BATCH_SIZE
+        )
+    return synced_index
+
+
+async def search_similar_in_group(query: str, group_uuid: str, top_n: int = 5):
+    """在指定组内搜索最相似的句子（从数据库同步的内存索引中检索）"""
+    from agents_system.models.embedding import get_embedding_model
+    from agents_system.utils.similarity_retrieve_json import format_qa_reference
+
+    query_vector = await get_embedding_model().embed(query)
+    results = get_synced_index().search(group_uuid, query_vector, top_n)
+    if not results:
+        return []
+    return format_qa_reference(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="sentence_vector 表维护")
+    parser.add_argument("command", choices=["migrate", "sync"], help="migrate: 回填 vector_blob 二进制列；sync: 全量加载并输出统计")
+    parser.add_argument("--backend", default=settings.QA_SOURCE if settings.QA_SOURCE != "file" else "mysql")
+    args = parser.parse_args()
+
+    async def main():
+        store = SentenceVectorStore(args.backend, pool_size=settings.QA_DB_POOL_SIZE)
+        try:
+            if args.command == "migrate":
+                print(f"converted: {await store.migrate_binary_vectors()}")
+            else:
+                index = SyncedQAIndex(store)
+                await index.full_sync()
+                print(json.dumps(index.stats(), ensure_ascii=False, indent=2, default=str))
+        finally:
+            store.close()
+
+    asyncio.run(main())
@@ -1,24 +1,33 @@
 import asyncio
-import json
-import os
 import numpy as np
-from openai import AsyncOpenAI
-from typing import List, Dict
+from typing import Any, List, Dict, Optional
 
-# 初始化OpenAI客户端
-openai_client = AsyncOpenAI(
-    api_key="fb1a7bd2-fca4-47e0-9ea4-ef8661f01b7e",
-    base_url="https://ark.cn-beijing.volces.com/api/v3"
-)
+from agents_system.config.settings import settings
+from agents_system.models.embedding import get_embedding_model
+from agents_system.utils.lexical_index import normalize_question, reciprocal_rank_fusion, same_polarity
+from agents_system.utils.vector_index import QAVectorIndex, get_qa_index
+
+
+def get_retrieval_index(file_path: Optional[str] = None) -> QAVectorIndex:
+    """
+    获取问答知识库索引：指定文件时使用文件索引，否则按配置 QA_SOURCE 选择文件或数据库同步索引
+
+    :param file_path: 知识库文件路径
+    :return: 索引实例
+    """
+    if file_path is None and settings.QA_SOURCE != "file":
+        from agents_system.utils.similarity_retrieve import get_synced_index
+        return get_synced_index()
+    return get_qa_index(file_path or settings.QA_JSON_PATH)
 
 
 async def batch_get_vectors(sentences: List[str], model: str = "doubao-embedding-large-text-250515") -> Dict[str, List[float]]:
-    """获取句子向量"""
-    response = await openai_client.embeddings.create(
-        model=model,
-        input=sentences
-    )
-    return {word: emb for word, emb in zip(sentences, [x.embedding for x in response.data])}
+    """获取句子向量（经向量缓存与微批合并）"""
+    embedding_model = get_embedding_model()
+    if model != embedding_model.model:
+        raise ValueError(f"向量模型不一致: {model}")
+    vectors = await embedding_model.embed_many(sentences)
+    return {word: emb.tolist() for word, emb in zip(sentences, vectors)}
 
 
 def cosine_similarity(vector_a: List[float], vector_b: List[float]) -> float:
@@ -38,60 +47,95 @@ def cosine_similarity(vector_a: List[float], vector_b: List[float]) -> float:
     return np.clip(dot_product / (norm_a * norm_b), -1.0, 1.0)
 
 
-async def search_similar_in_group(query: str, group_uuid: str, top_n: int = 5, file_path: str = r"D:\PycharmProjects\zc_project\agents_system\data\QAsql.json"):
-    """在指定组内搜索最相似的句子（从JSON文件中检索）"""
-    # current_dir = os.path.dirname(os.path.abspath(__file__))
-    # # 拼接得到文件的完整路径
-    # file_path = os.path.join(current_dir, file_name)
-
-    # 1. 获取查询句子的向量
-    query_vectors = await batch_get_vectors([query])
-    query_vector = query_vectors[query]
-
-    # 2. 从JSON文件获取指定组的句子向量
-    try:
-        if not os.path.exists(file_path):  # 使用拼接后的完整路径
-            print(f"文件 {file_path} 不存在")
-            return []
-
-        # 读取JSON文件内容
-        with open(file_path, 'r', encoding='utf-8') as f:  # 使用完整路径
-            data = json.load(f)
-
-        # 查找指定group_uuid的组
-        target_group = next((group for group in data if group.get("group_uuid") == group_uuid), None)
-
-        if not target_group or "entries" not in target_group:
-            print(f"未找到group_uuid为{group_uuid}的句子组")
-            return []
-
-        # 3. 计算相似度并排序
-        similarity_results = []
-        for entry in target_group["entries"]:
-            try:
-                stored_vector = entry['vector']
-                similarity = cosine_similarity(query_vector, stored_vector)
-                entry_with_sim = entry.copy()
-                entry_with_sim['similarity'] = float(similarity)
-                similarity_results.append(entry_with_sim)
-            except Exception as e:
-                print(f"处理句子 '{entry.get('question', '未知')}' 时出错: {str(e)}")
-                continue
-
-        # 4. 按相似度降序排序并返回前N个结果
-        similarity_results.sort(key=lambda x: x['similarity'], reverse=True)
-        results = similarity_results[:top_n]
-
-        # 格式化结果信息
-        info = ""
-        for result in results:
-            info += f"问题: {result['question']} 答案: {result['answer']}\n"
-
-        return info.strip()  # 去除末尾多余的换行
-
-    except Exception as e:
-        print(f"处理文件时出错: {str(e)}")
-        raise
+async def search_similar_with_scores(query: str, group_uuid: str, top_n: int = 5,
+                                     file_path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    在指定组内搜索最相似的问答并返回相似度
+
+    :param query: 查询句子
+    :param group_uuid: 问答组ID
+    :param top_n: 返回数量
+    :param file_path: 知识库文件路径，默认按配置 QA_SOURCE 选择数据源
+    :return: 条目列表，每项包含 question、answer、similarity 等字段，按相似度降序
+    """
+    # 1. 获取查询句子的向量（命中缓存时不调用向量接口，并发查询合并为一次调用）
+    query_vector = await get_embedding_model().embed(query)
+
+    # 2. 在常驻内存的归一化索引中检索（文件修改后自动重新加载）
+    return get_retrieval_index(file_path).search(group_uuid, query_vector, top_n)
+
+
+async def search_hybrid(query: str, group_uuid: str, top_n: int = 5, file_path: Optional[str] = None,
+                        lexical_threshold: Optional[float] = None,
+                        vector_threshold: Optional[float] = None,
+                        fuzzy: Optional[bool] = None) -> Dict[str, Any]:
+    """
+    词法（BM25）与向量混合检索，高置信度命中时直接给出知识库条目
+
+    先做不需要向量接口的 BM25 检索，问题归一化后完全相同时直接返回；否则再做向量检索，
+    按倒数排名融合两路结果。开启模糊直接回答时，词法匹配度或向量相似度达到阈值、
+    且与知识库问题的否定词一致时也直接返回（避免"不需要开发票吗"命中"需要开发票吗"）。
+
+    :param query: 查询句子
+    :param group_uuid: 问答组ID
+    :param top_n: 返回数量
+    :param file_path: 知识库文件路径，默认按配置 QA_SOURCE 选择数据源
+    :param lexical_threshold: 词法匹配度阈值，默认使用配置 QA_LEXICAL_THRESHOLD
+    :param vector_threshold: 向量相似度阈值，默认使用配置 QA_VECTOR_THRESHOLD
+    :param fuzzy: 是否开启模糊直接回答，默认使用配置 QA_FUZZY_DIRECT_ANSWER_ENABLED
+    :return: {"direct": 高置信度条目或None, "source": "lexical"/"vector"/None, "results": 条目列表}
+    """
+    lexical_threshold = settings.QA_LEXICAL_THRESHOLD if lexical_threshold is None else lexical_threshold
+    vector_threshold = settings.QA_VECTOR_THRESHOLD if vector_threshold is None else vector_threshold
+    fuzzy = settings.QA_FUZZY_DIRECT_ANSWER_ENABLED if fuzzy is None else fuzzy
+
+    lexical_results = get_retrieval_index(file_path).lexical_search(group_uuid, query, top_n)
+    normalized_query = normalize_question(query)
+    # 空白或纯标点的查询归一化后为空，不直接回答（可能与归一化后同样为空的知识库问题"完全相同"）
+    if lexical_results and normalized_query:
+        top = lexical_results[0]
+        if normalize_question(top["question"]) == normalized_query or (
+                fuzzy and top["lexical_score"] >= lexical_threshold and same_polarity(query, top["question"])):
+            return {"direct": top, "source": "lexical", "results": lexical_results}
+
+    vector_results = await search_similar_with_scores(query, group_uuid, top_n, file_path)
+    if fuzzy and normalized_query and vector_results and vector_results[0]["similarity"] >= vector_threshold \
+            and same_polarity(query, vector_results[0]["question"]):
+        return {"direct": vector_results[0], "source": "vector", "results": vector_results}
+
+    # 同一问答在两路结果中以 (问题, 答案) 对应
+    entries = {}
+    for result in lexical_results + vector_results:
+        entries.setdefault((result["question"], result["answer"]), {}).update(result)
+    fused = reciprocal_rank_fusion([
+        [(result["question"], result["answer"]) for result in vector_results],
+        [(result["question"], result["answer"]) for result in lexical_results]
+    ])
+    results = [{**entries[key], "fusion_score": score} for key, score in fused[:top_n]]
+    return {"direct": None, "source": None, "results": results}
+
+
+def format_qa_reference(results: List[Dict[str, Any]]) -> str:
+    """
+    将检索结果格式化为提示词中的背景信息
+
+    :param results: 检索结果条目
+    :return: 每行一条 "问题: .. 答案: .."
+    """
+    info = ""
+    for result in results:
+        info += f"问题: {result['question']} 答案: {result['answer']}\n"
+
+    return info.strip()  # 去除末尾多余的换行
+
+
+async def search_similar_in_group(query: str, group_uuid: str, top_n: int = 5, file_path: Optional[str] = None):
+    """在指定组内搜索最相似的句子（从JSON文件构建的内存索引中检索）"""
+    results = await search_similar_with_scores(query, group_uuid, top_n, file_path)
+    if not results:
+        return []
+
+    return format_qa_reference(results)
 
 
 # 使用示例
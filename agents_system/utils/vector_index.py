@@ -0,0 +1,354 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from agents_system.config.settings import settings
+from agents_system.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """
+    按行 L2 归一化，零向量保持为零（相似度恒为0）
+
+    :param vectors: 二维向量矩阵
+    :return: float32 归一化矩阵
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def normalize_vector(vector: Sequence[float]) -> np.ndarray:
+    """
+    L2 归一化单个查询向量
+
+    :param vector: 查询向量
+    :return: float32 归一化向量
+    :raises ValueError: 零向量
+    """
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        raise ValueError("不允许零向量")
+    return vector / norm
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    取得分最高的 k 个下标（降序），先 argpartition 再对 k 个结果排序
+
+    :param scores: 得分向量
+    :param k: 返回数量
+    :return: 下标数组
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class GroupIndex:
+    """
+    单个问答组的向量索引
+
+    向量保存为 L2 归一化的 float32 矩阵，余弦相似度即一次矩阵-向量乘积；
+    挂载了 ANN 索引（ann）的大组只对候选列表计算相似度；问题文本的 BM25 索引在首次词法检索时构建。
+    """
+
+    def __init__(self, vectors: np.ndarray, entries: List[Dict[str, Any]]):
+        self.matrix = normalize_rows(vectors) if len(entries) else np.zeros((0, 0), dtype=np.float32)
+        self.entries = entries
+        self.ann = None
+        self._lexical = None
+
+    @classmethod
+    def from_normalized(cls, matrix: np.ndarray, entries: List[Dict[str, Any]]) -> "GroupIndex":
+        """
+        使用已归一化的矩阵创建索引，不复制数据（可直接传入内存映射矩阵）
+
+        :param matrix: 已归一化的 float32 矩阵
+        :param entries: 条目元数据
+        """
+        index = cls.__new__(cls)
+        index.matrix = matrix
+        index.entries = entries
+        index.ann = None
+        index._lexical = None
+        return index
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def dimension(self) -> int:
+        """向量维度"""
+        return self.matrix.shape[1] if self.matrix.ndim == 2 else 0
+
+    def extended(self, vectors: np.ndarray, entries: List[Dict[str, Any]]) -> "GroupIndex":
+        """
+        返回追加了新条目的索引（重建矩阵，适用于增量同步等低频写入）；原索引不变，检索中的请求继续使用
+
+        :param vectors: 新条目的向量
+        :param entries: 新条目的元数据
+        :return: 新索引（已有 ANN 索引时新条目并入原倒排列表，BM25 索引需重新构建）
+        """
+        if not entries:
+            return self
+        added = normalize_rows(vectors)
+        matrix = added if not len(self.entries) else np.vstack([self.matrix, added])
+        index = GroupIndex.from_normalized(matrix, self.entries + entries)
+        if self.ann is not None:
+            index.ann = self.ann.extended(added, len(self.entries))
+        return index
+
+    @property
+    def lexical(self):
+        """问题文本的字符 n-gram BM25 索引（首次使用时构建）"""
+        if self._lexical is None:
+            from agents_system.utils.lexical_index import BM25Index
+            self._lexical = BM25Index([entry.get("question", "") for entry in self.entries])
+        return self._lexical
+
+    def search(self, query: np.ndarray, k: int, exact: bool = False) -> List[Tuple[int, float]]:
+        """
+        检索最相似的 k 个条目
+
+        :param query: 已归一化的查询向量
+        :param k: 返回数量
+        :param exact: 是否强制精确检索（忽略 ANN 索引）
+        :return: (条目下标, 相似度) 列表，按相似度降序
+        """
+        if not len(self.entries):
+            return []
+        if query.shape[0] != self.dimension:
+            raise ValueError("向量长度必须相同")
+        if self.ann is not None and not exact:
+            return self.ann.search(self.matrix, query, k)
+        scores = self.matrix @ query
+        return [(int(i), float(scores[i])) for i in top_k(scores, k)]
+
+
+class QAVectorIndex:
+    """
+    问答知识库向量索引
+
+    首次使用时加载知识库，按 group_uuid 构建归一化矩阵常驻内存；文件修改后自动重新加载，
+    且两次 mtime 检查之间至少间隔 check_interval 秒。知识库可以是 QAsql.json，
+    也可以是 .npy 二进制向量存储（内存映射加载，见 vector_store）。
+    开启 ANN 后，条目数不少于 ANN_MIN_GROUP_SIZE 的组使用 IVF 索引（见 ann_index），索引文件保存在知识库旁。
+    """
+
+    def __init__(self, file_path: str, check_interval: float = 1.0, ann_enabled: Optional[bool] = None):
+        self.file_path = file_path
+        self.check_interval = check_interval
+        self.ann_enabled = settings.ANN_ENABLED if ann_enabled is None else ann_enabled
+        self.groups: Dict[str, GroupIndex] = {}
+        self._mtime: Optional[float] = None
+        self._checked_at = float("-inf")
+        self._lock = threading.Lock()
+        self._reloading = False
+        self._stats = {
+            "loads": 0, "load_seconds": 0.0, "searches": 0, "search_seconds": 0.0,
+            "lexical_searches": 0, "lexical_search_seconds": 0.0
+        }
+
+    @property
+    def is_binary_store(self) -> bool:
+        """知识库是否为二进制向量存储"""
+        return self.file_path.endswith(".npy")
+
+    def _watched_path(self) -> str:
+        """用于判断是否需要重新加载的文件，二进制存储以最后写入的元数据文件为准"""
+        if self.is_binary_store:
+            from agents_system.utils.vector_store import store_paths
+            return store_paths(self.file_path)[1]
+        return self.file_path
+
+    def refresh(self) -> bool:
+        """
+        文件修改时重新加载：首次加载同步执行（服务启动时已在线程中预加载），
+        之后的重新加载在后台线程执行，完成前继续使用旧索引，不阻塞检索请求
+
+        :return: 是否同步完成了加载
+        """
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return False
+        with self._lock:
+            first_check = self._checked_at == float("-inf")
+            self._checked_at = now
+            watched_path = self._watched_path()
+            if not os.path.exists(watched_path):
+                if first_check:
+                    logger.warning(f"知识库文件 {watched_path} 不存在")
+                return False
+            mtime = os.stat(watched_path).st_mtime
+            if mtime == self._mtime or self._reloading:
+                return False
+            if self._mtime is not None:
+                self._reloading = True
+                threading.Thread(target=self._reload, args=(mtime,), name="qa-index-reload", daemon=True).start()
+                return False
+            self.load()
+            self._mtime = mtime
+            return True
+
+    def _reload(self, mtime: float) -> None:
+        """后台线程中重新加载，失败时保留旧索引，下次检查时重试"""
+        try:
+            self.load()
+            self._mtime = mtime
+        except Exception as e:
+            logger.error(f"重新加载知识库失败，继续使用旧索引: {str(e)}")
+        finally:
+            self._reloading = False
+
+    def load(self) -> None:
+        """加载知识库并构建全部分组索引"""
+        start_time = time.perf_counter()
+        if self.is_binary_store:
+            from agents_system.utils.vector_store import load_store
+            groups = load_store(self.file_path)
+        else:
+            groups = self._load_json()
+        self.prepare(groups)
+
+        # 整体替换，检索中的请求继续使用旧索引
+        self.groups = groups
+        elapsed = time.perf_counter() - start_time
+        self._stats["loads"] += 1
+        self._stats["load_seconds"] += elapsed
+        logger.info(f"Loaded QA index from {self.file_path}: {len(groups)} groups in {elapsed * 1000:.1f}ms")
+
+    def prepare(self, groups: Dict[str, GroupIndex]) -> None:
+        """
+        构建替换前的派生索引（ANN 与 BM25），在加载线程中执行，避免首次检索时在事件循环中构建
+
+        :param groups: 新的分组索引
+        """
+        if self.ann_enabled:
+            self._attach_ann(groups)
+        for group in groups.values():
+            _ = group.lexical  # 访问即构建
+
+    def _attach_ann(self, groups: Dict[str, GroupIndex]) -> None:
+        """为大组挂载 ANN 索引，失败时保持精确检索"""
+        from agents_system.utils.ann_index import ann_index_path, attach_ann_indexes
+        try:
+            attach_ann_indexes(
+                groups,
+                index_path=ann_index_path(self.file_path),
+                source_mtime=os.stat(self._watched_path()).st_mtime,
+                min_group_size=settings.ANN_MIN_GROUP_SIZE,
+                nlist=settings.ANN_NLIST,
+                nprobe=settings.ANN_NPROBE,
+                iterations=settings.ANN_TRAIN_ITERATIONS
+            )
+        except Exception as e:
+            logger.error(f"构建ANN索引失败，使用精确检索: {str(e)}")
+
+    def _load_json(self) -> Dict[str, GroupIndex]:
+        """解析 JSON 知识库"""
+        with open(self.file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        groups: Dict[str, GroupIndex] = {}
+        for group in data:
+            vectors, entries = [], []
+            dimension = None
+            for entry in group.get("entries", []):
+                vector = entry.get("vector")
+                if not vector or (dimension is not None and len(vector) != dimension):
+                    logger.warning(f"跳过向量无效的句子: {entry.get('question', '未知')}")
+                    continue
+                dimension = len(vector)
+                vectors.append(vector)
+                entries.append({key: value for key, value in entry.items() if key != "vector"})
+            groups[group.get("group_uuid")] = GroupIndex(np.asarray(vectors, dtype=np.float32), entries)
+        return groups
+
+    def search(self, group_uuid: str, query_vector: Sequence[float], top_n: int = 5) -> List[Dict[str, Any]]:
+        """
+        在指定组内检索最相似的问答
+
+        :param group_uuid: 问答组ID
+        :param query_vector: 查询向量
+        :param top_n: 返回数量
+        :return: 条目列表（含 similarity 字段），按相似度降序；组不存在时返回空列表
+        """
+        self.refresh()
+        group = self.groups.get(group_uuid)
+        if group is None:
+            logger.warning(f"未找到group_uuid为{group_uuid}的句子组")
+            return []
+
+        start_time = time.perf_counter()
+        hits = group.search(normalize_vector(query_vector), top_n)
+        self._stats["searches"] += 1
+        self._stats["search_seconds"] += time.perf_counter() - start_time
+        return [{**group.entries[i], "similarity": score} for i, score in hits]
+
+    def lexical_search(self, group_uuid: str, query: str, top_n: int = 5) -> List[Dict[str, Any]]:
+        """
+        在指定组内按问题文本做 BM25 检索
+
+        :param group_uuid: 问答组ID
+        :param query: 查询文本
+        :param top_n: 返回数量
+        :return: 条目列表（含 bm25 与 lexical_score 字段），按 BM25 分数降序；组不存在时返回空列表
+        """
+        self.refresh()
+        group = self.groups.get(group_uuid)
+        if group is None:
+            logger.warning(f"未找到group_uuid为{group_uuid}的句子组")
+            return []
+
+        start_time = time.perf_counter()
+        hits = group.lexical.search(query, top_n)
+        self._stats["lexical_searches"] += 1
+        self._stats["lexical_search_seconds"] += time.perf_counter() - start_time
+        return [{**group.entries[i], "bm25": score, "lexical_score": match} for i, score, match in hits]
+
+    def stats(self) -> Dict[str, Any]:
+        """获取加载与检索耗时统计"""
+        searches = self._stats["searches"]
+        lexical_searches = self._stats["lexical_searches"]
+        return {
+            **self._stats,
+            "groups": {group_uuid: len(group) for group_uuid, group in self.groups.items()},
+            "ann_groups": [group_uuid for group_uuid, group in self.groups.items() if group.ann is not None],
+            "avg_search_us": self._stats["search_seconds"] * 1e6 / searches if searches else 0.0,
+            "avg_lexical_search_us": (
+                self._stats["lexical_search_seconds"] * 1e6 / lexical_searches if lexical_searches else 0.0
+            )
+        }
+
+
+_indexes: Dict[str, QAVectorIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_qa_index(file_path: str) -> QAVectorIndex:
+    """
+    获取知识库文件对应的索引实例（进程内共享）
+
+    :param file_path: 知识库文件路径
+    :return: 索引实例
+    """
+    index = _indexes.get(file_path)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.setdefault(file_path, QAVectorIndex(file_path))
+    return index
@@ -0,0 +1,176 @@
+import argparse
+import json
+import os
+import time
+from typing import Any, Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from agents_system.config.settings import settings
+from agents_system.utils.logger import get_logger
+from agents_system.utils.vector_index import GroupIndex, normalize_rows
+
+
+logger = get_logger(__name__)
+
+STORE_VERSION = 1
+
+
+def store_paths(base_path: str) -> Tuple[str, str]:
+    """
+    获取向量存储的矩阵文件与元数据文件路径
+
+    :param base_path: 存储路径（可带或不带 .npy 后缀）
+    :return: (矩阵文件路径, 元数据文件路径)
+    """
+    base = base_path[:-4] if base_path.endswith(".npy") else base_path
+    return f"{base}.npy", f"{base}.meta.json"
+
+
+def write_store(base_path: str, groups: Iterable[Tuple[str, np.ndarray, List[Dict[str, Any]]]]) -> Dict[str, Any]:
+    """
+    写入二进制向量存储
+
+    矩阵文件为 L2 归一化的 float32 (N, D) .npy，同组条目连续存放；元数据文件记录各组的行区间与问答内容。
+    两个文件先写临时文件再原子替换，已映射旧文件的进程不受影响。
+
+    :param base_path: 存储路径
+    :param groups: (group_uuid, 向量矩阵, 条目元数据) 序列
+    :return: 元数据
+    """
+    matrix_path, meta_path = store_paths(base_path)
+    store_dir = os.path.dirname(matrix_path)
+    if store_dir and not os.path.exists(store_dir):
+        os.makedirs(store_dir)
+
+    blocks, entries = [], []
+    meta: Dict[str, Any] = {"version": STORE_VERSION, "normalized": True, "dimension": 0, "groups": {}}
+    for group_uuid, vectors, group_entries in groups:
+        if not group_entries:
+            continue
+        vectors = normalize_rows(vectors)
+        if meta["dimension"] and vectors.shape[1] != meta["dimension"]:
+            raise ValueError(f"向量维度不一致: {group_uuid}")
+        meta["dimension"] = vectors.shape[1]
+        meta["groups"][group_uuid] = [len(entries), len(entries) + len(group_entries)]
+        blocks.append(vectors)
+        entries.extend(group_entries)
+    meta["count"] = len(entries)
+    meta["entries"] = entries
+
+    matrix = np.vstack(blocks) if blocks else np.zeros((0, 0), dtype=np.float32)
+    with open(matrix_path + ".tmp", "wb") as f:
+        np.save(f, matrix.astype(np.float32, copy=False))
+    with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    # 先替换矩阵再替换元数据，读取方以元数据的 mtime 判断是否重新加载
+    os.replace(matrix_path + ".tmp", matrix_path)
+    os.replace(meta_path + ".tmp", meta_path)
+    logger.info(f"Wrote vector store {matrix_path}: {len(entries)} entries, {len(meta['groups'])} groups")
+    return meta
+
+
+def load_store(base_path: str) -> Dict[str, GroupIndex]:
+    """
+    以内存映射方式加载二进制向量存储
+
+    矩阵只读映射，不复制到进程堆内存；多个 worker 通过页缓存共享同一份物理内存。
+
+    :param base_path: 存储路径
+    :return: group_uuid 到分组索引的映射
+    """
+    matrix_path, meta_path = store_paths(base_path)
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("version") != STORE_VERSION:
+        raise ValueError(f"不支持的向量存储版本: {meta.get('version')}")
+    matrix = np.load(matrix_path, mmap_mode="r")
+    if matrix.shape[0] != meta["count"]:
+        raise ValueError("向量存储矩阵与元数据条目数不一致")
+
+    entries = meta["entries"]
+    return {
+        group_uuid: GroupIndex.from_normalized(matrix[start:end], entries[start:end])
+        for group_uuid, (start, end) in meta["groups"].items()
+    }
+
+
+def groups_from_json(file_path: str) -> Iterable[Tuple[str, np.ndarray, List[Dict[str, Any]]]]:
+    """
+    从 QAsql.json 读取分组向量
+
+    :param file_path: JSON 文件路径
+    :return: (group_uuid, 向量矩阵, 条目元数据) 序列
+    """
+    with open(file_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    for group in data:
+        vectors, entries = [], []
+        for entry in group.get("entries", []):
+            if not entry.get("vector"):
+                continue
+            vectors.append(entry["vector"])
+            entries.append({key: value for key, value in entry.items() if key != "vector"})
+        yield group.get("group_uuid"), np.asarray(vectors, dtype=np.float32), entries
+
+
+def groups_from_mysql() -> Iterable[Tuple[str, np.ndarray, List[Dict[str, Any]]]]:
+    """
+    从 MySQL sentence_vector 表读取分组向量（vector 列为 JSON 文本）
+
+    :return: (group_uuid, 向量矩阵, 条目元数据) 序列
+    """
+    import mysql.connector
+
+    conn = mysql.connector.connect(
+        host=settings.DB_HOST,
+        user=settings.DB_USER,
+        password=settings.DB_PASSWORD,
+        database=settings.DB_NAME,
+        charset="utf8mb4"
+    )
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(
+            "SELECT id, group_uuid, question, answer, vector, create_time "
+            "FROM sentence_vector ORDER BY group_uuid, id"
+        )
+        current_group, vectors, entries = None, [], []
+        for row in cursor:
+            if row["group_uuid"] != current_group:
+                if entries:
+                    yield current_group, np.asarray(vectors, dtype=np.float32), entries
+                current_group, vectors, entries = row["group_uuid"], [], []
+            vectors.append(json.loads(row["vector"]))
+            entries.append({
+                "id": row["id"],
+                "question": row["question"],
+                "answer": row["answer"],
+                "create_time": str(row["create_time"])
+            })
+        if entries:
+            yield current_group, np.asarray(vectors, dtype=np.float32), entries
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="将问答知识库转换为内存映射向量存储（.npy + .meta.json）")
+    subparsers = parser.add_subparsers(dest="source", required=True)
+    json_parser = subparsers.add_parser("from-json", help="从 QAsql.json 转换")
+    json_parser.add_argument("json_path", help="QAsql.json 路径")
+    json_parser.add_argument("output", help="输出路径（不含后缀）")
+    mysql_parser = subparsers.add_parser("from-mysql", help="从 MySQL sentence_vector 表转换（使用 DB_* 配置）")
+    mysql_parser.add_argument("output", help="输出路径（不含后缀）")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    source = groups_from_json(args.json_path) if args.source == "from-json" else groups_from_mysql()
+    meta = write_store(args.output, source)
+    print(json.dumps({
+        "output": store_paths(args.output),
+        "entries": meta["count"],
+        "groups": len(meta["groups"]),
+        "dimension": meta["dimension"],
+        "seconds": round(time.perf_counter() - start_time, 3)
+    }, ensure_ascii=False, indent=2))
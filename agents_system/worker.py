@@ -0,0 +1,133 @@
+import argparse
+import asyncio
+import os
+import signal
+import sys
+from typing import Any, Dict, Optional
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from agents_system.config.settings import settings
+from agents_system.core.batch_jobs import RecordProcessor
+from agents_system.core.record_store import close_record_store
+from agents_system.core.registry import registry
+from agents_system.core.task_queue import RESULTS, TASKS, TaskBroker, create_task_broker
+from agents_system.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class BatchWorker:
+    """
+    批量任务工作进程
+
+    从任务队列取出单条对话任务，调用对应智能体处理后把结果发布到结果队列并确认消息；
+    处理失败时延迟重新发布（attempts + 1），超过 max_retries 次后发布失败结果并转入死信队列。
+    多个工作进程（容器）消费同一任务队列即可水平扩展，与交互服务的进程和连接池互不影响。
+    """
+
+    def __init__(self, broker: TaskBroker, processors: Dict[str, RecordProcessor], concurrency: Optional[int] = None,
+                 max_retries: Optional[int] = None, retry_delay_ms: Optional[int] = None, poll_interval: float = 0.2):
+        self.broker = broker
+        self.processors = processors
+        self.concurrency = concurrency or settings.TASK_WORKER_CONCURRENCY
+        self.max_retries = settings.TASK_MAX_RETRIES if max_retries is None else max_retries
+        self.retry_delay_ms = settings.TASK_RETRY_DELAY_MS if retry_delay_ms is None else retry_delay_ms
+        self.poll_interval = poll_interval
+        self.stats = {"processed": 0, "retried": 0, "dead_lettered": 0}
+        self._stopping = asyncio.Event()
+
+    def stop(self) -> None:
+        """停止取新任务，等待处理中的任务完成"""
+        self._stopping.set()
+
+    async def run(self) -> None:
+        """持续消费任务队列，同时处理的任务数不超过 concurrency"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+        logger.info(f"Batch worker started, concurrency {self.concurrency}")
+        while not self._stopping.is_set():
+            await semaphore.acquire()
+            delivery = await asyncio.to_thread(self.broker.get, TASKS)
+            if delivery is None:
+                semaphore.release()
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            task = asyncio.create_task(self._handle(*delivery))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            task.add_done_callback(lambda _: semaphore.release())
+        await asyncio.gather(*tasks, return_exceptions=True)
+        logger.info(f"Batch worker stopped: {self.stats}")
+
+    async def _handle(self, delivery_tag: Any, message: Dict[str, Any]) -> None:
+        """
+        处理单条任务消息
+
+        :param delivery_tag: 投递标签
+        :param message: {"job_id", "index", "task", "record", "attempts"}
+        """
+        result = {"job_id": message.get("job_id"), "index": message.get("index")}
+        try:
+            processor = self.processors[message["task"]]
+            output = await processor(message["record"])
+        except Exception as e:
+            attempts = message.get("attempts", 0) + 1
+            if attempts <= self.max_retries:
+                logger.warning(f"任务 {result} 第 {attempts} 次处理失败，{self.retry_delay_ms}ms 后重试: {str(e)}")
+                await asyncio.to_thread(
+                    self.broker.publish, TASKS, {**message, "attempts": attempts}, self.retry_delay_ms * attempts
+                )
+                await asyncio.to_thread(self.broker.ack, delivery_tag)
+                self.stats["retried"] += 1
+            else:
+                logger.error(f"任务 {result} 超过重试次数，转入死信队列: {str(e)}")
+                await asyncio.to_thread(
+                    self.broker.publish, RESULTS, {**result, "status": "failed", "output": {"error": str(e)[:200]}}
+                )
+                await asyncio.to_thread(self.broker.dead_letter, delivery_tag)
+                self.stats["dead_lettered"] += 1
+            return
+
+        # 先发布结果再确认，进程在两者之间退出时任务会被重新投递（收集方按记录覆盖写入，重复结果无副作用）
+        await asyncio.to_thread(self.broker.publish, RESULTS, {**result, "status": "done", "output": output})
+        await asyncio.to_thread(self.broker.ack, delivery_tag)
+        self.stats["processed"] += 1
+
+
+def create_processors() -> Dict[str, RecordProcessor]:
+    """创建批量任务处理函数（与API进程的批量任务类型一致）"""
+    from agents_system.agents.jianlian_agent.conversation_processor_agent import ConversationProcessorAgent
+    from agents_system.agents.jianlian_agent.rebate_identification_agent import RebateIdentificationAgent
+
+    rebate_identification_agent = RebateIdentificationAgent()
+    conversation_processor_agent = ConversationProcessorAgent()
+    return {
+        "rebate-identification": lambda record: rebate_identification_agent.process_record(record, raise_errors=True),
+        "conversation-process": lambda record: conversation_processor_agent.process_record(record, raise_errors=True)
+    }
+
+
+async def main(concurrency: Optional[int] = None) -> None:
+    broker = create_task_broker()
+    worker = BatchWorker(broker, create_processors(), concurrency=concurrency)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+    try:
+        await worker.run()
+    finally:
+        close_record_store()
+        await registry.close_model()
+        broker.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量任务工作进程（消费 TASK_QUEUE_PREFIX.tasks 队列）")
+    parser.add_argument("--concurrency", type=int, default=None, help="同时处理的任务数，默认 TASK_WORKER_CONCURRENCY")
+    args = parser.parse_args()
+    asyncio.run(main(args.concurrency))